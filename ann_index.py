@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+IVF-flat approximate nearest-neighbour index cho embedding ECAPA (192-d).
+
+Embedding được chia vào nlist cụm (spherical k-means). Khi tìm kiếm chỉ so sánh với
+các embedding thuộc nprobe cụm gần probe nhất: nprobe càng lớn recall càng cao,
+nprobe = nlist tương đương exact search. Khoảng cách trả về vẫn là cosine distance
+chính xác nên ngưỡng của identify_speaker giữ nguyên ý nghĩa.
+
+Benchmark recall/latency so với exact search:
+    python ann_index.py --size 200000 --nlist 1024 --nprobe 8 16 32
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from speaker_index import SpeakerIndex
+
+
+def spherical_kmeans(data: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """K-means trên vector đã chuẩn hóa, trả về k centroid đã chuẩn hóa."""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = _nearest(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # cụm rỗng: lấy ngẫu nhiên điểm dữ liệu khác làm centroid
+            sums[empty] = data[rng.choice(len(data), size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+def _nearest(data: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    out = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), chunk):
+        out[start:start + chunk] = np.argmax(data[start:start + chunk] @ centroids.T, axis=1)
+    return out
+
+
+class IVFFlatIndex(SpeakerIndex):
+    """
+    - nlist: số cụm
+    - nprobe: số cụm được quét mỗi lần search (núm chỉnh recall/latency)
+    - train_min: chưa đủ số embedding này thì search exact
+    Mỗi cụm giữ 1 inverted list (mảng số dòng trong ma trận), search chỉ ghép các list
+    của nprobe cụm gần nhất, không quét toàn bộ N dòng. Ma trận float32 vẫn là nơi duy
+    nhất chứa vector (list chỉ thêm 4 byte / dòng).
+    Tự train lại trên thread nền khi số embedding tăng gấp retrain_factor lần so với lúc
+    train; trong lúc đó search dùng các cụm cũ.
+    """
+    kind = "ivf"
+
+    def __init__(self,
+                 dim: int = 192,
+                 capacity: int = 1024,
+                 nlist: int = 256,
+                 nprobe: int = 16,
+                 train_min: int = None,
+                 retrain_factor: float = 4.0,
+                 kmeans_sample: int = 100000,
+                 background: bool = True):
+        super().__init__(dim=dim, capacity=capacity)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_min = train_min if train_min is not None else nlist * 39
+        self.retrain_factor = retrain_factor
+        self.kmeans_sample = kmeans_sample
+        self.background = background
+        self.centroids = None
+        self._trained_size = 0
+        self._assign = np.full(capacity, -1, dtype=np.int32)  # dòng → cụm (-1: chưa gán)
+        self._slot = np.zeros(capacity, dtype=np.int32)       # dòng → vị trí trong list
+        self._lists = []
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._training = False
+        self._changed = None  # dòng thay đổi trong lúc đang train
+
+    # ----------------------------------------------------------- inverted lists
+    def _list_add(self, pos: int, cluster: int) -> None:
+        ids = self._lists[cluster]
+        count = self._counts[cluster]
+        if count == ids.shape[0]:
+            grown = np.empty(max(16, 2 * count), dtype=np.int32)
+            grown[:count] = ids
+            ids = self._lists[cluster] = grown
+        ids[count] = pos
+        self._slot[pos] = count
+        self._counts[cluster] = count + 1
+        self._assign[pos] = cluster
+
+    def _list_remove(self, pos: int) -> None:
+        cluster = self._assign[pos]
+        if cluster < 0:
+            return
+        ids = self._lists[cluster]
+        last = self._counts[cluster] - 1
+        moved = ids[last]
+        ids[self._slot[pos]] = moved
+        self._slot[moved] = self._slot[pos]
+        self._counts[cluster] = last
+        self._assign[pos] = -1
+
+    def _rebuild_lists(self, assign: np.ndarray) -> None:
+        n = assign.shape[0]
+        order = np.argsort(assign, kind="stable").astype(np.int32)
+        counts = np.bincount(assign, minlength=self.nlist)
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        self._lists = []
+        for c in range(self.nlist):
+            ids = np.empty(max(16, int(counts[c] * 1.25)), dtype=np.int32)
+            ids[:counts[c]] = order[bounds[c]:bounds[c + 1]]
+            self._lists.append(ids)
+        self._counts = counts.astype(np.int64)
+        self._assign[:] = -1
+        self._assign[:n] = assign
+        self._slot[order] = np.arange(n, dtype=np.int32) - bounds[assign[order]].astype(np.int32)
+
+    # ------------------------------------------------------------------ train
+    def train(self, chunk: int = 65536) -> None:
+        """
+        k-means trên (mẫu của) embedding hiện có rồi gán lại toàn bộ cụm. Chỉ giữ lock
+        từng đoạn ngắn (lấy mẫu, gán từng chunk dòng, dựng lại list) nên add/search vẫn
+        chạy được trong lúc train.
+        """
+        with self._lock:
+            n = len(self._ids)
+            if n < self.nlist:
+                self._training = False
+                return
+            if n > self.kmeans_sample:
+                rng = np.random.default_rng(0)
+                data = self._matrix[np.sort(rng.choice(n, size=self.kmeans_sample, replace=False))]
+            else:
+                data = self._matrix[:n].copy()
+            self._changed = set()
+        try:
+            centroids = spherical_kmeans(data, self.nlist)
+            assign = np.empty(n, dtype=np.int32)
+            for start in range(0, n, chunk):
+                with self._lock:
+                    end = min(start + chunk, n, len(self._ids))
+                    if end > start:
+                        assign[start:end] = _nearest(self._matrix[start:end], centroids)
+            with self._lock:
+                m = len(self._ids)
+                full = np.empty(m, dtype=np.int32)
+                full[:min(n, m)] = assign[:min(n, m)]
+                # dòng thêm / sửa / bị dời chỗ sau khi bắt đầu train
+                redo = sorted(p for p in self._changed if p < m) + list(range(n, m))
+                if redo:
+                    full[redo] = _nearest(self._matrix[redo], centroids)
+                self.centroids = centroids
+                self._rebuild_lists(full)
+                self._trained_size = m
+                self.version += 1
+        finally:
+            with self._lock:
+                self._changed = None
+                self._training = False
+
+    def _maybe_train(self) -> None:
+        n = len(self._ids)
+        due = n >= self.train_min if self.centroids is None else n >= self._trained_size * self.retrain_factor
+        if not due or self._training:
+            return
+        self._training = True
+        if self.background:
+            threading.Thread(target=self.train, name="ivf-train", daemon=True).start()
+        else:
+            self.train()
+
+    # ------------------------------------------------------------------ hooks
+    def _on_add(self, pos: int) -> None:
+        capacity = self._matrix.shape[0]
+        if self._assign.shape[0] < capacity:
+            assign = np.full(capacity, -1, dtype=np.int32)
+            assign[:self._assign.shape[0]] = self._assign
+            self._assign = assign
+            slot = np.zeros(capacity, dtype=np.int32)
+            slot[:self._slot.shape[0]] = self._slot
+            self._slot = slot
+        if self._changed is not None:
+            self._changed.add(pos)
+        if self.centroids is not None:
+            cluster = int(np.argmax(self.centroids @ self._matrix[pos]))
+            if cluster != self._assign[pos]:
+                self._list_remove(pos)
+                self._list_add(pos, cluster)
+        self._maybe_train()
+
+    def _on_move(self, src: int, dst: int) -> None:
+        # dst là dòng bị xóa, dòng src (cuối ma trận) được chuyển vào chỗ của nó
+        if self._changed is not None:
+            self._changed.add(dst)
+        self._list_remove(dst)
+        if src == dst:
+            return
+        cluster = self._assign[src]
+        if cluster >= 0:
+            self._lists[cluster][self._slot[src]] = dst
+            self._slot[dst] = self._slot[src]
+            self._assign[dst] = cluster
+            self._assign[src] = -1
+
+    def _candidates(self, probe: np.ndarray):
+        if self.centroids is None or self.nprobe >= self.nlist:
+            return None
+        lists = np.argpartition(-(self.centroids @ probe), self.nprobe - 1)[:self.nprobe]
+        return np.concatenate([self._lists[c][:self._counts[c]] for c in lists])
+
+    def _state(self) -> dict:
+        state = super()._state()
+        state["nlist"] = np.array(self.nlist)
+        state["nprobe"] = np.array(self.nprobe)
+        if self.centroids is not None:
+            state["centroids"] = self.centroids
+            state["trained_size"] = np.array(self._trained_size)
+        return state
+
+    def _restore(self, state) -> None:
+        self.nlist = int(state["nlist"])
+        self.nprobe = int(state["nprobe"])
+        if "centroids" in state:
+            self.centroids = state["centroids"].astype(np.float32)
+            self._lists = [np.empty(16, dtype=np.int32) for _ in range(self.nlist)]
+            self._counts = np.zeros(self.nlist, dtype=np.int64)
+            self._trained_size = int(state["trained_size"])
+        super()._restore(state)
+
+
+def benchmark(size: int, nlist: int, nprobes: list, queries: int = 500, k: int = 1,
+              dim: int = 192, speakers: int = None, seed: int = 0) -> None:
+    """
+    Sinh embedding tổng hợp dạng cụm (mỗi speaker = 1 vector gốc + nhiễu),
+    đo recall@k và latency của IVF so với exact search.
+    """
+    rng = np.random.default_rng(seed)
+    speakers = speakers or max(1, size // 50)
+    centers = rng.standard_normal((speakers, dim)).astype(np.float32)
+    labels = rng.integers(0, speakers, size=size)
+    data = centers[labels] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+    probe_ids = rng.choice(size, size=queries, replace=False)
+    probes = data[probe_ids] + 0.3 * rng.standard_normal((queries, dim)).astype(np.float32)
+
+    exact = SpeakerIndex(dim=dim, capacity=size)
+    ivf = IVFFlatIndex(dim=dim, capacity=size, nlist=nlist, train_min=size + 1, background=False)
+    t0 = time.perf_counter()
+    for i, emb in enumerate(data):
+        exact.add(str(i), None, None, emb)
+        ivf.add(str(i), None, None, emb)
+    print(f"Build {size} x {dim}: {time.perf_counter() - t0:.1f}s")
+    t0 = time.perf_counter()
+    ivf.train()
+    print(f"Train nlist={nlist}: {time.perf_counter() - t0:.1f}s")
+
+    t0 = time.perf_counter()
+    truth = [[r[0] for r in exact.search(p, k)] for p in probes]
+    exact_ms = (time.perf_counter() - t0) / queries * 1000
+    print(f"exact        : recall@{k}=1.000  {exact_ms:.3f} ms/query")
+
+    for nprobe in nprobes:
+        ivf.nprobe = nprobe
+        t0 = time.perf_counter()
+        found = [[r[0] for r in ivf.search(p, k)] for p in probes]
+        ivf_ms = (time.perf_counter() - t0) / queries * 1000
+        hits = sum(len(set(a) & set(b)) for a, b in zip(truth, found))
+        print(f"ivf nprobe={nprobe:<4}: recall@{k}={hits / (queries * k):.3f}  {ivf_ms:.3f} ms/query")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IVF-flat speaker index benchmark")
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=1)
+    args = parser.parse_args()
+    benchmark(args.size, args.nlist, args.nprobe, queries=args.queries, k=args.k)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Front-end asyncio (Starlette + uvicorn) của API xác thực giọng nói — entry point production.
+
+Cùng các route với http_server.py. /verify-voice chờ kết quả đối phương bằng
+result_broker.wait_async nên mỗi request đang chờ chỉ tốn 1 coroutine, không giữ thread;
+giải mã audio và các thao tác đọc DB chạy trong threadpool, inference chạy trong inference_pool.
+FastAGI server (fastagi_server.py) chạy trên cùng event loop, FASTAGI_HOST:FASTAGI_PORT
+(mặc định 127.0.0.1:4573, port 0 = tắt): Asterisk gửi trạng thái cuộc gọi thẳng vào call registry.
+MEDIA_RTP_PORT / MEDIA_AUDIOSOCKET_PORT (mặc định 0 = tắt): nhận audio cuộc gọi trực tiếp
+(media_ingest.py), kết quả mỗi leg đi qua result_broker và DB như /verify-voice.
+
+    python asgi_server.py                      # 0.0.0.0:5000
+    uvicorn asgi_server:app --port 5000        # chỉ 1 worker: state nằm trong process
+"""
+import contextlib
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+import g711
+import media_ingest
+import voice_service
+from fastagi_server import FastAGIServer
+from voice_service import ApiError, result_broker
+
+FASTAGI_PORT = int(os.environ.get("FASTAGI_PORT", 4573))
+FASTAGI_HOST = os.environ.get("FASTAGI_HOST", "127.0.0.1")
+MEDIA_HOST = os.environ.get("MEDIA_HOST", "127.0.0.1")
+MEDIA_RTP_PORT = int(os.environ.get("MEDIA_RTP_PORT", 0))
+MEDIA_AUDIOSOCKET_PORT = int(os.environ.get("MEDIA_AUDIOSOCKET_PORT", 0))
+MEDIA_WORKERS = int(os.environ.get("MEDIA_WORKERS", 2))
+
+
+def error_response(e):
+    return JSONResponse(e.payload, status_code=e.status, headers=e.headers)
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def read_voices(form):
+    return [await voice.read() for voice in form.getlist("voice") if hasattr(voice, "read")]
+
+
+async def register(request):
+    form = await request.form()
+    # 1 hoặc nhiều file "voice": mỗi bản ghi là 1 embedding enrollment
+    data = await read_voices(form)
+    try:
+        user_id = await run_in_threadpool(
+            voice_service.register_user,
+            form.get("phone"), form.get("password"), form.get("fullname"), data)
+    except ApiError as e:
+        return error_response(e)
+    return JSONResponse({"success": True, "user_id": user_id})
+
+
+async def enroll(request):
+    form = await request.form()
+    data = await read_voices(form)
+    try:
+        count = await run_in_threadpool(
+            voice_service.enroll_voice, form.get("phone"), form.get("password"), data)
+    except ApiError as e:
+        return error_response(e)
+    return JSONResponse({"success": True, "utterances": count})
+
+
+async def login(request):
+    data = await read_json(request) or {}
+    try:
+        return JSONResponse(await run_in_threadpool(
+            voice_service.login_user, data.get("phone"), data.get("password")))
+    except ApiError as e:
+        return error_response(e)
+
+
+async def save_call_status(request):
+    if request.method == "GET":
+        data = request.query_params
+    else:
+        data = await read_json(request) or await request.form()
+    caller = data.get("caller")
+    callee = data.get("callee")
+    status = data.get("status")
+
+    if not all([caller, callee, status]):
+        return PlainTextResponse("Thiếu tham số", status_code=400)
+
+    try:
+        await voice_service.update_call_status_async(caller, callee, status)
+        return PlainTextResponse("OK")
+    except Exception as e:
+        return PlainTextResponse(f"Lỗi: {str(e)}", status_code=500)
+
+
+async def verify_voice(request):
+    form = await request.form()
+    user_id = form.get("user_id")
+    voice = form.get("voice")
+
+    if not user_id or voice is None or not hasattr(voice, "read"):
+        return JSONResponse({"success": False, "error": "Thiếu thông tin"}, status_code=400)
+
+    try:
+        # cache miss của call registry đọc SQLite: không chạy trên event loop
+        call_id, opponent_id = await run_in_threadpool(voice_service.resolve_call, user_id)
+        clip = await run_in_threadpool(voice_service.decode_voice, await voice.read())
+        # MODEL_LOADING=lazy: request đầu tiên nạp model, không được chặn event loop
+        await run_in_threadpool(voice_service.submit_verification, clip, user_id, call_id, opponent_id)
+    except ApiError as e:
+        return error_response(e)
+
+    # Chờ kết quả của đối phương mà không giữ thread
+    result = await result_broker.wait_async(call_id, opponent_id, timeout=voice_service.VERIFY_TIMEOUT)
+    if result is None:
+        result = await run_in_threadpool(voice_service.fetch_stored_result, call_id, opponent_id)
+
+    payload, code = voice_service.verification_response(result)
+    return JSONResponse(payload, status_code=code)
+
+
+async def warmup(request):
+    try:
+        return JSONResponse({"success": True, **await run_in_threadpool(voice_service.warmup)})
+    except ApiError as e:
+        return error_response(e)
+
+
+async def metrics(request):
+    payload = voice_service.metrics()
+    if getattr(request.app.state, "fastagi", None) is not None:
+        payload["fastagi"] = request.app.state.fastagi.metrics()
+    return JSONResponse(payload)
+
+
+async def get_user_status(request):
+    data = await read_json(request)
+    if not data:
+        return JSONResponse({"success": False, "error": "Invalid JSON"}, status_code=400)
+
+    user_id = data.get("user_id")
+    if not user_id:
+        return JSONResponse({"success": False, "error": "Missing user_id"}, status_code=400)
+
+    try:
+        status = await run_in_threadpool(voice_service.user_status, user_id)
+    except ApiError as e:
+        return error_response(e)
+    except sqlite3.OperationalError as e:
+        return JSONResponse({
+            "success": False,
+            "error": f"Database error: {str(e)}",
+            "solution": "Please ensure the call_status table exists"
+        }, status_code=500)
+    except Exception as e:
+        return JSONResponse({
+            "success": False,
+            "error": f"Internal server error: {str(e)}"
+        }, status_code=500)
+
+    return JSONResponse({"success": True, "status": status})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    app.state.fastagi = None
+    if FASTAGI_PORT:
+        # registry cập nhật RAM + đưa vào hàng đợi BatchWriter (không chờ); khi phải giữ
+        # chỗ khối call_id mới trong SQLite thì start_async chờ trong executor, không trên loop
+        app.state.fastagi = FastAGIServer(voice_service.update_call_status_async,
+                                          host=FASTAGI_HOST, port=FASTAGI_PORT)
+        await app.state.fastagi.start()
+    close_media = await start_media_ingest() if MEDIA_RTP_PORT or MEDIA_AUDIOSOCKET_PORT else None
+    yield
+    if close_media is not None:
+        await close_media()
+    if app.state.fastagi is not None:
+        await app.state.fastagi.close()
+
+
+def _identify_leg(clip):
+    return voice_service.identify_speaker(voice_service.get_embedding(clip))
+
+
+async def start_media_ingest():
+    """Audio trực tiếp từ Asterisk; model được nạp trước (không nạp trong callback của loop)."""
+    pool = await run_in_threadpool(voice_service.get_inference_pool)
+    executor = ThreadPoolExecutor(max_workers=MEDIA_WORKERS, thread_name_prefix="ingest")
+    on_event = media_ingest.result_events(voice_service.publish_media_result)
+
+    def factory(session_id):
+        return media_ingest.LegSession(session_id, pool.detector.stream(sample_rate=g711.SAMPLE_RATE),
+                                       executor, on_event=on_event, speaker_fn=_identify_leg)
+
+    close = await media_ingest.start(media_ingest.MediaIngest(factory), MEDIA_HOST,
+                                      MEDIA_RTP_PORT, MEDIA_AUDIOSOCKET_PORT)
+
+    async def close_media():
+        await close()
+        executor.shutdown(wait=False)
+
+    return close_media
+
+
+app = Starlette(
+    routes=[
+        Route("/register", register, methods=["POST"]),
+        Route("/enroll", enroll, methods=["POST"]),
+        Route("/login", login, methods=["POST"]),
+        Route("/save-call-status", save_call_status, methods=["GET", "POST"]),
+        Route("/verify-voice", verify_voice, methods=["POST"]),
+        Route("/warmup", warmup, methods=["GET", "POST"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/status", get_user_status, methods=["POST"]),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app,
+                host=os.environ.get("HOST", "0.0.0.0"),
+                port=int(os.environ.get("PORT", 5000)),
+                limit_concurrency=int(os.environ.get("ASGI_LIMIT_CONCURRENCY", 10000)),
+                backlog=int(os.environ.get("ASGI_BACKLOG", 4096)))
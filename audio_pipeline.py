@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Pipeline tiền xử lý audio dùng chung cho detector (AASIST) và speaker encoder (ECAPA).
+
+decode → mono → resample về 16 kHz (kernel polyphase được cache) → chuẩn hóa riêng
+cho từng nhánh. Mỗi file/upload chỉ được giải mã và resample đúng 1 lần.
+
+Xử lý hàng loạt (bulk_embed.py, bulk_score.py): load_many giải mã song song trên process
+pool với số file đọc trước có giới hạn, bucket_batches gom các file dài gần nhau vào
+cùng batch để giảm padding.
+
+Benchmark từng stage (--legacy: so sánh với đường librosa cũ):
+    python audio_pipeline.py path/to/file.wav --repeat 20 --legacy
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache, partial
+from math import gcd
+
+import numpy as np
+import soundfile as sf
+
+import g711
+
+TARGET_SR = 16000
+
+# Các cặp tần số hay gặp: trunk G.711 8 kHz, file ghi âm 22.05/44.1/48 kHz
+COMMON_RATES = (8000, 22050, 44100, 48000)
+
+# File G.711 thô (không header) do Asterisk ghi ra
+RAW_G711_EXTENSIONS = {
+    ".ul": "ulaw", ".ulaw": "ulaw", ".pcmu": "ulaw",
+    ".al": "alaw", ".alaw": "alaw", ".pcma": "alaw",
+}
+AUDIO_EXTENSIONS = {".wav", ".flac", ".ogg", ".mp3", ".m4a"} | set(RAW_G711_EXTENSIONS)
+
+
+def decode(source, fmt: str = None):
+    """
+    Giải mã bytes / đường dẫn / file-like object.
+    Trả về (wav float32, sample_rate); wav có thể nhiều kênh (shape [n, ch]).
+    fmt="ulaw"/"alaw" cho dữ liệu G.711 thô 8 kHz (tự nhận theo đuôi file).
+    """
+    if fmt is None and isinstance(source, (str, os.PathLike)):
+        fmt = RAW_G711_EXTENSIONS.get(os.path.splitext(str(source))[1].lower())
+    if fmt in ("ulaw", "alaw"):
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as f:
+                source = f.read()
+        elif hasattr(source, "read"):
+            source = source.read()
+        table = g711.decode_ulaw if fmt == "ulaw" else g711.decode_alaw
+        return table(source), g711.SAMPLE_RATE
+
+    # WAV (kể cả WAV μ-law/A-law), FLAC, OGG: libsndfile giải mã trực tiếp
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    try:
+        wav, sr = sf.read(source, dtype='float32', always_2d=False)
+    except Exception:
+        # định dạng libsndfile không hỗ trợ (mp3 cũ, m4a...) → để librosa/audioread xử lý,
+        # không nằm trên đường xử lý chính
+        import librosa
+        if hasattr(source, "seek"):
+            source.seek(0)
+        wav, sr = librosa.load(source, sr=None, mono=False)
+        if wav.ndim == 2:
+            wav = wav.T
+    return wav, sr
+
+
+def to_mono(wav: np.ndarray) -> np.ndarray:
+    if wav.ndim == 2:
+        wav = wav.mean(axis=1)
+    return np.ascontiguousarray(wav, dtype=np.float32)
+
+
+@lru_cache(maxsize=32)
+def resample_kernel(up: int, down: int) -> np.ndarray:
+    """FIR anti-aliasing giống mặc định của scipy.signal.resample_poly, chỉ thiết kế 1 lần."""
+    from scipy.signal import firwin  # scipy.signal chỉ được import khi thật sự cần resample
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    return firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0))
+
+
+def resample(wav: np.ndarray, sr: int, target_sr: int = TARGET_SR) -> np.ndarray:
+    if sr == target_sr:
+        return wav
+    from scipy.signal import resample_poly
+    g = gcd(int(sr), int(target_sr))
+    up, down = target_sr // g, sr // g
+    out = resample_poly(wav, up, down, window=resample_kernel(up, down))
+    return out.astype(np.float32, copy=False)
+
+
+def prewarm_resamplers(target_sr: int = TARGET_SR) -> None:
+    """Thiết kế sẵn kernel cho các tần số phổ biến để request đầu tiên không phải chờ."""
+    for sr in COMMON_RATES:
+        if sr != target_sr:
+            g = gcd(sr, target_sr)
+            resample_kernel(target_sr // g, sr // g)
+
+
+def preemphasis(wav: np.ndarray, coef: float = 1.0) -> np.ndarray:
+    """
+    Giống librosa.effects.preemphasis(wav, coef) (kể cả trạng thái đầu 2*y[0] - y[1])
+    nhưng không đi qua scipy.signal.lfilter.
+    """
+    out = np.empty_like(wav)
+    if len(wav) == 0:
+        return out
+    out[1:] = wav[1:] - coef * wav[:-1]
+    out[0] = 3 * wav[0] - wav[1] if len(wav) > 1 else wav[0]
+    return out
+
+
+def peak_normalize(wav: np.ndarray) -> np.ndarray:
+    """Giống librosa.util.normalize(wav): chia cho biên độ đỉnh."""
+    peak = np.max(np.abs(wav)) if len(wav) else 0.0
+    if peak < np.finfo(wav.dtype).tiny:
+        return wav
+    return wav / peak
+
+
+def for_detector(wav: np.ndarray) -> np.ndarray:
+    """Nhánh AASIST: preemphasis + chuẩn hóa biên độ đỉnh."""
+    return peak_normalize(preemphasis(wav, coef=1.0))
+
+
+def for_encoder(wav: np.ndarray):
+    """Nhánh ECAPA: tensor [1, T]; EncoderClassifier tự chuẩn hóa mean/var."""
+    import torch
+    return torch.from_numpy(wav).unsqueeze(0)
+
+
+class AudioClip:
+    """
+    Audio đã giải mã về mono 16 kHz; input cho từng nhánh được tính khi cần và cache lại.
+    """
+    def __init__(self, wav: np.ndarray, sr: int):
+        self.wav = resample(to_mono(wav), sr)
+        self.sample_rate = TARGET_SR
+        self._detector_input = None
+        self._encoder_input = None
+
+    @property
+    def detector_input(self) -> np.ndarray:
+        if self._detector_input is None:
+            self._detector_input = for_detector(self.wav)
+        return self._detector_input
+
+    @property
+    def encoder_input(self):
+        if self._encoder_input is None:
+            self._encoder_input = for_encoder(self.wav)
+        return self._encoder_input
+
+    @property
+    def duration(self) -> float:
+        return len(self.wav) / self.sample_rate
+
+
+def load(source) -> AudioClip:
+    """decode → mono → 16 kHz."""
+    wav, sr = decode(source)
+    return AudioClip(wav, sr)
+
+
+def list_audio(root: str) -> list:
+    """Đường dẫn mọi file audio trong thư mục root (đệ quy), đã sắp xếp."""
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                paths.append(os.path.join(dirpath, name))
+    paths.sort()
+    return paths
+
+
+def _load_wav(path: str, max_samples: int = None, transform=None):
+    try:
+        wav = load(path).wav
+        if max_samples:
+            wav = wav[:max_samples]
+        return path, transform(wav) if transform else wav, None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def load_many(paths, workers: int = 4, prefetch: int = 4, max_seconds: float = None,
+              transform=None):
+    """
+    Giải mã nhiều file song song, giống DataLoader(num_workers, prefetch_factor): tối đa
+    workers * prefetch file đang giải mã hoặc chờ được lấy ra, nên bộ nhớ không tăng theo
+    số file. Sinh (path, wav 16 kHz, None) hoặc (path, None, lỗi) theo thứ tự xong trước.
+    transform(wav) (hàm cấp module) chạy luôn trong worker, kết quả thay cho wav.
+    """
+    load_one = partial(_load_wav, max_samples=int(max_seconds * TARGET_SR) if max_seconds else None,
+                       transform=transform)
+    if workers <= 0:
+        for path in paths:
+            yield load_one(path)
+        return
+
+    paths = iter(paths)
+    window = workers * max(prefetch, 1)
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("fork")) as executor:
+        pending = set()
+        while True:
+            for path in paths:
+                pending.add(executor.submit(load_one, path))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def bucket_batches(items, batch_size: int, buffer_batches: int = 16, key=len):
+    """
+    Gom items thành batch theo độ dài: đọc buffer_batches * batch_size phần tử, sắp theo
+    key rồi cắt thành batch, các phần tử trong 1 batch dài gần bằng nhau.
+    """
+    buffer = []
+    limit = batch_size * max(buffer_batches, 1)
+    for item in items:
+        buffer.append(item)
+        if len(buffer) >= limit:
+            buffer.sort(key=key)
+            for start in range(0, len(buffer), batch_size):
+                yield buffer[start:start + batch_size]
+            buffer = []
+    buffer.sort(key=key)
+    for start in range(0, len(buffer), batch_size):
+        yield buffer[start:start + batch_size]
+
+
+def benchmark(path: str, repeat: int = 10) -> None:
+    with open(path, "rb") as f:
+        data = f.read()
+    fmt = RAW_G711_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    stages = {"decode": [], "mono": [], "resample": [], "detector": [], "encoder": []}
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        wav, sr = decode(data, fmt=fmt)
+        t1 = time.perf_counter()
+        mono = to_mono(wav)
+        t2 = time.perf_counter()
+        wav16k = resample(mono, sr)
+        t3 = time.perf_counter()
+        for_detector(wav16k)
+        t4 = time.perf_counter()
+        for_encoder(wav16k)
+        t5 = time.perf_counter()
+        for name, dt in zip(stages, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+            stages[name].append(dt * 1000.0)
+    print(f"{os.path.basename(path)}: {sr} Hz, {len(mono) / sr:.2f}s, {repeat} runs")
+    for name, times in stages.items():
+        print(f"  {name:<9} median {np.median(times):8.3f} ms   min {np.min(times):8.3f} ms")
+    total = sum(np.median(times) for name, times in stages.items() if name != "encoder")
+    print(f"  {'total':<9} median {total:8.3f} ms   (decode + resample + detector)")
+
+
+def benchmark_legacy(path: str, repeat: int = 10) -> None:
+    """Đường cũ của infer_one: librosa.load + preemphasis/normalize + librosa.resample."""
+    import librosa
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        wav, sr = librosa.load(path, sr=None)
+        wav = librosa.effects.preemphasis(wav, coef=1.0)
+        wav = librosa.util.normalize(wav)
+        if sr != TARGET_SR:
+            wav = librosa.resample(wav, orig_sr=sr, target_sr=TARGET_SR)
+        times.append((time.perf_counter() - t0) * 1000.0)
+    print(f"  {'librosa':<9} median {np.median(times):8.3f} ms   min {np.min(times):8.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage audio pipeline benchmark")
+    parser.add_argument("path")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--legacy", action="store_true",
+                        help="also time the old librosa decode + resample path")
+    args = parser.parse_args()
+    prewarm_resamplers()
+    benchmark(args.path, args.repeat)
+    if args.legacy:
+        benchmark_legacy(args.path, args.repeat)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Load test cho các truy vấn cuộc gọi đang hoạt động.
+
+Tạo DB tạm với N dòng call_status lịch sử, đo latency của truy vấn cũ (OR-join trên
+call_status, không index) và truy vấn mới (active_calls theo phone) sau migration.
+
+    python bench_db.py --rows 10000 100000 1000000 5000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import db
+
+LEGACY_ACTIVE_CALL_FOR_USER = """
+    SELECT cs.id, cs.caller, cs.callee
+    FROM call_status cs
+    JOIN users u ON (u.phone = cs.caller OR u.phone = cs.callee)
+    WHERE u.id = ? AND cs.status = 'calling'
+    ORDER BY cs.timestamp DESC
+    LIMIT 1
+"""
+LEGACY_ACTIVE_CALL_FOR_PHONE = """
+    SELECT status FROM call_status
+    WHERE (caller = ? OR callee = ?)
+    AND status = 'calling'
+    ORDER BY timestamp DESC
+    LIMIT 1
+"""
+
+
+def populate(conn: sqlite3.Connection, rows: int, phones: int, active: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    conn.executemany(db.SQL_INSERT_USER, (
+        (f"user-{i}", f"{1000 + i}", "x", f"User {i}", None, None) for i in range(phones)))
+
+    def history():
+        for i in range(rows):
+            a, b = rng.sample(range(phones), 2)
+            yield (f"{1000 + a}", f"{1000 + b}", "idle", f"2024-01-01 00:00:{i % 60:02d}")
+
+    conn.executemany(
+        "INSERT INTO call_status (caller, callee, status, timestamp) VALUES (?, ?, ?, ?)",
+        history())
+    for i in range(active):
+        conn.execute("INSERT INTO call_status (caller, callee, status) VALUES (?, ?, 'calling')",
+                     (f"{1000 + 2 * i}", f"{1000 + 2 * i + 1}"))
+    conn.commit()
+
+
+def timed(fn, args_list) -> float:
+    start = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1000.0
+
+
+def run(rows: int, phones: int, active: int, queries: int) -> None:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    conn = sqlite3.connect(path)
+    for pragma in db.PRAGMAS:
+        conn.execute(pragma)
+    db.create_tables(conn)
+    t0 = time.perf_counter()
+    populate(conn, rows, phones, active)
+    build_s = time.perf_counter() - t0
+
+    rng = random.Random(1)
+    users = [(f"user-{rng.randrange(phones)}",) for _ in range(queries)]
+    phone_args = [(f"{1000 + rng.randrange(phones)}",) for _ in range(queries)]
+    legacy_queries = max(1, min(queries, 2000000 // max(rows, 1)))
+
+    legacy_verify = timed(lambda u: conn.execute(LEGACY_ACTIVE_CALL_FOR_USER, (u,)).fetchone(),
+                          users[:legacy_queries])
+    legacy_status = timed(lambda p: conn.execute(LEGACY_ACTIVE_CALL_FOR_PHONE, (p, p)).fetchone(),
+                          phone_args[:legacy_queries])
+
+    t0 = time.perf_counter()
+    db.migrate(conn)
+    migrate_s = time.perf_counter() - t0
+
+    def new_verify(user_id):
+        phone = conn.execute(db.SQL_USER_PHONE, (user_id,)).fetchone()[0]
+        call = db.find_active_call(conn, phone)
+        if call:
+            conn.execute(db.SQL_USER_ID_BY_PHONE, (call[1],)).fetchone()
+
+    def new_status(phone):
+        db.find_active_call(conn, phone)
+
+    verify = timed(new_verify, users)
+    status = timed(new_status, phone_args)
+    conn.close()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    print(f"{rows:>10,} | build {build_s:6.1f}s migrate {migrate_s:5.1f}s | "
+          f"verify {legacy_verify:9.3f} → {verify:6.3f} ms | "
+          f"status {legacy_status:9.3f} → {status:6.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="call_status query latency vs. history size")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--phones", type=int, default=10000)
+    parser.add_argument("--active", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+    print("      rows |                               | legacy → new (per lookup)")
+    for n in args.rows:
+        run(n, args.phones, args.active, args.queries)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Đo cold-start (thời gian import) và RSS của server ở từng chế độ MODEL_LOADING.
+
+Mỗi lần đo chạy trong 1 process mới; "eager" tương đương hành vi cũ (model được nạp
+ngay khi import).
+
+    python bench_startup.py --module asgi_server --modes off lazy eager --warmup
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import {module}
+import_s = time.perf_counter() - started
+result = {{
+    "import_s": import_s,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    "torch_loaded": "torch" in sys.modules,
+}}
+if {warmup}:
+    import voice_service
+    started = time.perf_counter()
+    try:
+        voice_service.warmup()
+        result["first_inference_s"] = time.perf_counter() - started
+    except voice_service.ApiError as e:
+        result["first_inference_s"] = None
+    result["rss_after_warmup_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+print("BENCH " + json.dumps(result))
+"""
+
+
+def probe(module: str, mode: str, warmup: bool) -> dict:
+    env = dict(os.environ, MODEL_LOADING=mode)
+    proc = subprocess.run([sys.executable, "-c", PROBE.format(module=module, warmup=warmup)],
+                          env=env, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith("BENCH "):
+            return json.loads(line[len("BENCH "):])
+    raise RuntimeError(f"{module} ({mode}) không khởi động được:\n{proc.stderr[-2000:]}")
+
+
+def fmt(value, unit):
+    return "-" if value is None else f"{value:.2f}{unit}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold-start time and RSS per MODEL_LOADING mode")
+    parser.add_argument("--module", default="asgi_server", help="asgi_server or http_server")
+    parser.add_argument("--modes", nargs="+", default=["off", "lazy", "eager"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", action="store_true", help="also time /warmup after import")
+    args = parser.parse_args()
+
+    print(f"{'mode':<10} {'import':>9} {'RSS':>10} {'torch':>6} {'warmup':>9} {'RSS warm':>10}")
+    for mode in args.modes:
+        runs = [probe(args.module, mode, args.warmup) for _ in range(args.repeat)]
+        best = min(runs, key=lambda r: r["import_s"])
+        print(f"{mode:<10} {fmt(best['import_s'], 's'):>9} {fmt(best['rss_mb'], 'MB'):>10} "
+              f"{str(best['torch_loaded']):>6} {fmt(best.get('first_inference_s'), 's'):>9} "
+              f"{fmt(best.get('rss_after_warmup_mb'), 'MB'):>10}")
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Trích embedding ECAPA hàng loạt (đổi model, nhập kho ghi âm có sẵn của khách hàng).
+
+- File được giải mã song song (audio_pipeline.load_many), gom theo độ dài
+  (bucket_batches), pad về cùng độ dài và chạy encode_batch với wav_lens thật thay vì
+  từng file 1.
+- Kết quả ghi vào bảng tạm bulk_embeddings theo job, mỗi commit_every file 1 transaction;
+  chạy lại cùng --job thì bỏ qua các file đã xong (resume sau khi bị ngắt).
+- finalize: thay enrollment của từng user bằng embedding mới, tính lại centroid
+  (speaker_embeddings) và cohort stats AS-norm. File ghi lúc đăng ký (users.voice_filename)
+  được lưu với source='register' để adaptation không bao giờ xóa nó.
+
+File thuộc user theo tên: {user_id}.wav hoặc {user_id}_<bất kỳ>.wav (như voice_service).
+
+    python bulk_embed.py --audio_dir user_voices --db voice_system.db \\
+        --batch_size 32 --workers 8 --job ecapa-2024
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+import audio_pipeline
+import db
+from enrollment import EnrollmentStore, centroid
+from speaker_index import make_speaker_index, normalize
+
+SQL_CREATE_STAGING = """
+    CREATE TABLE IF NOT EXISTS bulk_embeddings (
+        job TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        embedding BLOB,
+        error TEXT,
+        PRIMARY KEY (job, filename)
+    )
+"""
+SQL_STAGED_FILES = "SELECT filename FROM bulk_embeddings WHERE job = ?"
+SQL_STAGE = """
+    INSERT OR REPLACE INTO bulk_embeddings (job, filename, user_id, embedding, error)
+    VALUES (?, ?, ?, ?, ?)
+"""
+SQL_STAGED_USERS = """
+    SELECT b.user_id, b.filename, b.embedding, u.voice_filename FROM bulk_embeddings b
+    JOIN users u ON u.id = b.user_id
+    WHERE b.job = ? AND b.embedding IS NOT NULL
+    ORDER BY b.user_id, b.filename
+"""
+
+
+def user_of(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0].split("_", 1)[0]
+
+
+def load_classifier(device: str = "cpu"):
+    from speechbrain.inference.speaker import EncoderClassifier
+    return EncoderClassifier.from_hparams(
+        source="speechbrain/spkrec-ecapa-voxceleb",
+        savedir="pretrained_models/spkrec-ecapa",
+        run_opts={"device": device}
+    )
+
+
+def pad_batch(wavs: list):
+    """[B, T_max] zero-padded + wav_lens tương đối (độ dài / T_max) như speechbrain cần."""
+    import torch
+    lengths = [len(w) for w in wavs]
+    longest = max(lengths)
+    batch = torch.zeros(len(wavs), longest)
+    for i, wav in enumerate(wavs):
+        batch[i, :len(wav)] = torch.from_numpy(wav)
+    return batch, torch.tensor(lengths, dtype=torch.float32) / longest
+
+
+def embed_files(classifier, paths, batch_size: int = 32, workers: int = 4, prefetch: int = 4,
+                max_seconds: float = 60.0, buffer_batches: int = 16):
+    """
+    Sinh (path, embedding float32 hoặc None, lỗi hoặc None) cho mọi file trong paths,
+    theo thứ tự xử lý xong (không phải thứ tự đầu vào).
+    """
+    import torch
+    decoded = []
+    for path, wav, error in audio_pipeline.load_many(paths, workers, prefetch, max_seconds):
+        if wav is None or len(wav) == 0:
+            yield path, None, error or "empty audio"
+        else:
+            decoded.append((path, wav))
+        if len(decoded) >= batch_size * buffer_batches:
+            yield from _encode_buckets(classifier, decoded, batch_size, torch)
+            decoded = []
+    yield from _encode_buckets(classifier, decoded, batch_size, torch)
+
+
+def _encode_buckets(classifier, decoded: list, batch_size: int, torch):
+    for batch in audio_pipeline.bucket_batches(decoded, batch_size, key=lambda item: len(item[1])):
+        wavs, wav_lens = pad_batch([wav for _, wav in batch])
+        with torch.inference_mode():
+            embeddings = classifier.encode_batch(wavs, wav_lens)  # [B, 1, 192]
+        embeddings = embeddings.reshape(len(batch), -1).cpu().numpy().astype(np.float32)
+        for (path, _), emb in zip(batch, embeddings):
+            yield path, emb, None
+
+
+def stage(pool: db.ConnectionPool, classifier, audio_dir: str, job: str = "reindex",
+          restart: bool = False, commit_every: int = 2048, **kwargs) -> dict:
+    """Trích embedding mọi file chưa có trong job vào bulk_embeddings."""
+    with pool.connection() as conn:
+        conn.execute(SQL_CREATE_STAGING)
+        if restart:
+            conn.execute("DELETE FROM bulk_embeddings WHERE job = ?", (job,))
+        conn.commit()
+        done = {r[0] for r in conn.execute(SQL_STAGED_FILES, (job,))}
+
+    paths = [p for p in audio_pipeline.list_audio(audio_dir)
+             if os.path.relpath(p, audio_dir) not in done]
+    print(f"{len(done)} file đã xong trong job '{job}', còn {len(paths)} file")
+
+    stats = {"embedded": 0, "failed": 0}
+    rows = []
+    t0 = time.perf_counter()
+    with pool.connection() as conn:
+        def flush():
+            conn.executemany(SQL_STAGE, rows)
+            conn.commit()
+            rows.clear()
+            processed = stats["embedded"] + stats["failed"]
+            rate = processed / max(time.perf_counter() - t0, 1e-9)
+            print(f"  {processed}/{len(paths)} file ({rate:.1f} file/s, {stats['failed']} lỗi)")
+
+        for path, emb, error in embed_files(classifier, paths, **kwargs):
+            if emb is None:
+                stats["failed"] += 1
+                print(f"Bỏ qua {path}: {error}")
+            else:
+                stats["embedded"] += 1
+            rows.append((job, os.path.relpath(path, audio_dir), user_of(path),
+                         emb.tobytes() if emb is not None else None, error))
+            if len(rows) >= commit_every:
+                flush()
+        if rows:
+            flush()
+    return stats
+
+
+def finalize(pool: db.ConnectionPool, job: str = "reindex", max_utterances: int = 20,
+             cohort_k: int = 200) -> int:
+    """
+    Thay enrollment của các user có file trong job bằng embedding mới (giữ bản đăng ký +
+    các bản cuối theo tên file, tối đa max_utterances), ghi centroid mới; 1 transaction
+    cho toàn bộ. Embedding cũ thuộc model khác nên không giữ lại bản nào.
+    """
+    users = {}
+    with pool.connection() as conn:
+        for user_id, filename, blob, voice_filename in conn.execute(SQL_STAGED_USERS, (job,)):
+            source = "register" if os.path.basename(filename) == voice_filename else "bulk"
+            users.setdefault(user_id, []).append((source, np.frombuffer(blob, dtype=np.float32)))
+
+        for user_id, staged in users.items():
+            registered = [s for s in staged if s[0] == "register"]
+            others = [s for s in staged if s[0] != "register"]
+            room = max(max_utterances - len(registered), 0)
+            staged = registered + (others[-room:] if room else [])
+            embeddings = [normalize(e) for _, e in staged]
+            conn.execute("DELETE FROM speaker_enrollments WHERE user_id = ?", (user_id,))
+            conn.executemany(db.SQL_INSERT_ENROLLMENT,
+                             [(user_id, e.tobytes(), source) for (source, _), e in zip(staged, embeddings)])
+            conn.execute(db.SQL_UPSERT_EMBEDDING,
+                         (user_id, centroid(embeddings).tobytes(), len(embeddings), None, None))
+        conn.commit()
+
+        index = make_speaker_index("exact")
+        index.load_rows(conn.execute(db.SQL_ALL_EMBEDDINGS).fetchall())
+    EnrollmentStore(pool, index, max_utterances, cohort_k).refresh_norm_stats()
+    return len(users)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk ECAPA embedding extraction")
+    parser.add_argument("--audio_dir", default="user_voices")
+    parser.add_argument("--db", default=db.DB_FILE)
+    parser.add_argument("--job", default="reindex", help="resume key; rerun the same job to continue")
+    parser.add_argument("--restart", action="store_true", help="discard staged results of this job")
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--prefetch", type=int, default=4)
+    parser.add_argument("--max_seconds", type=float, default=60.0,
+                        help="truncate longer recordings (bounds padding memory)")
+    parser.add_argument("--commit_every", type=int, default=2048)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--no_finalize", action="store_true",
+                        help="only stage embeddings, do not touch speaker_embeddings yet")
+    args = parser.parse_args()
+
+    pool = db.ConnectionPool(args.db)
+    with pool.connection() as conn:
+        db.create_tables(conn)
+        db.migrate(conn)
+    classifier = load_classifier(args.device)
+    t0 = time.perf_counter()
+    stats = stage(pool, classifier, args.audio_dir, args.job, args.restart, args.commit_every,
+                  batch_size=args.batch_size, workers=args.workers, prefetch=args.prefetch,
+                  max_seconds=args.max_seconds)
+    print(f"Đã trích {stats['embedded']} embedding ({stats['failed']} lỗi) "
+          f"trong {time.perf_counter() - t0:.1f}s")
+    if not args.no_finalize:
+        print(f"Đã cập nhật centroid cho {finalize(pool, args.job)} user")
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Chấm điểm deepfake hàng loạt cho audit (ví dụ ghi âm cả ngày trong
+/var/spool/asterisk/monitor).
+
+- Đầu vào: thư mục (quét đệ quy) hoặc manifest (mỗi dòng 1 đường dẫn, '#' là comment).
+- Worker process giải mã, resample và cắt mỗi file thành các cửa sổ 64600 mẫu trượt
+  theo hop (giống StreamingScorer), tiền xử lý từng cửa sổ (for_detector).
+- Cửa sổ của nhiều file được gom thành batch cố định batch_size cho model; cửa sổ cùng
+  độ dài nên không tốn padding. Score của file = trung bình các cửa sổ.
+- Kết quả ghi CSV, flush sau mỗi file; chạy lại với cùng --out thì bỏ qua file đã có.
+
+    python bulk_score.py /var/spool/asterisk/monitor --out audit_2024-06-01.csv \\
+        --workers 4 --threads 12 --batch_size 16
+"""
+import argparse
+import csv
+import os
+import time
+from functools import partial
+
+import numpy as np
+import torch
+
+import audio_pipeline
+from infer import WINDOW_SAMPLES, AntiSpoofing, fit_length, score_batch
+
+COLUMNS = ["path", "duration", "windows", "score", "score_min", "score_max", "label", "error"]
+
+
+def windows_of(wav: np.ndarray, hop_seconds: float = 4.0, max_windows: int = 0):
+    """(mảng [n, 64600] các cửa sổ đã tiền xử lý, thời lượng giây); audio ngắn được pad lặp lại."""
+    hop = max(int(hop_seconds * audio_pipeline.TARGET_SR), 1)
+    starts = list(range(0, max(len(wav) - WINDOW_SAMPLES, 0) + 1, hop)) if len(wav) else []
+    if starts and starts[-1] + WINDOW_SAMPLES < len(wav):
+        starts.append(len(wav) - WINDOW_SAMPLES)  # cửa sổ cuối khớp đuôi file
+    if max_windows:
+        starts = starts[:max_windows]
+    out = np.empty((len(starts), WINDOW_SAMPLES), dtype=np.float32)
+    for i, start in enumerate(starts):
+        out[i] = audio_pipeline.for_detector(fit_length(wav[start:start + WINDOW_SAMPLES], WINDOW_SAMPLES))
+    return out, len(wav) / audio_pipeline.TARGET_SR
+
+
+def read_manifest(path: str) -> list:
+    base = os.path.dirname(os.path.abspath(path))
+    paths = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                paths.append(line if os.path.isabs(line) else os.path.join(base, line))
+    return paths
+
+
+def score_files(detector: AntiSpoofing, paths, batch_size: int = 16, workers: int = 4,
+                prefetch: int = 4, hop_seconds: float = 4.0, max_windows: int = 0):
+    """Sinh (path, dict kết quả theo COLUMNS) theo thứ tự chấm xong; path trùng chỉ chấm 1 lần."""
+    paths = list(dict.fromkeys(paths))
+    transform = partial(windows_of, hop_seconds=hop_seconds, max_windows=max_windows)
+    files = {}       # path -> [số cửa sổ còn chờ, scores, duration]
+    pending = []     # (path, cửa sổ)
+
+    def run(batch):
+        scores = score_batch([w for _, w in batch], detector.model, detector.device)
+        for (path, _), score in zip(batch, scores):
+            entry = files[path]
+            entry[0] -= 1
+            entry[1].append(score)
+            if entry[0] == 0:
+                del files[path]
+                yield path, result_row(detector, path, entry[1], entry[2])
+
+    for path, decoded, error in audio_pipeline.load_many(paths, workers, prefetch, transform=transform):
+        if decoded is None:
+            yield path, {"path": path, "error": error}
+            continue
+        windows, duration = decoded
+        if len(windows) == 0:
+            yield path, {"path": path, "duration": round(duration, 3), "windows": 0, "error": "empty audio"}
+            continue
+        files[path] = [len(windows), [], duration]
+        pending.extend((path, w) for w in windows)
+        while len(pending) >= batch_size:
+            batch, pending = pending[:batch_size], pending[batch_size:]
+            yield from run(batch)
+    if pending:
+        yield from run(pending)
+
+
+def result_row(detector: AntiSpoofing, path: str, scores: list, duration: float) -> dict:
+    result = detector.make_result(float(np.mean(scores)))
+    return {
+        "path": path,
+        "duration": round(duration, 3),
+        "windows": len(scores),
+        "score": round(result["score"], 6),
+        "score_min": round(float(np.min(scores)), 6),
+        "score_max": round(float(np.max(scores)), 6),
+        "label": result["label"],
+        "error": "",
+    }
+
+
+def scored_paths(out: str) -> set:
+    """Các file đã có trong CSV; dòng cuối bị ghi dở (process bị ngắt) được cắt bỏ."""
+    if not os.path.isfile(out):
+        return set()
+    with open(out, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+    with open(out, newline="") as f:
+        return {row["path"] for row in csv.DictReader(f)}
+
+
+def main(args) -> None:
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    detector = AntiSpoofing(config_path=args.config, weights_path=args.weights,
+                            device=args.device, compiled_path=args.compiled)
+
+    if os.path.isdir(args.source):
+        paths = audio_pipeline.list_audio(args.source)
+    else:
+        paths = read_manifest(args.source)
+    done = scored_paths(args.out)
+    paths = [p for p in paths if p not in done]
+    print(f"{len(done)} file đã chấm, còn {len(paths)} file")
+
+    new_file = not os.path.isfile(args.out) or os.path.getsize(args.out) == 0
+    t0 = time.perf_counter()
+    count = failed = 0
+    audio_seconds = 0.0
+    with open(args.out, "a", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=COLUMNS)
+        if new_file:
+            writer.writeheader()
+        for path, row in score_files(detector, paths, args.batch_size, args.workers,
+                                     args.prefetch, args.hop_seconds, args.max_windows):
+            writer.writerow(row)
+            fh.flush()
+            count += 1
+            failed += bool(row.get("error"))
+            audio_seconds += row.get("duration") or 0.0
+            if count % args.log_every == 0 or count == len(paths):
+                elapsed = time.perf_counter() - t0
+                print(f"  {count}/{len(paths)} file, {failed} lỗi, {count / elapsed:.1f} file/s, "
+                      f"{audio_seconds / elapsed:.1f}x realtime")
+    print(f"Xong {count} file trong {time.perf_counter() - t0:.1f}s → {args.out}")
+
+
+if __name__ == "__main__":
+    cpus = os.cpu_count() or 4
+    parser = argparse.ArgumentParser(description="Offline AASIST scoring of recorded calls")
+    parser.add_argument("source", help="directory to scan or manifest file (one path per line)")
+    parser.add_argument("--out", required=True, help="CSV output; rerun with the same file to resume")
+    parser.add_argument("--config", default="./config/AASIST.conf")
+    parser.add_argument("--weights", default="./models/weights/AASIST.pth")
+    parser.add_argument("--compiled", default=None, help="TorchScript/ONNX graph from export_model.py")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=max(1, cpus // 4), help="decode processes")
+    parser.add_argument("--threads", type=int, default=max(1, cpus - max(1, cpus // 4)),
+                        help="torch intra-op threads for the model")
+    parser.add_argument("--prefetch", type=int, default=4)
+    parser.add_argument("--hop_seconds", type=float, default=4.0)
+    parser.add_argument("--max_windows", type=int, default=0, help="score at most N windows per file")
+    parser.add_argument("--log_every", type=int, default=100)
+    main(parser.parse_args())
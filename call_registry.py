@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Call registry thường trú trong RAM.
+
+- phone → cuộc gọi đang diễn ra, call_id → 2 đầu cuộc gọi, user_id ↔ phone:
+  /status và /verify-voice tra cứu O(1) trong bộ nhớ, không chạm SQLite
+- mỗi thay đổi trạng thái được đưa cho db_writer.BatchWriter, ghi xuống call_status /
+  active_calls theo lô (nhiều thay đổi trong 1 transaction)
+call_id được cấp ngay trong process từ 1 khối id giữ chỗ trong bảng id_sequences
+(db.reserve_ids), nên không phải chờ INSERT và nhiều process không cấp trùng id.
+"""
+import asyncio
+import threading
+import time
+
+import db
+
+SQL_INSERT_CALL_WITH_ID = """
+    INSERT INTO call_status (id, caller, callee, status, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+"""
+SQL_ALL_ACTIVE_CALLS = "SELECT phone, call_id, peer FROM active_calls"
+SQL_ALL_USER_PHONES = "SELECT id, phone FROM users"
+
+
+class Call:
+    __slots__ = ("call_id", "caller", "callee", "started_at")
+
+    def __init__(self, call_id: int, caller: str, callee: str, started_at: str = None):
+        self.call_id = call_id
+        self.caller = caller
+        self.callee = callee
+        self.started_at = started_at
+
+    def peer_of(self, phone: str) -> str:
+        return self.callee if phone == self.caller else self.caller
+
+
+class CallRegistry:
+    """
+    - start(caller, callee) -> call_id, end(phone, status) -> call_id | None
+    - start_async(caller, callee): như start, dùng trên event loop (không bao giờ chờ DB
+      trên loop)
+    - find(phone) -> (call_id, peer) | None, legs(call_id) -> (caller, callee) | None
+    - bind_media(key, phone), media_phone(key): leg audio trực tiếp (UUID AudioSocket /
+      địa chỉ nguồn RTP) → số điện thoại, được xóa khi cuộc gọi của số đó kết thúc
+    - phone_of(user_id), user_of(phone): cache users.id ↔ users.phone; tra cứu không thấy
+      cũng được cache miss_ttl giây để số / user lạ không chạm SQLite mỗi lần
+    Ghi DB đi qua writer (BatchWriter dùng chung với các bảng khác).
+    """
+    def __init__(self, pool: db.ConnectionPool, writer, id_block: int = 100,
+                 miss_ttl: float = 5.0):
+        self.pool = pool
+        self.writer = writer
+        self.id_block = id_block
+        self.miss_ttl = miss_ttl
+        self._lock = threading.Lock()
+        self._by_phone = {}
+        self._by_id = {}
+        self._phone_by_user = {}
+        self._user_by_phone = {}
+        self._missing = {}  # ("user"|"phone", key) → hết hạn lúc (monotonic)
+        self._phone_by_media = {}
+        self._media_by_phone = {}
+        self._next_id = self._block_end = 0
+        self._spare = None        # đầu khối id kế tiếp, giữ chỗ trước trên thread nền
+        self._reserving = False
+        self._load()
+
+    def _load(self) -> None:
+        with self.pool.connection() as conn:
+            for phone, call_id, peer in conn.execute(SQL_ALL_ACTIVE_CALLS):
+                call = self._by_id.get(call_id)
+                if call is None:
+                    call = self._by_id[call_id] = Call(call_id, phone, peer)
+                self._by_phone[phone] = call
+            for user_id, phone in conn.execute(SQL_ALL_USER_PHONES):
+                self._remember_locked(user_id, phone)
+            self._next_id = db.reserve_ids(conn, "call_status", self.id_block)
+            self._block_end = self._next_id + self.id_block
+        print(f"Call registry: {len(self._by_id)} cuộc gọi đang hoạt động, "
+              f"{len(self._phone_by_user)} người dùng")
+
+    # ------------------------------------------------------------- call state
+    def start(self, caller: str, callee: str) -> int:
+        """Từ thread thường: hết khối id thì giữ chỗ khối mới (ngoài lock) rồi thử lại."""
+        while True:
+            call_id = self._try_start(caller, callee)
+            if call_id is not None:
+                return call_id
+            self._ensure_block()
+
+    async def start_async(self, caller: str, callee: str) -> int:
+        """Từ event loop: giữ chỗ khối id mới (hiếm) chạy trong executor."""
+        while True:
+            call_id = self._try_start(caller, callee)
+            if call_id is not None:
+                return call_id
+            await asyncio.get_running_loop().run_in_executor(None, self._ensure_block)
+
+    def _try_start(self, caller: str, callee: str):
+        """Ghi nhận cuộc gọi mới; None nếu đã dùng hết khối id hiện tại và khối dự phòng."""
+        now = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        with self._lock:
+            if self._next_id >= self._block_end:
+                if self._spare is None:
+                    return None
+                self._next_id, self._spare = self._spare, None
+                self._block_end = self._next_id + self.id_block
+            call_id = self._next_id
+            self._next_id += 1
+            if self._block_end - self._next_id <= self.id_block // 2 and \
+                    self._spare is None and not self._reserving:
+                # giữ chỗ trước khối kế tiếp để start không phải chờ DB
+                self._reserving = True
+                threading.Thread(target=self._prefetch_block, name="call-id-block", daemon=True).start()
+            call = Call(call_id, caller, callee, now)
+            self._by_id[call_id] = call
+            for phone in (caller, callee):
+                previous = self._by_phone.get(phone)
+                if previous is not None and previous.call_id in self._by_id:
+                    # cuộc gọi cũ chưa được kết thúc: chỉ còn tồn tại ở đầu kia
+                    other = previous.peer_of(phone)
+                    if self._by_phone.get(other) is not previous:
+                        del self._by_id[previous.call_id]
+                self._by_phone[phone] = call
+        self.writer.submit_many((
+            (SQL_INSERT_CALL_WITH_ID, (call_id, caller, callee, "calling", now)),
+            (db.SQL_SET_ACTIVE_CALL, (caller, call_id, callee)),
+            (db.SQL_SET_ACTIVE_CALL, (callee, call_id, caller)),
+        ))
+        return call_id
+
+    def _reserve_block(self) -> int:
+        with self.pool.connection() as conn:
+            return db.reserve_ids(conn, "call_status", self.id_block)
+
+    def _ensure_block(self) -> None:
+        """Chặn tới khi có khối dự phòng; I/O DB chạy ngoài self._lock."""
+        with self._lock:
+            if self._spare is not None or self._next_id < self._block_end:
+                return
+        start = self._reserve_block()
+        with self._lock:
+            if self._spare is None:
+                self._spare = start
+
+    def _prefetch_block(self) -> None:
+        try:
+            start = self._reserve_block()
+            with self._lock:
+                self._spare = start
+        except Exception as e:
+            print(f"Lỗi khi giữ chỗ khối call_id: {e}")
+        finally:
+            self._reserving = False
+
+    def end(self, phone: str, status: str):
+        with self._lock:
+            call = self._by_phone.get(phone)
+            if call is None:
+                return None
+            for leg in (call.caller, call.callee):
+                if self._by_phone.get(leg) is call:
+                    del self._by_phone[leg]
+                for key in self._media_by_phone.pop(leg, ()):
+                    self._phone_by_media.pop(key, None)
+            self._by_id.pop(call.call_id, None)
+        self.writer.submit_many((
+            (db.SQL_SET_CALL_STATUS, (status, call.call_id)),
+            (db.SQL_CLEAR_ACTIVE_CALL, (call.call_id,)),
+        ))
+        return call.call_id
+
+    def bind_media(self, key: str, phone: str) -> None:
+        with self._lock:
+            self._phone_by_media[key] = phone
+            self._media_by_phone.setdefault(phone, set()).add(key)
+
+    def media_phone(self, key: str):
+        return self._phone_by_media.get(key)
+
+    def find(self, phone: str):
+        call = self._by_phone.get(phone)
+        if call is None:
+            return None
+        return call.call_id, call.peer_of(phone)
+
+    def legs(self, call_id: int):
+        call = self._by_id.get(call_id)
+        if call is None:
+            return None
+        return call.caller, call.callee
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    # ------------------------------------------------------------------ users
+    def _remember_locked(self, user_id: str, phone: str) -> None:
+        self._phone_by_user[user_id] = phone
+        self._user_by_phone[phone] = user_id
+        self._missing.pop(("user", user_id), None)
+        self._missing.pop(("phone", phone), None)
+
+    def remember_user(self, user_id: str, phone: str) -> None:
+        with self._lock:
+            self._remember_locked(user_id, phone)
+
+    def _recently_missing(self, key: tuple) -> bool:
+        expires = self._missing.get(key)
+        return expires is not None and expires > time.monotonic()
+
+    def _remember_missing(self, key: tuple) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if len(self._missing) >= 10000:
+                self._missing = {k: t for k, t in self._missing.items() if t > now}
+            self._missing[key] = now + self.miss_ttl
+
+    def phone_of(self, user_id: str):
+        phone = self._phone_by_user.get(user_id)
+        if phone is None and not self._recently_missing(("user", user_id)):
+            # user được tạo bởi process khác: đọc DB 1 lần rồi cache
+            with self.pool.connection() as conn:
+                row = conn.execute(db.SQL_USER_PHONE, (user_id,)).fetchone()
+            if row:
+                phone = row[0]
+                self.remember_user(user_id, phone)
+            else:
+                self._remember_missing(("user", user_id))
+        return phone
+
+    def user_of(self, phone: str):
+        user_id = self._user_by_phone.get(phone)
+        if user_id is None and not self._recently_missing(("phone", phone)):
+            with self.pool.connection() as conn:
+                row = conn.execute(db.SQL_USER_ID_BY_PHONE, (phone,)).fetchone()
+            if row:
+                user_id = row[0]
+                self.remember_user(user_id, phone)
+            else:
+                self._remember_missing(("phone", phone))
+        return user_id
+
+    def metrics(self) -> dict:
+        return {
+            "active_calls": len(self._by_id),
+            "users_cached": len(self._phone_by_user),
+            "media_legs": len(self._phone_by_media),
+            "misses_cached": len(self._missing),
+        }
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Data-access layer dùng chung cho http_server.py và fastagi_server.py.
+
+- ConnectionPool: tái sử dụng kết nối SQLite giữa các request thay vì connect/close
+  mỗi lần; pragma được đặt 1 lần khi mở kết nối.
+- Các câu SQL nóng được khai báo 1 lần ở đây: sqlite3 cache prepared statement theo
+  chuỗi SQL trên mỗi kết nối (cached_statements), nên dùng chung chuỗi = dùng lại statement.
+"""
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_FILE = "voice_system.db"  # Cùng DB cho http_server.py và fastagi_server.py
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# ---------------------------------------------------------------- hot queries
+SQL_USER_PHONE = "SELECT phone FROM users WHERE id = ?"
+SQL_USER_ID_BY_PHONE = "SELECT id FROM users WHERE phone = ?"
+SQL_USER_LOGIN = "SELECT id, password, fullname FROM users WHERE phone = ?"
+SQL_USER_NAME_PHONE = "SELECT fullname, phone FROM users WHERE id = ?"
+SQL_INSERT_USER = """
+    INSERT INTO users (id, phone, password, fullname, voice_filename, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+SQL_INSERT_CALL = """
+    INSERT INTO call_status (id, caller, callee, status)
+    VALUES (?, ?, ?, ?)
+"""
+SQL_SET_CALL_STATUS = "UPDATE call_status SET status = ? WHERE id = ?"
+SQL_ACTIVE_CALL = "SELECT call_id, peer FROM active_calls WHERE phone = ?"
+SQL_SET_ACTIVE_CALL = """
+    INSERT OR REPLACE INTO active_calls (phone, call_id, peer)
+    VALUES (?, ?, ?)
+"""
+SQL_CLEAR_ACTIVE_CALL = "DELETE FROM active_calls WHERE call_id = ?"
+
+SQL_INSERT_RESULT = """
+    INSERT INTO voice_verification_results
+    (call_id, user_id, opponent_id, result, speaker_id, speaker_name, speaker_phone)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_SELECT_RESULT = """
+    SELECT result, speaker_id, speaker_name, speaker_phone
+    FROM voice_verification_results
+    WHERE call_id = ? AND user_id = ?
+"""
+
+SQL_UPSERT_EMBEDDING = """
+    INSERT OR REPLACE INTO speaker_embeddings (user_id, embedding, n_utterances, cohort_mean, cohort_std)
+    VALUES (?, ?, ?, ?, ?)
+"""
+SQL_ALL_EMBEDDINGS = """
+    SELECT u.id, u.fullname, u.phone, se.embedding
+    FROM speaker_embeddings se
+    JOIN users u ON se.user_id = u.id
+"""
+SQL_NORM_STATS = """
+    SELECT user_id, cohort_mean, cohort_std FROM speaker_embeddings
+    WHERE cohort_std > 0
+"""
+SQL_SET_NORM_STATS = "UPDATE speaker_embeddings SET cohort_mean = ?, cohort_std = ? WHERE user_id = ?"
+
+SQL_INSERT_ENROLLMENT = """
+    INSERT INTO speaker_enrollments (user_id, embedding, source)
+    VALUES (?, ?, ?)
+"""
+SQL_USER_ENROLLMENTS = """
+    SELECT id, embedding, source FROM speaker_enrollments WHERE user_id = ? ORDER BY id DESC
+"""
+SQL_DELETE_ENROLLMENT = "DELETE FROM speaker_enrollments WHERE id = ?"
+
+
+# ---------------------------------------------------------------------- schema
+TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        phone TEXT UNIQUE,
+        password TEXT,
+        fullname TEXT,
+        voice_filename TEXT,
+        created_at TEXT,
+        last_check_result TEXT,
+        last_check_time TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS call_status (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        caller TEXT NOT NULL,
+        callee TEXT NOT NULL,
+        status TEXT NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS voice_verification_results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        call_id INTEGER NOT NULL,
+        user_id TEXT NOT NULL,
+        opponent_id TEXT NOT NULL,
+        result TEXT NOT NULL,
+        speaker_id TEXT,
+        speaker_name TEXT,
+        speaker_phone TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS speaker_embeddings (
+        user_id TEXT PRIMARY KEY,
+        embedding BLOB,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """,
+)
+
+
+def create_tables(conn: sqlite3.Connection) -> None:
+    for sql in TABLES:
+        conn.execute(sql)
+    conn.commit()
+
+
+# ------------------------------------------------------------------ migrations
+# Mỗi phần tử là 1 version của schema (PRAGMA user_version), chạy đúng 1 lần.
+MIGRATIONS = (
+    # 1: bảng active_calls (phone → cuộc gọi đang diễn ra), index cho call_status,
+    #    bảng lưu trữ cuộc gọi đã kết thúc
+    (
+        """
+        CREATE TABLE IF NOT EXISTS active_calls (
+            phone TEXT PRIMARY KEY,
+            call_id INTEGER NOT NULL,
+            peer TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_active_calls_call_id ON active_calls(call_id)",
+        """
+        CREATE INDEX IF NOT EXISTS idx_call_status_caller_calling
+        ON call_status(caller, timestamp) WHERE status = 'calling'
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_call_status_callee_calling
+        ON call_status(callee, timestamp) WHERE status = 'calling'
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_call_status_finished
+        ON call_status(timestamp) WHERE status != 'calling'
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_verification_call_user
+        ON voice_verification_results(call_id, user_id)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS call_status_archive (
+            id INTEGER PRIMARY KEY,
+            caller TEXT NOT NULL,
+            callee TEXT NOT NULL,
+            status TEXT NOT NULL,
+            timestamp DATETIME
+        )
+        """,
+        # cuộc gọi đang 'calling' mới nhất của mỗi số điện thoại
+        """
+        INSERT OR REPLACE INTO active_calls (phone, call_id, peer)
+        SELECT phone, id, peer FROM (
+            SELECT caller AS phone, callee AS peer, id, timestamp FROM call_status WHERE status = 'calling'
+            UNION ALL
+            SELECT callee AS phone, caller AS peer, id, timestamp FROM call_status WHERE status = 'calling'
+            ORDER BY timestamp, id
+        )
+        """,
+    ),
+    # 2: nhiều embedding cho mỗi user (speaker_enrollments); speaker_embeddings giữ
+    #    centroid đã chuẩn hóa + cohort stats cho AS-norm
+    (
+        """
+        CREATE TABLE IF NOT EXISTS speaker_enrollments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            source TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_speaker_enrollments_user ON speaker_enrollments(user_id, id)",
+        "ALTER TABLE speaker_embeddings ADD COLUMN n_utterances INTEGER DEFAULT 1",
+        "ALTER TABLE speaker_embeddings ADD COLUMN cohort_mean REAL",
+        "ALTER TABLE speaker_embeddings ADD COLUMN cohort_std REAL",
+        # embedding duy nhất lúc đăng ký trở thành utterance đầu tiên
+        """
+        INSERT INTO speaker_enrollments (user_id, embedding, source)
+        SELECT user_id, embedding, 'register' FROM speaker_embeddings
+        """,
+    ),
+    # 3: bộ đếm id dùng chung giữa các process (call_id cấp theo khối, xem reserve_ids)
+    (
+        """
+        CREATE TABLE IF NOT EXISTS id_sequences (
+            name TEXT PRIMARY KEY,
+            next_id INTEGER NOT NULL
+        )
+        """,
+        """
+        INSERT OR IGNORE INTO id_sequences (name, next_id)
+        SELECT 'call_status', COALESCE(MAX(id), 0) + 1 FROM (
+            SELECT MAX(id) AS id FROM call_status
+            UNION ALL
+            SELECT MAX(id) FROM call_status_archive
+        )
+        """,
+    ),
+)
+
+
+def migrate(conn: sqlite3.Connection) -> None:
+    """
+    Áp dụng các migration chưa chạy (theo PRAGMA user_version). Mỗi migration nằm trong 1
+    transaction mở bằng BEGIN tường minh: sqlite3 của Python không tự mở transaction cho
+    CREATE / ALTER nên nếu không, process chết giữa chừng sẽ để lại cột đã thêm và lần
+    khởi động sau lỗi "duplicate column name".
+    """
+    if conn.in_transaction:
+        conn.commit()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version={target}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        print(f"Đã migrate schema lên version {target}")
+
+
+# ------------------------------------------------------------------ call state
+def reserve_ids(conn: sqlite3.Connection, name: str, count: int) -> int:
+    """
+    Giữ chỗ count id liên tiếp của sequence name, trả về id đầu tiên. UPDATE lấy write
+    lock của DB nên 2 process không bao giờ nhận cùng 1 khối id.
+    """
+    conn.execute("UPDATE id_sequences SET next_id = next_id + ? WHERE name = ?", (count, name))
+    next_id = conn.execute("SELECT next_id FROM id_sequences WHERE name = ?", (name,)).fetchone()[0]
+    conn.commit()
+    return next_id - count
+
+
+def start_call(conn: sqlite3.Connection, caller: str, callee: str) -> int:
+    """Ghi 1 cuộc gọi mới, trả về call_id."""
+    call_id = reserve_ids(conn, "call_status", 1)
+    conn.execute(SQL_INSERT_CALL, (call_id, caller, callee, "calling"))
+    conn.executemany(SQL_SET_ACTIVE_CALL, ((caller, call_id, callee), (callee, call_id, caller)))
+    return call_id
+
+
+def end_call(conn: sqlite3.Connection, phone: str, status: str):
+    """Kết thúc cuộc gọi đang diễn ra của phone, trả về call_id (None nếu không có)."""
+    row = conn.execute(SQL_ACTIVE_CALL, (phone,)).fetchone()
+    if row is None:
+        return None
+    call_id = row[0]
+    conn.execute(SQL_SET_CALL_STATUS, (status, call_id))
+    conn.execute(SQL_CLEAR_ACTIVE_CALL, (call_id,))
+    return call_id
+
+
+def find_active_call(conn: sqlite3.Connection, phone: str):
+    """(call_id, số điện thoại đối phương) hoặc None."""
+    return conn.execute(SQL_ACTIVE_CALL, (phone,)).fetchone()
+
+
+def archive_finished_calls(conn: sqlite3.Connection, older_than_days: float = 1.0,
+                           batch_size: int = 50000) -> int:
+    """Chuyển các cuộc gọi đã kết thúc sang call_status_archive, trả về số dòng đã chuyển."""
+    moved = 0
+    cutoff = f"-{float(older_than_days)} days"
+    while True:
+        ids = [r[0] for r in conn.execute("""
+            SELECT id FROM call_status
+            WHERE status != 'calling' AND timestamp < datetime('now', ?)
+            LIMIT ?
+        """, (cutoff, batch_size))]
+        if not ids:
+            return moved
+        marks = ",".join("?" * len(ids))
+        conn.execute(f"""
+            INSERT OR REPLACE INTO call_status_archive (id, caller, callee, status, timestamp)
+            SELECT id, caller, callee, status, timestamp FROM call_status WHERE id IN ({marks})
+        """, ids)
+        conn.execute(f"DELETE FROM call_status WHERE id IN ({marks})", ids)
+        conn.commit()
+        moved += len(ids)
+
+
+class ConnectionPool:
+    """
+    Pool kết nối SQLite an toàn đa luồng:
+    - connection(): context manager mượn 1 kết nối, tự rollback nếu có exception
+      và trả lại pool khi xong
+    - tối đa max_connections kết nối; hết thì chờ kết nối được trả lại
+    Kết nối mở với check_same_thread=False vì được trả lại pool và dùng bởi thread khác,
+    nhưng tại mỗi thời điểm chỉ 1 thread giữ 1 kết nối.
+    """
+    def __init__(self,
+                 path: str = DB_FILE,
+                 max_connections: int = 16,
+                 busy_timeout_ms: int = 5000,
+                 cache_size_kb: int = 65536,
+                 mmap_size: int = 256 * 1024 * 1024,
+                 cached_statements: int = 256):
+        self.path = path
+        self.max_connections = max_connections
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path,
+                               timeout=self.busy_timeout_ms / 1000.0,
+                               check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        return conn
+
+    def open_dedicated(self) -> sqlite3.Connection:
+        """Kết nối riêng (không thuộc pool) cho thread chạy lâu, ví dụ writer."""
+        return self._open()
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.max_connections:
+                self._opened += 1
+                try:
+                    return self._open()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+_default_pool = None
+_default_lock = threading.Lock()
+
+
+def get_pool(path: str = DB_FILE) -> ConnectionPool:
+    """Pool dùng chung trong 1 process."""
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = ConnectionPool(path)
+        return _default_pool
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Write-behind cho SQLite: 1 thread ghi duy nhất.
+
+Các lệnh ghi (kết quả xác thực, trạng thái cuộc gọi) được đưa vào hàng đợi và gộp thành
+1 transaction mỗi flush_interval giây (hoặc khi đủ max_batch), thay vì mỗi request mở
+1 transaction riêng. Chỉ còn 1 writer nên các luồng đọc không phải tranh write lock.
+
+durability:
+- "full":   synchronous=FULL, mỗi lô được fsync ngay khi commit
+- "normal": synchronous=NORMAL (WAL), fsync khi checkpoint — mặc định
+- "off":    synchronous=OFF, nhanh nhất, có thể mất lô cuối nếu máy sập
+"""
+import itertools
+import queue
+import sqlite3
+import threading
+import time
+
+DURABILITY = {
+    "full": "PRAGMA synchronous=FULL",
+    "normal": "PRAGMA synchronous=NORMAL",
+    "off": "PRAGMA synchronous=OFF",
+}
+
+
+class BatchWriter:
+    """
+    - submit(sql, params): xếp 1 lệnh ghi
+    - submit_many([(sql, params), ...]): các lệnh luôn nằm chung 1 transaction
+    - flush(timeout): chờ đến khi mọi lệnh đã xếp được commit
+    DB bị khóa (locked/busy) thì lô được thử lại tối đa max_retries lần. Lỗi khác (hoặc hết
+    lượt thử) thì lô được ghi lại từng nhóm lệnh của submit/submit_many: nhóm lỗi được log
+    và bỏ đi để không chặn các lệnh phía sau.
+    Hàng đợi giới hạn max_queue nhóm lệnh; đầy thì lệnh bị bỏ ngay (có log + đếm), submit
+    không bao giờ chặn vì được gọi cả trên event loop (call registry từ ASGI / FastAGI).
+    """
+    def __init__(self, pool, flush_interval: float = 0.05, max_batch: int = 1000,
+                 durability: str = "normal", retry_delay: float = 1.0, max_retries: int = 5,
+                 max_queue: int = 100000):
+        if durability not in DURABILITY:
+            raise ValueError(f"durability phải là một trong {sorted(DURABILITY)}")
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.durability = durability
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._idle = threading.Condition()
+        self._unwritten = 0
+        self._written = 0
+        self._batches = 0
+        self._failed = 0
+        self._dropped = 0
+        self._last_flush_ms = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, sql: str, params=()) -> None:
+        self.submit_many(((sql, params),))
+
+    def submit_many(self, ops) -> None:
+        ops = tuple(ops)
+        with self._idle:
+            self._unwritten += len(ops)
+        try:
+            self._queue.put_nowait(ops)
+        except queue.Full:
+            print(f"Hàng đợi ghi DB đầy, bỏ {len(ops)} lệnh")
+            with self._idle:
+                self._unwritten -= len(ops)
+                self._dropped += len(ops)
+                self._idle.notify_all()
+
+    def _collect(self, first) -> list:
+        """Các nhóm lệnh (mỗi nhóm = 1 lần submit_many) cho 1 lô."""
+        groups = [first]
+        count = len(first)
+        deadline = time.monotonic() + self.flush_interval
+        while count < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                group = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            groups.append(group)
+            count += len(group)
+        return groups
+
+    @staticmethod
+    def _apply(conn, batch) -> None:
+        # các lệnh liên tiếp cùng câu SQL → 1 executemany
+        for sql, group in itertools.groupby(batch, key=lambda op: op[0]):
+            conn.executemany(sql, [params for _, params in group])
+
+    def _commit(self, conn, batch) -> None:
+        """Ghi + commit; chỉ thử lại khi DB đang bị process khác khóa."""
+        for attempt in itertools.count():
+            try:
+                self._apply(conn, batch)
+                conn.commit()
+                return
+            except Exception as e:
+                conn.rollback()
+                transient = isinstance(e, sqlite3.OperationalError) and \
+                    ("locked" in str(e) or "busy" in str(e))
+                if not transient or attempt >= self.max_retries or self._stop.is_set():
+                    raise
+                print(f"DB đang bận, thử lại lô {len(batch)} lệnh ({attempt + 1}/{self.max_retries})")
+                time.sleep(self.retry_delay)
+
+    def _write(self, conn, groups) -> int:
+        """Ghi 1 lô, trả về số lệnh bị bỏ."""
+        started = time.perf_counter()
+        dropped = 0
+        try:
+            self._commit(conn, [op for group in groups for op in group])
+        except Exception as e:
+            self._failed += 1
+            print(f"Lỗi khi ghi lô {len(groups)} nhóm lệnh xuống DB: {e}; ghi lại từng nhóm")
+            for group in groups:
+                try:
+                    self._commit(conn, group)
+                except Exception as e:
+                    dropped += len(group)
+                    print(f"Bỏ {len(group)} lệnh ghi lỗi: {e}; {group}")
+        self._last_flush_ms = (time.perf_counter() - started) * 1000.0
+        return dropped
+
+    def _run(self) -> None:
+        conn = self.pool.open_dedicated()
+        conn.execute(DURABILITY[self.durability])
+        try:
+            while not (self._stop.is_set() and self._queue.empty()):
+                try:
+                    first = self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                groups = self._collect(first)
+                count = sum(len(group) for group in groups)
+                dropped = self._write(conn, groups)
+                with self._idle:
+                    self._unwritten -= count
+                    self._written += count - dropped
+                    self._dropped += dropped
+                    self._batches += 1
+                    self._idle.notify_all()
+        finally:
+            conn.close()
+
+    def flush(self, timeout: float = None) -> bool:
+        with self._idle:
+            return self._idle.wait_for(lambda: self._unwritten == 0, timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def metrics(self) -> dict:
+        with self._idle:
+            return {
+                "durability": self.durability,
+                "pending": self._unwritten,
+                "written": self._written,
+                "batches": self._batches,
+                "avg_batch": round(self._written / self._batches, 2) if self._batches else 0.0,
+                "last_flush_ms": round(self._last_flush_ms, 3),
+                "errors": self._failed,
+                "dropped": self._dropped,
+            }
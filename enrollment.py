@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Enrollment nhiều câu nói cho mỗi user.
+
+- Mỗi lần đăng ký / bổ sung giọng / xác thực thành công với độ tin cậy cao lưu thêm 1
+  embedding vào speaker_enrollments (giữ tối đa max_utterances bản). Bản ghi lúc đăng ký
+  (source='register') không bao giờ bị xóa, chỉ các bản 'enroll' / 'verified' cũ nhất bị
+  thay thế, nên audio đã xác thực không thể dần đẩy hết giọng gốc ra khỏi centroid.
+- Centroid = trung bình các embedding đã chuẩn hóa L2, chuẩn hóa lại; được lưu vào
+  speaker_embeddings và speaker index, nên identify vẫn chỉ là 1 dot product với mỗi user.
+- Cohort stats (AS-norm): mean/std của cohort_k similarity lớn nhất giữa centroid của user
+  và centroid các user khác, tính lúc enroll. Cohort thay đổi dần khi có user mới,
+  chạy refresh định kỳ để tính lại cho tất cả:
+
+    python enrollment.py refresh --db voice_system.db
+"""
+import argparse
+import threading
+
+import numpy as np
+
+import db
+from speaker_index import make_speaker_index, normalize
+
+
+def centroid(embeddings) -> np.ndarray:
+    """Trung bình các embedding đã chuẩn hóa L2, chuẩn hóa lại."""
+    return normalize(np.mean([normalize(e) for e in embeddings], axis=0))
+
+
+class EnrollmentStore:
+    """
+    - enroll(user_id, embeddings, source): thêm embedding, cập nhật centroid + cohort stats
+      của user trong DB và index; trả về số utterance đang giữ
+    - load_norm_stats(): nạp cohort stats đã lưu vào index (sau load_speaker_index)
+    - refresh_norm_stats(): tính lại cohort stats cho mọi user
+    """
+    def __init__(self, pool: db.ConnectionPool, index, max_utterances: int = 20,
+                 cohort_k: int = 200):
+        self.pool = pool
+        self.index = index
+        self.max_utterances = max_utterances
+        self.cohort_k = cohort_k
+        # enroll hiếm khi xảy ra; 1 lock tránh 2 lần cập nhật cùng user đè centroid của nhau
+        self._lock = threading.Lock()
+
+    def enroll(self, user_id: str, embeddings, source: str = "register") -> int:
+        embeddings = [normalize(e) for e in embeddings if e is not None]
+        if not embeddings:
+            return 0
+        with self._lock, self.pool.connection() as conn:
+            user = conn.execute(db.SQL_USER_NAME_PHONE, (user_id,)).fetchone()
+            if user is None:
+                return 0
+            conn.executemany(db.SQL_INSERT_ENROLLMENT,
+                             [(user_id, e.tobytes(), source) for e in embeddings])
+            rows = conn.execute(db.SQL_USER_ENROLLMENTS, (user_id,)).fetchall()
+            registered = [r for r in rows if r[2] == "register"]
+            others = [r for r in rows if r[2] != "register"]
+            room = max(self.max_utterances - len(registered), 0)
+            stale = others[room:]
+            if stale:
+                conn.executemany(db.SQL_DELETE_ENROLLMENT, [(r[0],) for r in stale])
+            kept = [np.frombuffer(r[1], dtype=np.float32) for r in registered + others[:room]]
+            center = centroid(kept)
+            stats = self.index.embedding_cohort_stats(center, user_id, self.cohort_k)
+            mean, std = stats if stats is not None else (None, None)
+            conn.execute(db.SQL_UPSERT_EMBEDDING, (user_id, center.tobytes(), len(kept), mean, std))
+            conn.commit()
+
+            # index chỉ được cập nhật sau khi DB đã commit: commit lỗi thì index vẫn khớp DB
+            self.index.add(user_id, user[0], user[1], center)
+            if stats is not None:
+                self.index.set_norm_stats(user_id, *stats)
+        return len(kept)
+
+    def load_norm_stats(self) -> int:
+        with self.pool.connection() as conn:
+            rows = conn.execute(db.SQL_NORM_STATS).fetchall()
+        return sum(self.index.set_norm_stats(user_id, mean, std) for user_id, mean, std in rows)
+
+    def refresh_norm_stats(self) -> int:
+        stats = self.index.all_cohort_stats(self.cohort_k)
+        with self.pool.connection() as conn:
+            conn.executemany(db.SQL_SET_NORM_STATS,
+                             [(mean, std, user_id) for user_id, mean, std in stats])
+            conn.commit()
+        return len(stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Speaker enrollment maintenance")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("refresh", help="recompute AS-norm cohort stats for every user")
+    p.add_argument("--db", default=db.DB_FILE)
+    p.add_argument("--cohort_k", type=int, default=200)
+    args = parser.parse_args()
+
+    pool = db.ConnectionPool(args.db)
+    index = make_speaker_index("exact")
+    with pool.connection() as conn:
+        index.load_rows(conn.execute(db.SQL_ALL_EMBEDDINGS).fetchall())
+    store = EnrollmentStore(pool, index, cohort_k=args.cohort_k)
+    print(f"Đã tính lại cohort stats cho {store.refresh_norm_stats()} user")
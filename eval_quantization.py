@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+So sánh các chế độ inference của AntiSpoofing (FP32 vs INT8 dynamic, channels_last...)
+trên tập eval ASVspoof2019: latency mỗi batch và EER / min-tDCF (evaluation.calculate_tDCF_EER).
+
+    python eval_quantization.py --config ./config/AASIST.conf \\
+        --database_path ./LA --modes fp32 int8 int8-cl --batch_size 8
+
+min-tDCF chỉ có ý nghĩa khi chạy toàn bộ tập eval (không dùng --limit).
+"""
+import argparse
+import itertools
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from data_utils import Dataset_ASVspoof2019_devNeval, genSpoof_list
+from evaluation import calculate_tDCF_EER
+from infer import get_model, load_config, load_weights, optimize_model
+
+MODES = {
+    "fp32": {"quantization": "none", "channels_last": False},
+    "fp32-cl": {"quantization": "none", "channels_last": True},
+    "int8": {"quantization": "dynamic", "channels_last": False},
+    "int8-cl": {"quantization": "dynamic", "channels_last": True},
+}
+
+
+def score_eval_set(model, loader, trial_lines: dict, save_path: Path) -> list:
+    """Giống main.produce_evaluation_file, kèm thời gian từng batch (ms)."""
+    times = []
+    with open(save_path, "w") as fh:
+        for batch_x, utt_ids in loader:
+            t0 = time.perf_counter()
+            with torch.inference_mode():
+                _, batch_out = model(batch_x)
+            times.append((time.perf_counter() - t0) * 1000.0)
+            for utt_id, score in zip(utt_ids, batch_out[:, 1].cpu().numpy().ravel()):
+                src, key = trial_lines[utt_id]
+                fh.write(f"{utt_id} {src} {key} {score}\n")
+    return times
+
+
+def main(args) -> None:
+    cfg = load_config(args.config)
+    track = cfg.get("track", "LA")
+    database_path = Path(args.database_path)
+    prefix_2019 = f"ASVspoof2019.{track}"
+    trial_path = (database_path /
+                  f"ASVspoof2019_{track}_cm_protocols/{prefix_2019}.cm.eval.trl.txt")
+    asv_score_path = database_path / cfg["asv_score_path"]
+
+    file_eval = genSpoof_list(dir_meta=trial_path, is_train=False, is_eval=True)
+    if args.limit:
+        file_eval = file_eval[:args.limit]
+    trial_lines = {}
+    with open(trial_path) as f:
+        for line in f:
+            _, utt_id, _, src, key = line.strip().split(" ")
+            trial_lines[utt_id] = (src, key)
+
+    eval_set = Dataset_ASVspoof2019_devNeval(list_IDs=file_eval,
+                                             base_dir=database_path / f"ASVspoof2019_{track}_eval/")
+    # chỉ đo thời gian forward pass, không tính đọc file
+    loader = DataLoader(eval_set, batch_size=args.batch_size, shuffle=False)
+
+    out_dir = Path(args.output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    device = torch.device("cpu")
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    results = {}
+    for mode in args.modes:
+        model = get_model(cfg["model_config"], device)
+        load_weights(model, args.weights or cfg["model_path"], device)
+        model = optimize_model(model, MODES[mode], device)
+
+        score_path = out_dir / f"scores_{mode}.txt"
+        score_eval_set(model, itertools.islice(loader, 2), trial_lines, out_dir / "warmup.txt")
+        times = score_eval_set(model, loader, trial_lines, score_path)
+        eer, min_tdcf = calculate_tDCF_EER(cm_scores_file=score_path,
+                                           asv_score_file=asv_score_path,
+                                           output_file=out_dir / f"t-DCF_EER_{mode}.txt",
+                                           printout=False)
+        results[mode] = {
+            "eer": float(eer),
+            "min_tdcf": float(min_tdcf),
+            "batch_ms_median": float(np.median(times)),
+            "batch_ms_p95": float(np.percentile(times, 95)),
+        }
+
+    base = results.get("fp32")
+    print(f"{'mode':<9} {'EER %':>9} {'ΔEER':>8} {'min-tDCF':>9} {'Δ':>8} "
+          f"{'ms/batch':>9} {'p95':>8} {'speedup':>8}")
+    for mode, r in results.items():
+        d_eer = r["eer"] - base["eer"] if base else 0.0
+        d_tdcf = r["min_tdcf"] - base["min_tdcf"] if base else 0.0
+        speedup = base["batch_ms_median"] / r["batch_ms_median"] if base else 1.0
+        print(f"{mode:<9} {r['eer']:9.4f} {d_eer:+8.4f} {r['min_tdcf']:9.5f} {d_tdcf:+8.5f} "
+              f"{r['batch_ms_median']:9.2f} {r['batch_ms_p95']:8.2f} {speedup:7.2f}x")
+    with open(out_dir / "quantization_drift.json", "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EER / latency drift of optimized inference modes")
+    parser.add_argument("--config", default="./config/AASIST.conf")
+    parser.add_argument("--database_path", required=True, help="ASVspoof2019 LA/PA root")
+    parser.add_argument("--weights", default=None)
+    parser.add_argument("--modes", nargs="+", default=["fp32", "int8"], choices=sorted(MODES))
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--limit", type=int, default=0, help="only score the first N utterances")
+    parser.add_argument("--output_dir", default="./exp_result/quantization")
+    main(parser.parse_args())
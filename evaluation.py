@@ -34,14 +34,14 @@ def calculate_tDCF_EER(cm_scores_file,
     asv_data = np.genfromtxt(asv_score_file, dtype=str)
     # asv_sources = asv_data[:, 0]
     asv_keys = asv_data[:, 1]
-    asv_scores = asv_data[:, 2].astype(np.float)
+    asv_scores = asv_data[:, 2].astype(float)
 
     # Load CM scores
     cm_data = np.genfromtxt(cm_scores_file, dtype=str)
     # cm_utt_id = cm_data[:, 0]
     cm_sources = cm_data[:, 1]
     cm_keys = cm_data[:, 2]
-    cm_scores = cm_data[:, 3].astype(np.float)
+    cm_scores = cm_data[:, 3].astype(float)
 
     # Extract target, nontarget, and spoof scores from the ASV scores
     tar_asv = asv_scores[asv_keys == 'target']
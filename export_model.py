@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Export AASIST thành graph đã biên dịch và kiểm tra parity với model eager.
+
+- torchscript: torch.jit.trace với input [MAX_BATCH_SIZE, 64600] (batch > 1 để shape
+  phụ thuộc batch không bị đóng cứng thành 1), freeze (gộp conv+BN, hằng số hóa weight)
+  + optimize_for_inference; metadata (độ dài input, threshold, architecture) được nhúng
+  trong file
+- onnx: torch.onnx.export, trục batch động; chạy bằng onnxruntime
+Sau khi export, graph được chạy với batch 1, 3 và MAX_BATCH_SIZE và so với model eager;
+parity mặc định cũng chạy theo batch MAX_BATCH_SIZE như lúc phục vụ.
+
+    python export_model.py export --config ./config/AASIST.conf --format torchscript \\
+        --out ./models/weights/AASIST.ts
+    python export_model.py parity --config ./config/AASIST.conf \\
+        --compiled ./models/weights/AASIST.ts --database_path ./LA --n 200
+
+AntiSpoofing dùng file đã export khi config có "compiled_model_path" (xem infer.py),
+không cần import models.<architecture> lúc khởi động.
+"""
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from infer import (MAX_BATCH_SIZE, WINDOW_SAMPLES, load_compiled, get_model, load_config,
+                   load_weights, optimize_model)
+
+
+def build_eager(cfg: dict, weights_path: str = None) -> torch.nn.Module:
+    device = torch.device("cpu")
+    model = get_model(cfg["model_config"], device)
+    load_weights(model, weights_path or cfg["model_path"], device)
+    return optimize_model(model, cfg.get("inference", {}), device)
+
+
+def export(cfg: dict, out: str, fmt: str = "torchscript", weights_path: str = None,
+           length: int = WINDOW_SAMPLES, trace_batch: int = MAX_BATCH_SIZE) -> None:
+    model = build_eager(cfg, weights_path)
+    example = torch.randn(max(trace_batch, 2), length)
+    meta = {
+        "length": length,
+        "threshold": cfg.get("threshold", 0.5),
+        "architecture": cfg["model_config"]["architecture"],
+        "torch": torch.__version__,
+    }
+    t0 = time.perf_counter()
+    if fmt == "torchscript":
+        with torch.inference_mode():
+            traced = torch.jit.trace(model, example, check_trace=False)
+            traced = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+        torch.jit.save(traced, out, _extra_files={"aasist.json": json.dumps(meta)})
+    elif fmt == "onnx":
+        torch.onnx.export(model, example, out,
+                          input_names=["wav"], output_names=["hidden", "logits"],
+                          dynamic_axes={"wav": {0: "batch"}, "hidden": {0: "batch"},
+                                        "logits": {0: "batch"}},
+                          opset_version=17)
+        with open(out + ".json", "w") as f:
+            json.dump(meta, f)
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+    print(f"Exported {meta['architecture']} → {out} ({fmt}, input [N, {length}]) "
+          f"in {time.perf_counter() - t0:.1f}s")
+    if not check_batch_sizes(model, out, length, sorted({1, 3, trace_batch})):
+        raise RuntimeError(f"{out}: kết quả phụ thuộc kích thước batch, không dùng được khi gộp batch")
+
+
+def check_batch_sizes(eager: torch.nn.Module, compiled_path: str, length: int, sizes,
+                      atol: float = 1e-3) -> bool:
+    """Graph đã export chạy đúng với mọi batch trong sizes (trục batch động) so với eager."""
+    compiled = load_compiled(compiled_path)
+    gen = torch.Generator().manual_seed(0)
+    ok = True
+    for size in sizes:
+        x = 0.1 * torch.randn(size, length, generator=gen)
+        with torch.inference_mode():
+            _, ref = eager(x)
+            _, out = compiled(x)
+        diff = (F.softmax(ref, dim=1)[:, 1] - F.softmax(out, dim=1)[:, 1]).abs().max().item()
+        print(f"batch {size:<3}: max |Δscore| = {diff:.2e}")
+        ok = ok and tuple(out.shape) == tuple(ref.shape) and diff <= atol
+    return ok
+
+
+def sample_inputs(database_path: str, cfg: dict, n: int, seed: int = 0) -> list:
+    """n file ngẫu nhiên từ danh sách eval ASVspoof2019, pad/cắt về 64600 như data_utils."""
+    from data_utils import Dataset_ASVspoof2019_devNeval, genSpoof_list
+    track = cfg.get("track", "LA")
+    root = Path(database_path)
+    trial_path = root / f"ASVspoof2019_{track}_cm_protocols/ASVspoof2019.{track}.cm.eval.trl.txt"
+    keys = genSpoof_list(dir_meta=trial_path, is_train=False, is_eval=True)
+    keys = random.Random(seed).sample(keys, min(n, len(keys)))
+    dataset = Dataset_ASVspoof2019_devNeval(list_IDs=keys, base_dir=root / f"ASVspoof2019_{track}_eval/")
+    return [dataset[i][0].float() for i in range(len(dataset))]
+
+
+def parity(cfg: dict, compiled_path: str, inputs: list, batch_size: int = MAX_BATCH_SIZE,
+           weights_path: str = None, atol: float = 1e-3) -> bool:
+    eager = build_eager(cfg, weights_path).eval()
+    compiled = load_compiled(compiled_path)
+    diffs, flips = [], 0
+    t_eager, t_compiled = [], []
+    threshold = cfg.get("threshold", 0.5)
+    for start in range(0, len(inputs), batch_size):
+        x = torch.stack(inputs[start:start + batch_size])
+        with torch.inference_mode():
+            t0 = time.perf_counter()
+            _, ref = eager(x)
+            t1 = time.perf_counter()
+            _, out = compiled(x)
+            t2 = time.perf_counter()
+        t_eager.append(t1 - t0)
+        t_compiled.append(t2 - t1)
+        p_ref = F.softmax(ref, dim=1)[:, 1]
+        p_out = F.softmax(out, dim=1)[:, 1]
+        diffs.append((p_ref - p_out).abs().max().item())
+        flips += int(((p_ref >= threshold) != (p_out >= threshold)).sum().item())
+
+    max_diff = max(diffs)
+    ok = max_diff <= atol and flips == 0
+    print(f"{len(inputs)} inputs: max |Δscore| = {max_diff:.2e}, label flips = {flips}")
+    print(f"eager    median {np.median(t_eager) * 1000:8.2f} ms/batch")
+    print(f"compiled median {np.median(t_compiled) * 1000:8.2f} ms/batch")
+    print("PARITY OK" if ok else f"PARITY FAILED (atol={atol})")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export AASIST to TorchScript / ONNX")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("export")
+    p.add_argument("--config", default="./config/AASIST.conf")
+    p.add_argument("--weights", default=None)
+    p.add_argument("--format", choices=["torchscript", "onnx"], default="torchscript")
+    p.add_argument("--out", required=True)
+
+    p = sub.add_parser("parity")
+    p.add_argument("--config", default="./config/AASIST.conf")
+    p.add_argument("--weights", default=None)
+    p.add_argument("--compiled", required=True)
+    p.add_argument("--database_path", default=None,
+                   help="ASVspoof2019 root; random noise inputs when omitted")
+    p.add_argument("--n", type=int, default=100)
+    p.add_argument("--batch_size", type=int, default=MAX_BATCH_SIZE,
+                   help="serving batch size (BatchingAntiSpoofing / AASIST_MAX_BATCH)")
+    p.add_argument("--atol", type=float, default=1e-3)
+
+    args = parser.parse_args()
+    cfg = load_config(args.config)
+    if args.cmd == "export":
+        export(cfg, args.out, args.format, args.weights)
+    else:
+        if args.database_path:
+            inputs = sample_inputs(args.database_path, cfg, args.n)
+        else:
+            gen = torch.Generator().manual_seed(0)
+            inputs = [0.1 * torch.randn(WINDOW_SAMPLES, generator=gen) for _ in range(args.n)]
+        raise SystemExit(0 if parity(cfg, args.compiled, inputs, args.batch_size,
+                                     args.weights, args.atol) else 1)
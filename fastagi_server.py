@@ -1,64 +1,299 @@
-
-
-
-
-
-
-
 #!/usr/bin/env python3
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import urlparse, parse_qs
-import sqlite3
+"""
+FastAGI server (AGI qua TCP) nhận trạng thái cuộc gọi trực tiếp từ Asterisk.
+
+Dialplan gọi AGI(agi://127.0.0.1:4573/call-status,<caller>,<callee>,<status>) thay vì
+fork curl qua System() cho mỗi lần bắt đầu / kết thúc cuộc gọi. Server chạy trên asyncio:
+mỗi kết nối AGI là 1 coroutine, không có thread hay process mới cho mỗi cuộc gọi. Sau khi
+xử lý, server đặt biến kênh CALLSTATUS (ok / error) rồi đóng kết nối.
+
+- Chạy chung process với asgi_server.py (mặc định, FASTAGI_PORT=4573): sự kiện đi thẳng
+  vào call registry, ghi DB qua BatchWriter theo lô.
+- Chạy riêng (python fastagi_server.py serve): sự kiện được chuyển tiếp tuần tự tới
+  CALL_STATUS_URL qua 1 kết nối HTTP keep-alive, không chặn kết nối AGI.
+Request HTTP GET ?caller=&callee=&status= kiểu cũ trên cùng cổng vẫn được chấp nhận.
+status=media gắn leg audio trực tiếp (callee = UUID AudioSocket / ip:port RTP) với số
+caller, xem media_ingest.py.
+
+Giả lập Asterisk để đo tải:
+    python fastagi_server.py loadtest --calls 5000 --concurrency 200
+"""
+import argparse
+import asyncio
+import http.client
 import logging
+import os
+import queue
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import numpy as np
 
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
-DB_FILE = "voice_system.db"  # Cùng DB với http_server.py
-
-class RequestHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
+# Trạng thái cuộc gọi do call registry của http_server.py / asgi_server.py quản lý
+# (RAM + ghi DB theo lô), nên khi chạy riêng thì chuyển tiếp sang đó
+CALL_STATUS_URL = os.environ.get("CALL_STATUS_URL", "http://127.0.0.1:5000/save-call-status")
+AGI_PORT = 4573
+# Chỉ Asterisk (thường cùng máy) được gửi sự kiện: mặc định không mở ra ngoài
+AGI_HOST = os.environ.get("FASTAGI_HOST", "127.0.0.1")
+
+
+async def read_agi_env(reader: asyncio.StreamReader, first_line: bytes = b"") -> dict:
+    """Đọc khối 'agi_xxx: value' Asterisk gửi khi mở kết nối, kết thúc bằng dòng trống."""
+    env = {}
+    line = first_line
+    while True:
+        text = line.decode("utf-8", "replace").strip()
+        if text:
+            key, _, value = text.partition(":")
+            env[key.strip()] = value.strip()
+        elif line:
+            return env
+        line = await reader.readline()
+        if not line:
+            return env
+
+
+def call_event(env: dict):
+    """(caller, callee, status) từ tham số AGI, hoặc query của agi_network_script."""
+    args = [env.get(f"agi_arg_{i}", "") for i in (1, 2, 3)]
+    if all(args):
+        return tuple(args)
+    query = parse_qs(urlparse(env.get("agi_network_script", "")).query)
+    return tuple(query.get(name, [""])[0] for name in ("caller", "callee", "status"))
+
+
+class FastAGIServer:
+    """
+    on_event(caller, callee, status) được gọi trên event loop cho mỗi sự kiện (hàm
+    thường hoặc coroutine), nên phải nhanh: cập nhật RAM / đưa vào hàng đợi ghi.
+    """
+    def __init__(self, on_event, host: str = AGI_HOST, port: int = AGI_PORT,
+                 timeout: float = 10.0):
+        self.on_event = on_event
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._server = None
+        self._connections = 0
+        self._events = 0
+        self._errors = 0
+        self._latency_ms = []
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port,
+                                                  reuse_address=True, backlog=1024)
+        logging.info(f"FastAGI server running on {self.host}:{self.port}...")
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _dispatch(self, event) -> bool:
+        caller, callee, status = event
+        if not all(event):
+            logging.info(f"Thiếu tham số: {event}")
+            return False
+        logging.info(f"Caller: {caller}, Callee: {callee}, Status: {status}")
         try:
-            # Parse query string
-            parsed_url = urlparse(self.path)
-            query_params = parse_qs(parsed_url.query)
-            caller = query_params.get('caller', [''])[0]
-            callee = query_params.get('callee', [''])[0]
-            status = query_params.get('status', [''])[0]
-
-            logging.info(f"Caller: {caller}, Callee: {callee}, Status: {status}")
-
-            # Lưu vào database
-            conn = sqlite3.connect(DB_FILE)
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO call_status (caller, callee, status)
-                VALUES (?, ?, ?)
-            """, (caller, callee, status))
-            conn.commit()
-            conn.close()
-
-            # Send HTTP 200 response
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(b'{"result": "ok"}')
+            result = self.on_event(caller, callee, status)
+            if asyncio.iscoroutine(result):
+                await result
+            self._events += 1
+            return True
         except Exception as e:
-            print(f"Error processing request: {str(e)}")
-            self.send_response(500)
-            self.end_headers()
+            print(f"Error processing event: {str(e)}")
+            return False
 
-    def log_message(self, format, *args):
-        # Sử dụng logging thay vì in ra console
-        logging.info("%s - - [%s] %s" % (self.address_string(), self.log_date_time_string(), format%args))
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections += 1
+        t0 = time.perf_counter()
+        try:
+            first = await asyncio.wait_for(reader.readline(), self.timeout)
+            if first.startswith(b"GET "):
+                await self._handle_http(first, reader, writer)
+            else:
+                env = await asyncio.wait_for(read_agi_env(reader, first), self.timeout)
+                ok = await self._dispatch(call_event(env))
+                # kết quả cho dialplan: ${CALLSTATUS}; chờ "200 result=1" để Asterisk nhận đủ
+                writer.write(f'SET VARIABLE CALLSTATUS "{"ok" if ok else "error"}"\n'.encode())
+                await writer.drain()
+                await asyncio.wait_for(reader.readline(), self.timeout)
+                self._errors += not ok
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            self._errors += 1
+            logging.info(f"AGI connection dropped: {e!r}")
+        finally:
+            writer.close()
+            self._latency_ms.append((time.perf_counter() - t0) * 1000.0)
+            if len(self._latency_ms) > 10000:
+                del self._latency_ms[:5000]
+
+    async def _handle_http(self, first: bytes, reader, writer) -> None:
+        """GET ?caller=&callee=&status= của cấu hình curl cũ."""
+        while (await asyncio.wait_for(reader.readline(), self.timeout)).strip():
+            pass
+        path = first.split()[1].decode("latin-1") if len(first.split()) > 1 else "/"
+        query = parse_qs(urlparse(path).query)
+        ok = await self._dispatch(tuple(query.get(n, [""])[0] for n in ("caller", "callee", "status")))
+        body = b'{"result": "ok"}' if ok else b'{"result": "error"}'
+        writer.write(b"HTTP/1.1 %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n"
+                     b"Connection: close\r\n\r\n%s" % (b"200 OK" if ok else b"500 Internal Server Error",
+                                                       len(body), body))
+        await writer.drain()
+        self._errors += not ok
+
+    def metrics(self) -> dict:
+        latency = self._latency_ms[-1000:]
+        return {
+            "port": self.port,
+            "connections": self._connections,
+            "events": self._events,
+            "errors": self._errors,
+            "latency_ms_p50": round(float(np.percentile(latency, 50)), 3) if latency else None,
+            "latency_ms_p99": round(float(np.percentile(latency, 99)), 3) if latency else None,
+        }
+
+
+class StatusForwarder:
+    """
+    Khi chạy riêng process: đưa sự kiện vào hàng đợi, 1 thread gửi tuần tự (giữ đúng thứ
+    tự calling → idle) tới CALL_STATUS_URL trên 1 kết nối HTTP keep-alive.
+    """
+    def __init__(self, url: str = CALL_STATUS_URL, timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path or "/"
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._conn = None
+        self._thread = threading.Thread(target=self._run, name="status-forwarder", daemon=True)
+        self._thread.start()
+
+    def __call__(self, caller: str, callee: str, status: str) -> None:
+        self._queue.put((caller, callee, status))
+
+    def _send(self, event) -> None:
+        query = urlencode(dict(zip(("caller", "callee", "status"), event)))
+        for attempt in (1, 2):
+            try:
+                if self._conn is None:
+                    self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self._conn.request("GET", f"{self.path}?{query}")
+                resp = self._conn.getresponse()
+                resp.read()
+                return
+            except (OSError, http.client.HTTPException) as e:
+                # server đóng kết nối keep-alive: mở lại và thử thêm 1 lần
+                self._conn.close()
+                self._conn = None
+                if attempt == 2:
+                    print(f"Error forwarding call status {event}: {str(e)}")
+
+    def _run(self) -> None:
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            self._send(event)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+
+# ------------------------------------------------------------ fake Asterisk
+async def fake_agi_call(host: str, port: int, caller: str, callee: str, status: str) -> str:
+    """1 lần AGI(agi://host:port/call-status,caller,callee,status) như Asterisk gửi."""
+    reader, writer = await asyncio.open_connection(host, port)
+    env = {
+        "agi_network": "yes",
+        "agi_network_script": "call-status",
+        "agi_request": f"agi://{host}:{port}/call-status",
+        "agi_channel": f"SIP/{caller}-00000001",
+        "agi_callerid": caller,
+        "agi_extension": callee,
+        "agi_arg_1": caller,
+        "agi_arg_2": callee,
+        "agi_arg_3": status,
+    }
+    writer.write("".join(f"{k}: {v}\n" for k, v in env.items()).encode() + b"\n")
+    await writer.drain()
+    command = await reader.readline()
+    if command:
+        writer.write(b"200 result=1\n")
+        await writer.drain()
+    await reader.read()
+    writer.close()
+    return command.decode().strip()
+
+
+async def loadtest(host: str, port: int, calls: int, concurrency: int) -> None:
+    sem = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def one_call(i: int) -> None:
+        nonlocal failures
+        caller, callee = f"{100000 + 2 * i}", f"{100001 + 2 * i}"
+        async with sem:
+            for status in ("calling", "idle"):
+                t0 = time.perf_counter()
+                try:
+                    reply = await fake_agi_call(host, port, caller, callee, status)
+                    ok = reply.endswith('"ok"')
+                except OSError:
+                    ok = False
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+                failures += not ok
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one_call(i) for i in range(calls)))
+    elapsed = time.perf_counter() - t0
+    print(f"{2 * calls} AGI requests ({calls} calls) in {elapsed:.2f}s, concurrency {concurrency}: "
+          f"{2 * calls / elapsed:.0f} req/s, {failures} failed")
+    print(f"latency p50 {np.percentile(latencies, 50):.2f} ms  p95 {np.percentile(latencies, 95):.2f} ms  "
+          f"p99 {np.percentile(latencies, 99):.2f} ms")
+
+
+def run(port: int = AGI_PORT, url: str = CALL_STATUS_URL, host: str = AGI_HOST) -> None:
+    forwarder = StatusForwarder(url)
+    try:
+        asyncio.run(FastAGIServer(forwarder, host=host, port=port).serve_forever())
+    finally:
+        forwarder.close()
 
-def run(server_class=HTTPServer, handler_class=RequestHandler, port=4573):
-    server_address = ('', port)
-    httpd = server_class(server_address, handler_class)
-    logging.info(f"Server running on port {port}...")
-    httpd.serve_forever()
 
 if __name__ == '__main__':
-    run()
+    parser = argparse.ArgumentParser(description="FastAGI call status receiver")
+    sub = parser.add_subparsers(dest="cmd")
+    p = sub.add_parser("serve", help="standalone server forwarding to CALL_STATUS_URL (default)")
+    p.add_argument("--host", default=AGI_HOST, help="bind address (Asterisk on another host: 0.0.0.0)")
+    p.add_argument("--port", type=int, default=AGI_PORT)
+    p.add_argument("--forward", default=CALL_STATUS_URL)
+    p = sub.add_parser("loadtest", help="fake Asterisk: concurrent AGI calling/idle pairs")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=AGI_PORT)
+    p.add_argument("--calls", type=int, default=1000)
+    p.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.cmd == "loadtest":
+        asyncio.run(loadtest(args.host, args.port, args.calls, args.concurrency))
+    elif args.cmd == "serve":
+        run(args.port, args.forward, args.host)
+    else:
+        run()
+
+
 
 
 # #!/usr/bin/env python3
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+G.711 μ-law / A-law codec dạng bảng tra (vectorized với NumPy).
+
+Asterisk trunk dùng ulaw (sip.conf: allow=ulaw), mỗi byte là 1 mẫu 8 kHz,
+giải mã chỉ là 1 phép index vào bảng 256 phần tử.
+"""
+import numpy as np
+
+SAMPLE_RATE = 8000
+
+
+def _ulaw_to_linear(code: np.ndarray) -> np.ndarray:
+    code = ~code.astype(np.uint8)
+    sign = code & 0x80
+    exponent = (code >> 4) & 0x07
+    mantissa = code & 0x0F
+    magnitude = ((mantissa.astype(np.int32) << 3) + 0x84) << exponent
+    magnitude -= 0x84
+    return np.where(sign != 0, -magnitude, magnitude).astype(np.int16)
+
+
+def _alaw_to_linear(code: np.ndarray) -> np.ndarray:
+    code = code.astype(np.uint8) ^ 0x55
+    sign = code & 0x80
+    exponent = (code >> 4) & 0x07
+    mantissa = (code & 0x0F).astype(np.int32)
+    magnitude = np.where(exponent == 0,
+                         (mantissa << 4) + 8,
+                         ((mantissa << 4) + 0x108) << np.maximum(exponent.astype(np.int32) - 1, 0))
+    return np.where(sign != 0, magnitude, -magnitude).astype(np.int16)
+
+
+_CODES = np.arange(256, dtype=np.uint8)
+ULAW_TO_INT16 = _ulaw_to_linear(_CODES)
+ALAW_TO_INT16 = _alaw_to_linear(_CODES)
+ULAW_TO_FLOAT = (ULAW_TO_INT16 / 32768.0).astype(np.float32)
+ALAW_TO_FLOAT = (ALAW_TO_INT16 / 32768.0).astype(np.float32)
+
+
+def decode_ulaw(data) -> np.ndarray:
+    """bytes/memoryview μ-law → float32 [-1, 1]."""
+    return ULAW_TO_FLOAT[np.frombuffer(data, dtype=np.uint8)]
+
+
+def decode_alaw(data) -> np.ndarray:
+    """bytes/memoryview A-law → float32 [-1, 1]."""
+    return ALAW_TO_FLOAT[np.frombuffer(data, dtype=np.uint8)]
+
+
+# Encoder chuẩn G.711 (chia segment + cắt bớt bit như g711.c của Sun / audioop), không phải
+# "mức giải mã gần nhất": 2 cách cho code khác nhau ở ~1000 giá trị int16.
+_ULAW_SEG_END = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+_ALAW_SEG_END = np.array([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF])
+
+
+def _linear_to_ulaw(pcm: np.ndarray) -> np.ndarray:
+    """int16 → μ-law (giống audioop.lin2ulaw)."""
+    val = pcm.astype(np.int32) >> 2  # 14 bit
+    mask = np.where(val < 0, 0x7F, 0xFF)
+    val = np.minimum(np.abs(val), 8159) + (0x84 >> 2)
+    seg = np.searchsorted(_ULAW_SEG_END, val)
+    code = np.where(seg >= 8, 0x7F, (seg << 4) | ((val >> (np.minimum(seg, 7) + 1)) & 0x0F))
+    return (code ^ mask).astype(np.uint8)
+
+
+def _linear_to_alaw(pcm: np.ndarray) -> np.ndarray:
+    """int16 → A-law (giống audioop.lin2alaw)."""
+    val = pcm.astype(np.int32) >> 3  # 13 bit
+    mask = np.where(val >= 0, 0xD5, 0x55)
+    val = np.where(val >= 0, val, -val - 1)
+    seg = np.searchsorted(_ALAW_SEG_END, val)
+    shift = np.where(seg < 2, 1, np.minimum(seg, 7))
+    code = np.where(seg >= 8, 0x7F, (seg << 4) | ((val >> shift) & 0x0F))
+    return (code ^ mask).astype(np.uint8)
+
+
+def _build_encoder(encode) -> np.ndarray:
+    """Bảng int16 (65536 phần tử) → code G.711, dùng cho bên gửi / test."""
+    return encode(np.arange(-32768, 32768, dtype=np.int32))
+
+
+_ULAW_ENCODER = None
+_ALAW_ENCODER = None
+
+
+def encode_ulaw(pcm: np.ndarray) -> bytes:
+    """float32 [-1, 1] hoặc int16 → bytes μ-law."""
+    global _ULAW_ENCODER
+    if _ULAW_ENCODER is None:
+        _ULAW_ENCODER = _build_encoder(_linear_to_ulaw)
+    return _ULAW_ENCODER[_to_int16(pcm).astype(np.int32) + 32768].tobytes()
+
+
+def encode_alaw(pcm: np.ndarray) -> bytes:
+    """float32 [-1, 1] hoặc int16 → bytes A-law."""
+    global _ALAW_ENCODER
+    if _ALAW_ENCODER is None:
+        _ALAW_ENCODER = _build_encoder(_linear_to_alaw)
+    return _ALAW_ENCODER[_to_int16(pcm).astype(np.int32) + 32768].tobytes()
+
+
+def _to_int16(pcm: np.ndarray) -> np.ndarray:
+    pcm = np.asarray(pcm)
+    if pcm.dtype == np.int16:
+        return pcm
+    return np.clip(np.round(pcm * 32768.0), -32768, 32767).astype(np.int16)
@@ -1,292 +1,58 @@
-
 #!/usr/bin/env python3
+"""
+Front-end Flask (đồng bộ) của API xác thực giọng nói, giữ lại để tương thích.
+Production chạy asgi_server.py; logic dùng chung nằm trong voice_service.py.
+"""
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import sqlite3
-import uuid
-import hashlib
-import os
-from datetime import datetime
-import sip_user_manager
-import soundfile as sf
-import numpy as np
-import librosa
-from infer import AntiSpoofing
-import time
-import threading
-import torchaudio
-from speechbrain.inference.speaker import EncoderClassifier
-import numpy as np
-from scipy.spatial.distance import cosine
+import voice_service
+from voice_service import ApiError, result_broker
 
 app = Flask(__name__)
 CORS(app)
 
-DB_FILE = "voice_system.db"
-AUDIO_DIR = "user_voices"
-os.makedirs(AUDIO_DIR, exist_ok=True)
-
-
-detector = AntiSpoofing(
-    config_path="./config/AASIST.conf",
-    weights_path="./models/weights/AASIST.pth",
-    device="cpu"
-)
-
-
-speaker_classifier = EncoderClassifier.from_hparams(
-    source="speechbrain/spkrec-ecapa-voxceleb",
-    savedir="pretrained_models/spkrec-ecapa"
-)
-
-
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("PRAGMA journal_mode=WAL;")
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY,
-        phone TEXT UNIQUE,
-        password TEXT,
-        fullname TEXT,
-        voice_filename TEXT,
-        created_at TEXT,
-        last_check_result TEXT,
-        last_check_time TEXT
-    )
-    """)
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS call_status (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        caller TEXT NOT NULL,
-        callee TEXT NOT NULL,
-        status TEXT NOT NULL,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-    
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS voice_verification_results (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        call_id INTEGER NOT NULL,
-        user_id TEXT NOT NULL,
-        opponent_id TEXT NOT NULL,
-        result TEXT NOT NULL,
-        speaker_id TEXT,
-        speaker_name TEXT,
-        speaker_phone TEXT,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-    
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS speaker_embeddings (
-        user_id TEXT PRIMARY KEY,
-        embedding BLOB,
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    )
-    """)
-    
-    conn.commit()
-    conn.close()
-
-init_db()
-
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def deepfake_detect(path):
-    try:
-        res = detector.predict(path)
-        print(f"score={res['score']:.4f}, label={res['label']}")
-        return res['label']
-    except Exception as e:
-        print("Cannot deepfake detect:", e)
-        return "error"
-
-def get_embedding(audio_path):
-    """Trích xuất embedding từ file âm thanh"""
-    try:
-        signal, fs = torchaudio.load(audio_path)
-        
-        # Mono
-        if signal.shape[0] > 1:
-            signal = signal[:1, :]
-            
-        embeddings = speaker_classifier.encode_batch(signal)
-        emb = embeddings.squeeze().detach().cpu().numpy().astype(np.float32)
-        
-        # Check vector 1D
-        if emb.ndim > 1:
-            emb = emb.flatten()
-            
-        return emb
-    except Exception as e:
-        print(f"Error extracting embedding: {e}")
-        return None
-
-def save_embedding(user_id, embedding):
-    """Lưu embedding vào database"""
-    if embedding is None:
-        return False
-        
-    try:
-        emb_blob = embedding.tobytes()
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT OR REPLACE INTO speaker_embeddings (user_id, embedding)
-            VALUES (?, ?)
-        """, (user_id, emb_blob))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Error saving embedding: {e}")
-        return False
 
-def identify_speaker(embedding, threshold=0.7):
-    """Xác định người nói từ embedding"""
-    if embedding is None:
-        return None
-        
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT u.id, u.fullname, u.phone, se.embedding 
-            FROM speaker_embeddings se
-            JOIN users u ON se.user_id = u.id
-        """)
-        rows = cursor.fetchall()
-        conn.close()
-        
-        best_match = None
-        best_score = float('inf')
-        
-        for row in rows:
-            user_id, name, phone, emb_blob = row
-            stored_emb = np.frombuffer(emb_blob, dtype=np.float32)
-            
-
-            probe_emb = embedding.flatten() if embedding.ndim > 1 else embedding
-            stored_emb = stored_emb.flatten() if stored_emb.ndim > 1 else stored_emb
-            
-            dist = cosine(probe_emb, stored_emb)
-            
-            if dist < best_score:
-                best_score = dist
-                best_match = (user_id, name, phone)
-        
-
-        if best_score < threshold:
-            return best_match
-        return None
-    except Exception as e:
-        print(f"Error identifying speaker: {e}")
-        return None
-
-# Hàm xử lý giọng nói trong luồng riêng
-def process_voice_in_thread(temp_path, user_id, call_id, opponent_id):
-    try:
-        # 1. Kiểm tra deepfake
-        label = deepfake_detect(temp_path)
-        
-        # 2. Nhận diện người nói
-        current_emb = get_embedding(temp_path)
-        speaker_info = identify_speaker(current_emb) if current_emb is not None else None
-        
-        # 3. Lưu kết quả vào database
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        if speaker_info:
-            speaker_id, speaker_name, speaker_phone = speaker_info
-            cursor.execute("""
-                INSERT INTO voice_verification_results 
-                (call_id, user_id, opponent_id, result, speaker_id, speaker_name, speaker_phone) 
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (call_id, user_id, opponent_id, label, speaker_id, speaker_name, speaker_phone))
-        else:
-            cursor.execute("""
-                INSERT INTO voice_verification_results 
-                (call_id, user_id, opponent_id, result) 
-                VALUES (?, ?, ?, ?)
-            """, (call_id, user_id, opponent_id, label))
-            
-        conn.commit()
-        conn.close()
-        print(f"Đã lưu kết quả cho user {user_id}: {label}")
-    except Exception as e:
-        print(f"Lỗi khi xử lý giọng nói: {str(e)}")
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+def error_response(e):
+    response = jsonify(e.payload)
+    for name, value in e.headers.items():
+        response.headers[name] = value
+    return response, e.status
 
 @app.route("/register", methods=["POST"])
 def register():
-    phone = request.form.get("phone")
-    password = request.form.get("password")
-    fullname = request.form.get("fullname")
-    voice = request.files.get("voice")
-
-    if not all([phone, password, fullname, voice]):
-        return jsonify({"success": False, "error": "Thiếu thông tin"}), 400
-
-    user_id = str(uuid.uuid4())
-    filename = f"{user_id}.wav"
-    voice_path = os.path.join(AUDIO_DIR, filename)
-    voice.save(voice_path)
-
+    # 1 hoặc nhiều file "voice": mỗi bản ghi là 1 embedding enrollment
+    voices = request.files.getlist("voice")
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-
-        cursor.execute("INSERT INTO users (id, phone, password, fullname, voice_filename, created_at) VALUES (?, ?, ?, ?, ?, ?)", 
-            (user_id, phone, hash_password(password), fullname, filename, datetime.now().isoformat()))
-
-        conn.commit()
-        conn.close()
-        
-        # Trích xuất và lưu embedding
-        embedding = get_embedding(voice_path)
-        save_embedding(user_id, embedding)
-        
-        sip_user_manager.add_user(phone, password)
-        return jsonify({"success": True, "user_id": user_id}), 200
-    except sqlite3.IntegrityError:
-        return jsonify({"success": False, "error": "Số điện thoại đã tồn tại"}), 409
-    except Exception as e:
-        print(f"Lỗi khi đăng ký: {str(e)}")
-        return jsonify({"success": False, "error": "Lỗi hệ thống"}), 500
+        user_id = voice_service.register_user(
+            request.form.get("phone"),
+            request.form.get("password"),
+            request.form.get("fullname"),
+            [voice.read() for voice in voices]
+        )
+    except ApiError as e:
+        return error_response(e)
+    return jsonify({"success": True, "user_id": user_id}), 200
+
+@app.route("/enroll", methods=["POST"])
+def enroll():
+    try:
+        count = voice_service.enroll_voice(
+            request.form.get("phone"),
+            request.form.get("password"),
+            [voice.read() for voice in request.files.getlist("voice")]
+        )
+    except ApiError as e:
+        return error_response(e)
+    return jsonify({"success": True, "utterances": count}), 200
 
 @app.route("/login", methods=["POST"])
 def login():
     data = request.get_json()
-    phone = data.get("phone")
-    password = data.get("password")
-    
-    if not phone or not password:
-        return jsonify({"success": False, "error": "Thiếu thông tin"}), 400
-
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, password, fullname FROM users WHERE phone = ?", (phone,))
-    user = cursor.fetchone()
-    conn.close()
-
-    if user and hash_password(password) == user[1]:
-        return jsonify({
-            "success": True,
-            "user_id": user[0],
-            "fullname": user[2]
-        }), 200
-    else:
-        return jsonify({"success": False, "error": "Sai số điện thoại hoặc mật khẩu"}), 401
+    try:
+        return jsonify(voice_service.login_user(data.get("phone"), data.get("password"))), 200
+    except ApiError as e:
+        return error_response(e)
 
 @app.route("/save-call-status", methods=["GET", "POST"])
 def save_call_status():
@@ -304,30 +70,7 @@ def save_call_status():
         return "Thiếu tham số", 400
     
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        if status == "calling":
-            cursor.execute("""
-                INSERT INTO call_status (caller, callee, status)
-                VALUES (?, ?, ?)
-            """, (caller, callee, status))
-        else:
-            cursor.execute("""
-                UPDATE call_status 
-                SET status = ?
-                WHERE id = (
-                    SELECT id 
-                    FROM call_status 
-                    WHERE (caller = ? OR callee = ?)
-                    AND status = 'calling'
-                    ORDER BY timestamp DESC 
-                    LIMIT 1
-                )
-            """, (status, caller, caller))
-        
-        conn.commit()
-        conn.close()
+        voice_service.update_call_status(caller, callee, status)
         return "OK", 200
     except Exception as e:
         return f"Lỗi: {str(e)}", 500
@@ -340,99 +83,31 @@ def verify_voice():
     if not all([user_id, voice]):
         return jsonify({"success": False, "error": "Thiếu thông tin"}), 400
 
-
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT cs.id, cs.caller, cs.callee 
-        FROM call_status cs
-        JOIN users u ON (u.phone = cs.caller OR u.phone = cs.callee)
-        WHERE u.id = ? AND cs.status = 'calling'
-        ORDER BY cs.timestamp DESC 
-        LIMIT 1
-    """, (user_id,))
-    call_info = cursor.fetchone()
-    
-    if not call_info:
-        conn.close()
-        return jsonify({"success": False, "error": "Không tìm thấy cuộc gọi đang hoạt động"}), 404
-    
-    call_id, caller_phone, callee_phone = call_info
+    try:
+        call_id, opponent_id = voice_service.resolve_call(user_id)
+        clip = voice_service.decode_voice(voice.read())
+        voice_service.submit_verification(clip, user_id, call_id, opponent_id)
+    except ApiError as e:
+        return error_response(e)
     
+    # Wait for opponent result
+    result = result_broker.wait(call_id, opponent_id, timeout=voice_service.VERIFY_TIMEOUT)
+    if result is None:
+        result = voice_service.fetch_stored_result(call_id, opponent_id)
 
-    cursor.execute("SELECT phone FROM users WHERE id = ?", (user_id,))
-    user_info = cursor.fetchone()
-    
-    if not user_info:
-        conn.close()
-        return jsonify({"success": False, "error": "Người dùng không tồn tại"}), 404
-    
-    user_phone = user_info[0]
-    
+    payload, code = voice_service.verification_response(result)
+    return jsonify(payload), code
 
-    opponent_phone = caller_phone if user_phone == callee_phone else callee_phone
-    
-    cursor.execute("SELECT id FROM users WHERE phone = ?", (opponent_phone,))
-    opponent_info = cursor.fetchone()
-    
-    if not opponent_info:
-        conn.close()
-        return jsonify({"success": False, "error": "Không tìm thấy đối phương"}), 404
-    
-    opponent_id = opponent_info[0]
-    conn.close()
+@app.route("/warmup", methods=["GET", "POST"])
+def warmup():
+    try:
+        return jsonify({"success": True, **voice_service.warmup()}), 200
+    except ApiError as e:
+        return error_response(e)
 
-    # Save temp file
-    temp_path = os.path.join(AUDIO_DIR, f"temp_{user_id}_{int(time.time())}.wav")
-    voice.save(temp_path)
-    
-    # Create a thread for handle
-    threading.Thread(
-        target=process_voice_in_thread,
-        args=(temp_path, user_id, call_id, opponent_id)
-    ).start()
-    
-    # Wait for opponent result
-    start_time = time.time()
-    timeout = 15
-    
-    while time.time() - start_time < timeout:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        # Check opponent result
-        cursor.execute("""
-            SELECT result, speaker_id, speaker_name, speaker_phone 
-            FROM voice_verification_results 
-            WHERE call_id = ? AND user_id = ?
-        """, (call_id, opponent_id))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            label, speaker_id, speaker_name, speaker_phone = result
-            
-            response = {
-                "success": True,
-                "label": label
-            }
-            
-            if speaker_id:
-                response["speaker"] = {
-                    "id": speaker_id,
-                    "name": speaker_name,
-                    "phone": speaker_phone
-                }
-            
-            return jsonify(response), 200
-        
-        time.sleep(0.5)
-    
-    return jsonify({
-        "success": False,
-        "error": "Timeout: Không nhận được kết quả từ đối phương"
-    }), 408
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return jsonify(voice_service.metrics()), 200
 
 @app.route("/status", methods=["POST"])
 def get_user_status():
@@ -445,36 +120,15 @@ def get_user_status():
         if not user_id:
             return jsonify({"success": False, "error": "Missing user_id"}), 400
 
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT phone FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        
-        if not user:
-            conn.close()
-            return jsonify({"success": False, "error": "User not found"}), 404
-        
-        phone = user[0]
-        
-        cursor.execute("""
-            SELECT status FROM call_status 
-            WHERE (caller = ? OR callee = ?) 
-            AND status = 'calling'
-            ORDER BY timestamp DESC 
-            LIMIT 1
-        """, (phone, phone))
-        
-        active_call = cursor.fetchone()
-        conn.close()
-        
-        status = "calling" if active_call else "idle"
+        status = voice_service.user_status(user_id)
         
         return jsonify({
             "success": True,
             "status": status
         }), 200
         
+    except ApiError as e:
+        return error_response(e)
     except sqlite3.OperationalError as e:
         return jsonify({
             "success": False,
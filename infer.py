@@ -2,11 +2,21 @@
 
 import json
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+import numpy as np
 import torch
 import torch.nn.functional as F
-import librosa
 from importlib import import_module
 
+import audio_pipeline
+import weights
+from audio_pipeline import AudioClip, for_detector, resample, to_mono
+
 def load_config(cfg_path: str) -> dict:
     """Read JSON config and return dict."""
     with open(cfg_path, 'r') as f:
@@ -20,42 +30,128 @@ def get_model(model_cfg: dict, device: torch.device) -> torch.nn.Module:
     return model
 
 def load_weights(model: torch.nn.Module, weights_path: str, device: torch.device) -> None:
-    """Load state_dict from file .pth to model."""
-    if not os.path.isfile(weights_path):
-        raise FileNotFoundError(f"Cannot find weights at {weights_path}")
-    state = torch.load(weights_path, map_location=device)
-    model.load_state_dict(state)
+    """Load state_dict (.pth hoặc .safetensors đã convert, memory-mapped) vào model."""
+    weights.load_into(model, weights_path, device)
 
-def infer_one(audio_path: str, model: torch.nn.Module, device: torch.device) -> float:
+# Khối "inference" (tùy chọn) trong config/AASIST.conf, ví dụ:
+#   "inference": {"quantization": "dynamic", "channels_last": true, "num_threads": 4}
+# - quantization: "none" | "dynamic" (INT8 dynamic cho nn.Linear, chỉ trên CPU)
+# - channels_last: weight conv 4D ở định dạng NHWC (kernel oneDNN nhanh hơn trên CPU)
+# - num_threads: số intra-op thread của torch (0 = giữ mặc định)
+INFERENCE_DEFAULTS = {"quantization": "none", "channels_last": False, "num_threads": 0}
+
+def optimize_model(model: torch.nn.Module, options: dict, device: torch.device) -> torch.nn.Module:
+    """Áp dụng các tối ưu inference trong options (INFERENCE_DEFAULTS) lên model đã nạp weight."""
+    options = {**INFERENCE_DEFAULTS, **(options or {})}
+    model.eval()
+    if options["num_threads"]:
+        torch.set_num_threads(int(options["num_threads"]))
+    if device.type != "cpu":
+        return model
+    if options["channels_last"]:
+        model = model.to(memory_format=torch.channels_last)
+    quantization = options["quantization"]
+    if quantization == "dynamic":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif quantization != "none":
+        raise ValueError(f"Unsupported quantization mode: {quantization}")
+    return model
+
+WINDOW_SAMPLES = 64600  # ~4 s ở 16 kHz, giống cut trong data_utils.py
+MAX_BATCH_SIZE = 8      # batch lớn nhất khi phục vụ (BatchingAntiSpoofing, AASIST_MAX_BATCH)
+
+class CompiledAASIST:
+    """
+    AASIST đã export (export_model.py): TorchScript (.ts/.pt) hoặc ONNX (.onnx, cần onnxruntime).
+    Graph được trace với độ dài cố định self.length: score_batch cắt / pad lặp từng clip gốc
+    về đúng độ dài đó trước khi gộp batch. Gọi giống model eager: model(x) -> (hidden, logits).
+    """
+    def __init__(self, path: str):
+        self.path = path
+        if path.endswith(".onnx"):
+            import onnxruntime
+            with open(path + ".json") as f:
+                self.meta = json.load(f)
+            opts = onnxruntime.SessionOptions()
+            opts.intra_op_num_threads = torch.get_num_threads()
+            self._session = onnxruntime.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+            self._module = None
+        else:
+            extra = {"aasist.json": ""}
+            self._module = torch.jit.load(path, map_location="cpu", _extra_files=extra)
+            self.meta = json.loads(extra["aasist.json"] or "{}")
+            self._session = None
+        self.length = int(self.meta.get("length", WINDOW_SAMPLES))
+
+    def __call__(self, x: torch.Tensor):
+        if x.shape[1] != self.length:
+            # pad lại batch đã pad sẽ lặp cả phần pad của clip ngắn: dùng pad_batch(wavs, self.length)
+            raise ValueError(f"Compiled AASIST expects {self.length} samples, got {x.shape[1]}")
+        if self._module is not None:
+            return self._module(x)
+        hidden, logits = self._session.run(None, {"wav": x.numpy()})
+        return torch.from_numpy(hidden), torch.from_numpy(logits)
+
+    def eval(self) -> "CompiledAASIST":
+        return self
+
+    def share_memory(self) -> "CompiledAASIST":
+        if self._module is not None:
+            self._module.share_memory()
+        return self
+
+def load_compiled(path: str) -> CompiledAASIST:
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Cannot find compiled model at {path}")
+    return CompiledAASIST(path)
+
+def prepare_wav(wav: np.ndarray, sr: int) -> np.ndarray:
     """
-    - Đọc audio với librosa để hỗ trợ nhiều định dạng.
     - Chuyển stereo → mono, resample về 16 kHz.
-    - Chạy qua model, lấy logits, softmax để ra xác suất lớp spoof (index 1).
+    - Tiền xử lý cho AASIST (preemphasis + normalize).
+    """
+    return for_detector(resample(to_mono(wav), sr))
+
+def load_audio(audio_path: str) -> np.ndarray:
+    """Đọc file audio và tiền xử lý như prepare_wav."""
+    return audio_pipeline.load(audio_path).detector_input
+
+def fit_length(wav: np.ndarray, length: int) -> np.ndarray:
+    """Cắt hoặc pad (lặp lại tín hiệu như data_utils.pad) về đúng length mẫu."""
+    if len(wav) >= length:
+        return wav[:length]
+    if len(wav) == 0:
+        return np.zeros(length, dtype=np.float32)
+    return np.tile(wav, int(np.ceil(length / len(wav))))[:length]
+
+def pad_batch(wavs: List[np.ndarray], length: int = WINDOW_SAMPLES) -> np.ndarray:
+    """
+    Cắt / pad lặp từng waveform về cùng 1 độ dài cố định (như data_utils lúc eval), không
+    phụ thuộc các waveform khác trong batch: score khi gộp batch = score khi chạy riêng.
     """
-    wav, sr = librosa.load(audio_path, sr=None)
-    
-    # wav = librosa.effects.preemphasis(wav, coef=1.0)
-    # wav = librosa.util.normalize(wav)
-    # wav, _ = librosa.effects.trim(wav, top_db=30)
-
-    wav = librosa.effects.preemphasis(wav, coef=1.0)
-    wav = librosa.util.normalize(wav)
-
-    if wav.ndim == 2:
-        wav = wav.mean(axis=1)
-    if sr != 16000:
-        wav = librosa.resample(wav, orig_sr=sr, target_sr=16000)
-        sr = 16000
-    if sr != 16000:
-        raise ValueError(f"Expected 16 kHz audio, got {sr}Hz")
-
-    x = torch.from_numpy(wav).float().unsqueeze(0).to(device)
+    batch = np.empty((len(wavs), length), dtype=np.float32)
+    for i, wav in enumerate(wavs):
+        batch[i] = fit_length(wav, length)
+    return batch
+
+def score_batch(wavs: List[np.ndarray], model: torch.nn.Module, device: torch.device) -> List[float]:
+    """Chạy 1 forward pass cho cả batch, trả về score lớp 1 của từng waveform."""
+    # graph đã export có độ dài cố định riêng (CompiledAASIST.length)
+    x = torch.from_numpy(pad_batch(wavs, getattr(model, "length", WINDOW_SAMPLES))).to(device)
     model.eval()
-    with torch.no_grad():
+    with torch.inference_mode():
         _, logits = model(x)
         probs = F.softmax(logits, dim=1)
+    return probs[:, 1].tolist()
+
+def infer_one(audio_path: str, model: torch.nn.Module, device: torch.device) -> float:
+    """
+    - Đọc audio, chuyển về mono 16 kHz, tiền xử lý (audio_pipeline).
+    - Chạy qua model, lấy logits, softmax để ra xác suất lớp spoof (index 1).
+    """
+    wav = load_audio(audio_path)
     # trả về score của lớp 'spoof' (hoặc genuine tùy định nghĩa config)
-    return probs[:, 1].item()
+    return score_batch([wav], model, device)[0]
 
 class AntiSpoofing:
     """
@@ -66,7 +162,8 @@ class AntiSpoofing:
     def __init__(self,
                  config_path: str = "./config/AASIST.conf",
                  weights_path: str = None,
-                 device: str = None):
+                 device: str = None,
+                 compiled_path: str = None):
         # 1) Load config
         cfg = load_config(config_path)
         self.threshold = cfg.get('threshold', 0.5)
@@ -76,10 +173,24 @@ class AntiSpoofing:
             self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         else:
             self.device = torch.device(device)
-        # 3) Build & load model
-        self.model = get_model(model_cfg, self.device)
-        ckpt = weights_path or cfg.get('model_path')
-        load_weights(self.model, ckpt, self.device)
+        # 3) Build & load model; graph đã export (export_model.py) không cần models.<architecture>
+        compiled_path = compiled_path or cfg.get('compiled_model_path')
+        self.inference_options = {**INFERENCE_DEFAULTS, **cfg.get('inference', {})}
+        if compiled_path and self.device.type != 'cpu':
+            print(f"Bỏ qua graph đã export {compiled_path}: chỉ dùng trên CPU, chạy model eager")
+            compiled_path = None
+        if compiled_path:
+            # file không tồn tại → FileNotFoundError, không âm thầm chạy model eager
+            if self.inference_options["num_threads"]:
+                torch.set_num_threads(int(self.inference_options["num_threads"]))
+            self.model = load_compiled(compiled_path)
+        else:
+            self.model = get_model(model_cfg, self.device)
+            ckpt = weights_path or cfg.get('model_path')
+            load_weights(self.model, ckpt, self.device)
+            self.model = optimize_model(self.model, self.inference_options, self.device)
+        # 4) Kernel resample cho 8k/22.05k/44.1k/48k → 16k được thiết kế sẵn
+        audio_pipeline.prewarm_resamplers()
 
     def predict(self, audio_path: str) -> dict:
         """
@@ -90,5 +201,210 @@ class AntiSpoofing:
         }
         """
         score = infer_one(audio_path, self.model, self.device)
+        return self.make_result(score)
+
+    def predict_array(self, wav: np.ndarray, sr: int) -> dict:
+        """Như predict nhưng nhận waveform đã giải mã trong bộ nhớ."""
+        score = score_batch([prepare_wav(wav, sr)], self.model, self.device)[0]
+        return self.make_result(score)
+
+    def predict_clip(self, clip: AudioClip) -> dict:
+        """Như predict nhưng dùng AudioClip đã qua audio_pipeline (dùng chung với ECAPA)."""
+        score = score_batch([clip.detector_input], self.model, self.device)[0]
+        return self.make_result(score)
+
+    def make_result(self, score: float) -> dict:
         label = "genuine" if score >= self.threshold else "spoof"
         return {'score': score, 'label': label}
+
+    def stream(self, **kwargs) -> "StreamingScorer":
+        """Tạo StreamingScorer để chấm điểm audio theo từng chunk PCM của cuộc gọi."""
+        return StreamingScorer(
+            lambda wav: score_batch([wav], self.model, self.device)[0],
+            threshold=self.threshold, **kwargs)
+
+
+
+class BatchingAntiSpoofing:
+    """
+    Micro-batching quanh AntiSpoofing:
+    - các luồng gọi predict() đưa waveform vào hàng đợi và nhận Future
+    - 1 luồng worker gom tối đa max_batch_size waveform (hoặc chờ tối đa
+      max_wait_ms kể từ phần tử đầu tiên), đưa về độ dài cố định WINDOW_SAMPLES và chạy
+      1 forward pass
+    - score được trả lại cho từng Future
+    """
+    def __init__(self,
+                 detector: AntiSpoofing,
+                 max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait_ms: float = 10.0):
+        self.detector = detector
+        self.threshold = detector.threshold
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="aasist-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, wav: np.ndarray) -> Future:
+        """Đưa 1 waveform 16 kHz đã tiền xử lý vào hàng đợi, trả về Future chứa score."""
+        future = Future()
+        self._queue.put((wav, future))
+        return future
+
+    def predict(self, audio_path: str) -> dict:
+        """Giống AntiSpoofing.predict nhưng forward pass được gộp với các request khác."""
+        score = self.submit(load_audio(audio_path)).result()
+        return self.detector.make_result(score)
+
+    def predict_array(self, wav: np.ndarray, sr: int) -> dict:
+        score = self.submit(prepare_wav(wav, sr)).result()
+        return self.detector.make_result(score)
+
+    def predict_clip(self, clip: AudioClip) -> dict:
+        score = self.submit(clip.detector_input).result()
+        return self.detector.make_result(score)
+
+    def stream(self, **kwargs) -> "StreamingScorer":
+        """Như AntiSpoofing.stream, các cửa sổ của nhiều cuộc gọi được gộp batch."""
+        return StreamingScorer(
+            lambda wav: self.submit(wav).result(),
+            threshold=self.threshold, **kwargs)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self) -> list:
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            batch = [(wav, fut) for wav, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                scores = score_batch([wav for wav, _ in batch], self.detector.model, self.detector.device)
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), score in zip(batch, scores):
+                fut.set_result(score)
+
+
+class StreamingScorer:
+    """
+    Chấm điểm deepfake theo thời gian thực:
+    - feed(pcm): nhận chunk PCM (float32 [-1, 1] hoặc int16) ở sample_rate
+    - mỗi khi đủ dữ liệu, cửa sổ 64600 mẫu (tính ở 16 kHz) trượt theo hop được
+      lấy từ ring buffer, tiền xử lý và chấm điểm trong bộ nhớ
+    - score tổng hợp = trung bình các cửa sổ; khi có ít nhất min_windows cửa sổ
+      và trung bình cách ngưỡng hơn margin thì đưa ra quyết định sớm
+    """
+    def __init__(self,
+                 score_fn,
+                 threshold: float = 0.5,
+                 sample_rate: int = 16000,
+                 hop_seconds: float = 2.0,
+                 min_windows: int = 2,
+                 margin: float = 0.2):
+        self.score_fn = score_fn
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.min_windows = min_windows
+        self.margin = margin
+        self.window = int(round(WINDOW_SAMPLES * sample_rate / 16000))
+        self.hop = int(round(hop_seconds * sample_rate))
+        self._ring = np.zeros(self.window, dtype=np.float32)
+        self._write = 0
+        self._total = 0
+        self._next_end = self.window
+        self.scores = []
+        self.decision = None
+
+    def feed(self, pcm) -> List[dict]:
+        """Thêm 1 chunk PCM, trả về danh sách kết quả của các cửa sổ mới được chấm."""
+        pcm = np.asarray(pcm)
+        if pcm.dtype == np.int16:
+            pcm = pcm.astype(np.float32) / 32768.0
+        else:
+            pcm = pcm.astype(np.float32, copy=False)
+        if pcm.ndim == 2:
+            pcm = pcm.mean(axis=1)
+
+        events = []
+        offset = 0
+        while offset < len(pcm):
+            # Không ghi quá điểm kết thúc của cửa sổ kế tiếp để ring buffer không bị ghi đè
+            n = min(len(pcm) - offset, self._next_end - self._total)
+            self._push(pcm[offset:offset + n])
+            offset += n
+            if self._total == self._next_end:
+                events.append(self._score(self._latest()))
+                self._next_end += self.hop
+        return events
+
+    def finish(self) -> dict:
+        """Kết thúc stream; audio ngắn hơn 1 cửa sổ vẫn được chấm (pad lặp lại)."""
+        if not self.scores and self._total > 0:
+            self._score(self._latest()[-self._total:])
+        return self.result()
+
+    def result(self) -> dict:
+        if not self.scores:
+            return {'score': None, 'label': None, 'windows': 0, 'final': False}
+        score = float(np.mean(self.scores))
+        label = self.decision or ("genuine" if score >= self.threshold else "spoof")
+        return {'score': score, 'label': label, 'windows': len(self.scores),
+                'final': self.decision is not None}
+
+    def _push(self, chunk: np.ndarray) -> None:
+        n = len(chunk)
+        if n >= self.window:
+            self._ring[:] = chunk[-self.window:]
+            self._write = 0
+        else:
+            first = min(n, self.window - self._write)
+            self._ring[self._write:self._write + first] = chunk[:first]
+            self._ring[:n - first] = chunk[first:]
+            self._write = (self._write + n) % self.window
+        self._total += n
+
+    def _latest(self) -> np.ndarray:
+        return np.concatenate((self._ring[self._write:], self._ring[:self._write]))
+
+    def _score(self, segment: np.ndarray) -> dict:
+        wav = segment
+        wav = fit_length(resample(wav, self.sample_rate), WINDOW_SAMPLES)
+        score = float(self.score_fn(for_detector(wav)))
+        self.scores.append(score)
+
+        mean = float(np.mean(self.scores))
+        if self.decision is None and len(self.scores) >= self.min_windows:
+            if mean >= self.threshold + self.margin:
+                self.decision = "genuine"
+            elif mean <= self.threshold - self.margin:
+                self.decision = "spoof"
+        return {'window': len(self.scores) - 1, 'score': score, 'mean': mean,
+                'decision': self.decision}
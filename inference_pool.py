@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Bounded inference executor.
+
+Thay cho việc tạo 1 thread cho mỗi request: số worker cố định, hàng đợi có giới hạn,
+khi đầy thì từ chối ngay (PoolSaturated) để HTTP layer trả 503 + Retry-After.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class PoolSaturated(Exception):
+    """Hàng đợi inference đã đầy."""
+
+
+class InferencePool:
+    """
+    - workers: số task inference chạy đồng thời
+    - max_queue: số task được phép chờ thêm khi tất cả worker đều bận
+    - torch_threads: số intra-op thread của torch (None = giữ mặc định)
+    Pool giữ tham chiếu tới các model (detector AASIST, speaker_classifier ECAPA).
+    """
+    def __init__(self,
+                 detector,
+                 speaker_classifier,
+                 workers: int = 2,
+                 max_queue: int = 16,
+                 torch_threads: int = None,
+                 retry_after: int = 2):
+        if torch_threads:
+            import torch
+            torch.set_num_threads(torch_threads)
+        self.detector = detector
+        self.speaker_classifier = speaker_classifier
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_times = deque(maxlen=1024)
+        self._run_times = deque(maxlen=1024)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Đưa task vào pool; raise PoolSaturated nếu không còn chỗ."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PoolSaturated(f"inference queue full ({self.workers + self.max_queue} slots)")
+
+        enqueued_at = time.monotonic()
+        with self._lock:
+            self._submitted += 1
+            self._pending += 1
+
+        def task():
+            started_at = time.monotonic()
+            with self._lock:
+                self._pending -= 1
+                self._running += 1
+                self._wait_times.append(started_at - enqueued_at)
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._run_times.append(time.monotonic() - started_at)
+                    if ok:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+                self._slots.release()
+
+        try:
+            return self._executor.submit(task)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+            raise
+
+    def metrics(self) -> dict:
+        with self._lock:
+            waits = sorted(self._wait_times)
+            runs = sorted(self._run_times)
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self._pending,
+                "running": self._running,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "completed": self._completed,
+                "failed": self._failed,
+                "wait_ms": _summary_ms(waits),
+                "run_ms": _summary_ms(runs),
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+def _summary_ms(values: list) -> dict:
+    """avg / p50 / p95 / max (ms) từ danh sách thời gian (giây) đã sort."""
+    if not values:
+        return {"avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+
+    def pct(p):
+        return values[min(len(values) - 1, int(p * len(values)))] * 1000.0
+
+    return {
+        "avg": sum(values) / len(values) * 1000.0,
+        "p50": pct(0.50),
+        "p95": pct(0.95),
+        "max": values[-1] * 1000.0,
+    }
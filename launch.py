@@ -30,14 +30,14 @@ except FileNotFoundError:
 
 time.sleep(1)
 
-http_script_path = os.path.join(working_dir, "http_server.py")
+http_script_path = os.path.join(working_dir, "asgi_server.py")
 try:
     subprocess.Popen([
         "gnome-terminal",
         "--", "bash", "-c",
         f"source {working_dir}/venv/bin/activate && python {http_script_path}; exec bash"
     ])
-    print("Đã mở terminal mới để chạy 'http_server.py'.")
+    print("Đã mở terminal mới để chạy 'asgi_server.py'.")
 except FileNotFoundError:
     print("Không tìm thấy gnome-terminal. Hãy thay bằng terminal khác nếu cần.")
 
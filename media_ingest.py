@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Nhận audio cuộc gọi trực tiếp từ Asterisk (không qua file WAV).
+
+- RTP (ARI ExternalMedia, format=ulaw/alaw): mỗi SSRC là 1 leg, payload G.711 được
+  giải mã bằng bảng tra (g711.py). Để nghe lén 1 leg mà không chiếm kênh, tạo
+  snoop channel qua ARI rồi bridge với externalMedia trỏ về --rtp-port.
+- AudioSocket (TCP): frame [type:1][len:2][payload], audio là slin 16-bit 8 kHz.
+
+Audio của mỗi leg được đưa thẳng vào StreamingScorer (AASIST) và, khi đủ
+embed_seconds, vào speaker encoder.
+
+Production: chạy trong process của asgi_server.py (MEDIA_RTP_PORT / MEDIA_AUDIOSOCKET_PORT),
+kết quả mỗi leg đi qua result_broker + BatchWriter như /verify-voice (result_events).
+Dialplan gắn leg với số điện thoại bằng sự kiện call-status status=media:
+    AGI(agi://127.0.0.1:4573/call-status,<phone>,<UUID AudioSocket | ip:port RTP nguồn>,media)
+Chạy riêng (serve) chỉ in kết quả ra màn hình, dùng để thử:
+
+    python media_ingest.py serve --rtp-port 4000 --audiosocket-port 9092
+    python media_ingest.py send call.wav --port 4000          # giả lập Asterisk gửi RTP
+"""
+import argparse
+import asyncio
+import random
+import socket
+import struct
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import audio_pipeline
+import g711
+
+RTP_PAYLOAD_TYPES = {0: g711.decode_ulaw, 8: g711.decode_alaw}
+
+AUDIOSOCKET_HANGUP = 0x00
+AUDIOSOCKET_UUID = 0x01
+AUDIOSOCKET_AUDIO = 0x10
+AUDIOSOCKET_ERROR = 0xff
+
+
+class LegSession:
+    """
+    1 leg của cuộc gọi. Audio được gom lại và xử lý tuần tự trên thread pool,
+    event loop không bao giờ bị chặn bởi inference.
+    """
+    def __init__(self, session_id: str, scorer, executor: ThreadPoolExecutor,
+                 on_event=None, speaker_fn=None, embed_seconds: float = 6.0,
+                 sample_rate: int = g711.SAMPLE_RATE):
+        self.session_id = session_id
+        self.scorer = scorer
+        self.executor = executor
+        self.on_event = on_event
+        self.speaker_fn = speaker_fn
+        self.sample_rate = sample_rate
+        self.embed_samples = int(embed_seconds * sample_rate)
+        self.last_seen = time.monotonic()
+        self.closed = False
+        self.speaker = None
+        self.source = None    # "ip:port" gửi RTP của leg
+        self.published = False
+        self.rtp_last = None  # (seq, timestamp, số mẫu) của gói RTP gần nhất
+        self._lock = threading.Lock()
+        self._pending = []
+        self._scheduled = False
+        self._speech = []
+        self._speech_len = 0
+
+    def push(self, pcm: np.ndarray) -> None:
+        self.last_seen = time.monotonic()
+        with self._lock:
+            self._pending.append(pcm)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.executor.submit(self._drain)
+
+    def close(self) -> None:
+        with self._lock:
+            self.closed = True
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.executor.submit(self._drain)
+
+    def _drain(self) -> None:
+        while True:
+            with self._lock:
+                chunks, self._pending = self._pending, []
+                closed = self.closed
+                if not chunks:
+                    self._scheduled = False
+                    break
+            self._process(np.concatenate(chunks))
+        if closed:
+            self._finish()
+
+    def _process(self, pcm: np.ndarray) -> None:
+        try:
+            for event in self.scorer.feed(pcm):
+                self._emit("window", event)
+            if self.speaker_fn is not None and self.speaker is None:
+                self._speech.append(pcm)
+                self._speech_len += len(pcm)
+                if self._speech_len >= self.embed_samples:
+                    self._identify()
+        except Exception as e:
+            print(f"[{self.session_id}] Lỗi khi xử lý audio: {e}")
+
+    def _identify(self) -> None:
+        clip = audio_pipeline.AudioClip(np.concatenate(self._speech), self.sample_rate)
+        self._speech = []
+        self.speaker = self.speaker_fn(clip) or ()
+        self._emit("speaker", {"speaker": self.speaker or None})
+
+    def _finish(self) -> None:
+        try:
+            if self.speaker_fn is not None and self.speaker is None and self._speech_len:
+                self._identify()
+            self._emit("final", self.scorer.finish())
+        except Exception as e:
+            print(f"[{self.session_id}] Lỗi khi kết thúc leg: {e}")
+
+    def _emit(self, kind: str, payload: dict) -> None:
+        if self.on_event is not None:
+            self.on_event(self, kind, payload)
+
+
+def result_events(publish):
+    """
+    on_event của LegSession gọi publish(keys, label, speaker) đúng 1 lần mỗi leg: khi đã
+    có quyết định deepfake sớm và người nói (nếu có speaker_fn), muộn nhất lúc leg kết thúc.
+    Các sự kiện của 1 leg được xử lý tuần tự nên cờ published không cần lock.
+    """
+    def on_event(session, kind, payload):
+        if session.published:
+            return
+        label = session.scorer.decision
+        if kind == "final":
+            label = payload["label"]
+        elif session.speaker_fn is not None and session.speaker is None:
+            label = None
+        if label is None:
+            return
+        session.published = True
+        keys = [k for k in (session.session_id, session.source) if k]
+        publish(keys, label, session.speaker or None)
+
+    return on_event
+
+
+class MediaIngest:
+    """Quản lý các leg; session_factory(session_id) tạo LegSession mới."""
+    def __init__(self, session_factory, idle_timeout: float = 10.0):
+        self.session_factory = session_factory
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+
+    def get(self, session_id: str) -> LegSession:
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = self.session_factory(session_id)
+        return session
+
+    def close(self, session_id: str) -> None:
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+
+    async def reap_idle(self) -> None:
+        """RTP không có tín hiệu kết thúc: leg im lặng quá idle_timeout được coi là đã cúp máy."""
+        while True:
+            await asyncio.sleep(self.idle_timeout / 2)
+            now = time.monotonic()
+            for session_id, session in list(self.sessions.items()):
+                if now - session.last_seen > self.idle_timeout:
+                    self.close(session_id)
+
+
+class RtpProtocol(asyncio.DatagramProtocol):
+    """RTP/UDP, payload PCMU (PT 0) hoặc PCMA (PT 8)."""
+    def __init__(self, ingest: MediaIngest):
+        self.ingest = ingest
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if len(data) < 12 or data[0] >> 6 != 2:
+            return
+        csrc_count = data[0] & 0x0F
+        has_extension = data[0] & 0x10
+        has_padding = data[0] & 0x20
+        payload_type = data[1] & 0x7F
+        seq, timestamp, ssrc = struct.unpack_from("!HII", data, 2)
+        offset = 12 + 4 * csrc_count
+        if has_extension:
+            if len(data) < offset + 4:
+                return
+            ext_words = struct.unpack_from("!H", data, offset + 2)[0]
+            offset += 4 + 4 * ext_words
+        end = len(data) - (data[-1] if has_padding else 0)
+        decode = RTP_PAYLOAD_TYPES.get(payload_type)
+        if decode is None or offset >= end:
+            return
+
+        session = self.ingest.get(f"{ssrc:08x}")
+        session.source = f"{addr[0]}:{addr[1]}"
+        pcm = decode(memoryview(data)[offset:end])
+        last = session.rtp_last
+        if last is not None:
+            delta = (seq - last[0]) & 0xFFFF
+            if delta == 0 or delta > 0x8000:
+                return  # trùng hoặc đến muộn
+            gap = (timestamp - last[1] - last[2]) & 0xFFFFFFFF
+            if 0 < gap <= g711.SAMPLE_RATE:
+                # mất gói: chèn khoảng lặng để timeline của cửa sổ không bị lệch
+                pcm = np.concatenate((np.zeros(gap, dtype=np.float32), pcm))
+                timestamp -= gap
+        session.rtp_last = (seq, timestamp & 0xFFFFFFFF, len(pcm))
+        session.push(pcm)
+
+
+async def handle_audiosocket(ingest: MediaIngest, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter) -> None:
+    session_id = None
+    try:
+        while True:
+            header = await reader.readexactly(3)
+            kind, length = header[0], struct.unpack("!H", header[1:])[0]
+            payload = await reader.readexactly(length) if length else b""
+            if kind == AUDIOSOCKET_UUID:
+                session_id = str(uuid.UUID(bytes=payload))
+            elif kind == AUDIOSOCKET_AUDIO and session_id is not None:
+                pcm = np.frombuffer(payload, dtype="<i2").astype(np.float32) / 32768.0
+                ingest.get(session_id).push(pcm)
+            elif kind in (AUDIOSOCKET_HANGUP, AUDIOSOCKET_ERROR):
+                break
+    except asyncio.IncompleteReadError:
+        pass
+    finally:
+        if session_id is not None:
+            ingest.close(session_id)
+        writer.close()
+
+
+async def start(ingest: MediaIngest, host: str, rtp_port: int, audiosocket_port: int):
+    """Mở cổng RTP / AudioSocket (port 0 = tắt) trên event loop đang chạy, trả về coroutine close()."""
+    loop = asyncio.get_running_loop()
+    transport = server = None
+    if rtp_port:
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: RtpProtocol(ingest), local_addr=(host, rtp_port))
+    if audiosocket_port:
+        server = await asyncio.start_server(
+            lambda r, w: handle_audiosocket(ingest, r, w), host, audiosocket_port)
+    reaper = loop.create_task(ingest.reap_idle())
+    print(f"[{time.ctime()}] RTP trên UDP {host}:{rtp_port}, AudioSocket trên TCP {host}:{audiosocket_port}")
+
+    async def close():
+        reaper.cancel()
+        if transport is not None:
+            transport.close()
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+        for session_id in list(ingest.sessions):
+            ingest.close(session_id)
+
+    return close
+
+
+async def serve(ingest: MediaIngest, host: str, rtp_port: int, audiosocket_port: int) -> None:
+    close = await start(ingest, host, rtp_port, audiosocket_port)
+    try:
+        await asyncio.get_running_loop().create_future()
+    finally:
+        await close()
+
+
+def send_rtp(path: str, host: str, port: int, alaw: bool = False, ptime_ms: int = 20) -> None:
+    """Giả lập Asterisk ExternalMedia: đọc file, mã hóa G.711 và gửi RTP theo thời gian thực."""
+    clip_wav, sr = audio_pipeline.decode(path)
+    pcm = audio_pipeline.resample(audio_pipeline.to_mono(clip_wav), sr, g711.SAMPLE_RATE)
+    payload = g711.encode_alaw(pcm) if alaw else g711.encode_ulaw(pcm)
+    frame = g711.SAMPLE_RATE * ptime_ms // 1000
+    payload_type = 8 if alaw else 0
+    ssrc = random.getrandbits(32)
+    seq = random.getrandbits(16)
+    timestamp = random.getrandbits(32)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = time.monotonic()
+    for i in range(0, len(payload), frame):
+        header = struct.pack("!BBHII", 0x80, payload_type, seq, timestamp, ssrc)
+        sock.sendto(header + payload[i:i + frame], (host, port))
+        seq = (seq + 1) & 0xFFFF
+        timestamp = (timestamp + frame) & 0xFFFFFFFF
+        delay = start + (i // frame + 1) * ptime_ms / 1000.0 - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    print(f"Đã gửi {len(payload) / g711.SAMPLE_RATE:.1f}s audio, SSRC {ssrc:08x}")
+
+
+def load_speaker_fn(db_file: str, threshold: float = 0.7):
+    """ECAPA + speaker index nạp từ speaker_embeddings, trả về hàm clip → (id, name, phone)."""
+    import db
+    from speechbrain.inference.speaker import EncoderClassifier
+    from speaker_index import SpeakerIndex
+
+    classifier = EncoderClassifier.from_hparams(
+        source="speechbrain/spkrec-ecapa-voxceleb",
+        savedir="pretrained_models/spkrec-ecapa"
+    )
+    index = SpeakerIndex()
+    with db.get_pool(db_file).connection() as conn:
+        index.load_rows(conn.execute(db.SQL_ALL_EMBEDDINGS).fetchall())
+
+    def speaker_fn(clip):
+        emb = classifier.encode_batch(clip.encoder_input).squeeze().detach().cpu().numpy()
+        matches = index.search(emb, k=1)
+        if matches and matches[0][3] < threshold:
+            return matches[0][:3]
+        return None
+
+    return speaker_fn
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Asterisk RTP / AudioSocket ingest")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_serve = sub.add_parser("serve")
+    p_serve.add_argument("--host", default="0.0.0.0")
+    p_serve.add_argument("--rtp-port", type=int, default=4000)
+    p_serve.add_argument("--audiosocket-port", type=int, default=9092)
+    p_serve.add_argument("--workers", type=int, default=2)
+    p_serve.add_argument("--config", default="./config/AASIST.conf")
+    p_serve.add_argument("--weights", default="./models/weights/AASIST.pth")
+    p_serve.add_argument("--speaker", action="store_true",
+                         help="also identify the speaker of each leg (ECAPA + speaker index)")
+    p_serve.add_argument("--db", default="voice_system.db")
+    p_send = sub.add_parser("send")
+    p_send.add_argument("path")
+    p_send.add_argument("--host", default="127.0.0.1")
+    p_send.add_argument("--port", type=int, default=4000)
+    p_send.add_argument("--alaw", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "send":
+        send_rtp(args.path, args.host, args.port, alaw=args.alaw)
+        return
+
+    from infer import AntiSpoofing, BatchingAntiSpoofing
+    detector = BatchingAntiSpoofing(
+        AntiSpoofing(config_path=args.config, weights_path=args.weights, device="cpu"))
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="ingest")
+
+    speaker_fn = load_speaker_fn(args.db) if args.speaker else None
+
+    def on_event(session, kind, payload):
+        print(f"[{session.session_id}] {kind}: {payload}")
+
+    def factory(session_id):
+        return LegSession(session_id, detector.stream(sample_rate=g711.SAMPLE_RATE),
+                          executor, on_event=on_event, speaker_fn=speaker_fn)
+
+    ingest = MediaIngest(factory)
+    try:
+        asyncio.run(serve(ingest, args.host, args.rtp_port, args.audiosocket_port))
+    except KeyboardInterrupt:
+        print("\nDỪNG SERVER")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Pre-fork inference: dùng hết các core mà không nhân bản weight.
+
+Process cha nạp AASIST + ECAPA 1 lần, chuyển toàn bộ parameter/buffer sang shared memory
+(nn.Module.share_memory()) rồi fork N worker process. Mỗi worker:
+- đặt số intra-op thread cố định (torch.set_num_threads), có thể ghim vào 1 nhóm core
+- nhận waveform qua pipe riêng, gộp các request đang chờ thành 1 batch AASIST
+- trả score / embedding về process cha
+Weight nằm trên cùng các trang shared memory nên RSS tổng gần như không đổi khi tăng N.
+
+Process cha giữ nguyên vai trò cũ (HTTP, call registry, broker, ghi DB); ProcessInferencePool
+có cùng interface với InferencePool nên voice_service không phải đổi gì.
+Nên fork trước khi chạy bất kỳ forward pass nào ở process cha (MODEL_LOADING=eager).
+
+Đo throughput và tổng PSS theo số worker:
+    python prefork_pool.py --processes 1 2 4 8 --requests 200
+"""
+import argparse
+import collections
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, wait
+from multiprocessing.connection import wait as wait_ready
+
+import numpy as np
+import torch
+
+from infer import StreamingScorer, prepare_wav, score_batch
+from inference_pool import InferencePool
+
+
+def _worker_main(index, detector, speaker_classifier, conn,
+                 threads: int, cpus, max_batch_size: int) -> None:
+    torch.set_num_threads(threads)
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    print(f"Inference worker {index} (pid {os.getpid()}): {threads} thread, cpu={cpus or 'all'}")
+
+    backlog = collections.deque()
+    while True:
+        try:
+            task = backlog.popleft() if backlog else conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        batch = [task]
+        if task[1] == "score":
+            # gom thêm các waveform đang chờ sẵn thành 1 forward pass
+            while len(batch) < max_batch_size and (backlog or conn.poll()):
+                more = backlog.popleft() if backlog else conn.recv()
+                if more is None or more[1] != "score":
+                    backlog.appendleft(more)
+                    break
+                batch.append(more)
+
+        try:
+            if task[1] == "score":
+                scores = score_batch([t[2] for t in batch], detector.model, detector.device)
+                for t, score in zip(batch, scores):
+                    conn.send((t[0], True, score))
+            else:
+                with torch.no_grad():
+                    emb = speaker_classifier.encode_batch(torch.from_numpy(task[2]))
+                conn.send((task[0], True, emb.detach().cpu().numpy()))
+        except Exception as e:
+            for t in batch:
+                conn.send((t[0], False, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    """1 worker process + pipe riêng (task đi, kết quả về) + các task đang giao cho nó."""
+    def __init__(self, index: int, proc, conn):
+        self.index = index
+        self.proc = proc
+        self.conn = conn
+        self.pending = set()
+        self.send_lock = threading.Lock()
+        self.dead = False
+
+
+class RemoteDetector:
+    """Thay cho BatchingAntiSpoofing ở process cha: score được tính ở worker process."""
+    def __init__(self, pool: "ProcessInferencePool", detector):
+        self._pool = pool
+        self._detector = detector
+        self.threshold = detector.threshold
+
+    def submit(self, wav: np.ndarray) -> Future:
+        return self._pool.call("score", np.ascontiguousarray(wav, dtype=np.float32))
+
+    def _score(self, wav: np.ndarray) -> float:
+        return self.submit(wav).result(timeout=self._pool.task_timeout)
+
+    def predict_array(self, wav: np.ndarray, sr: int) -> dict:
+        return self._detector.make_result(self._score(prepare_wav(wav, sr)))
+
+    def predict_clip(self, clip) -> dict:
+        return self._detector.make_result(self._score(clip.detector_input))
+
+    def stream(self, **kwargs) -> StreamingScorer:
+        return StreamingScorer(self._score, threshold=self.threshold, **kwargs)
+
+
+class RemoteEncoder:
+    """Thay cho EncoderClassifier ở process cha: encode_batch chạy ở worker process."""
+    def __init__(self, pool: "ProcessInferencePool"):
+        self._pool = pool
+
+    def encode_batch(self, wavs):
+        wavs = wavs.detach().cpu().numpy() if torch.is_tensor(wavs) else np.asarray(wavs)
+        emb = self._pool.call("embed", np.ascontiguousarray(wavs, dtype=np.float32))
+        return torch.from_numpy(emb.result(timeout=self._pool.task_timeout))
+
+
+class ProcessInferencePool(InferencePool):
+    """
+    - processes: số worker process (mặc định = số core / threads_per_process)
+    - threads_per_process: intra-op thread của torch trong mỗi worker
+    - pin_cpus: ghim worker i vào các core [i*T, (i+1)*T)
+    - workers / max_queue: giới hạn số task đang chạy / chờ ở process cha (như InferencePool)
+    Mỗi worker có 1 pipe riêng; task được giao cho worker đang ít việc nhất. Thread đọc kết
+    quả chờ đồng thời trên pipe và sentinel của các worker: worker chết thì các task của
+    nó lỗi ngay; worker mới được fork bởi 1 thread supervisor chỉ làm đúng việc đó (không
+    fork từ thread đọc kết quả đang giữ lock). Task quá task_timeout bị hủy.
+    """
+    def __init__(self,
+                 detector,
+                 speaker_classifier,
+                 processes: int = None,
+                 threads_per_process: int = 1,
+                 pin_cpus: bool = False,
+                 workers: int = None,
+                 max_queue: int = 16,
+                 max_batch_size: int = 8,
+                 task_timeout: float = 60.0,
+                 retry_after: int = 2):
+        cores = os.cpu_count() or 1
+        self.processes = processes or max(1, cores // threads_per_process)
+        self.threads_per_process = threads_per_process
+        self.task_timeout = task_timeout
+        self.pin_cpus = pin_cpus
+        self.max_batch_size = max_batch_size
+        self._ctx = multiprocessing.get_context("fork")
+        self._futures = {}  # task_id → (future, hạn chót, worker)
+        self._futures_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._closing = False
+        self._respawns = 0
+        self._timeouts = 0
+
+        # weight → shared memory, các worker fork ra dùng chung
+        detector.model.eval()
+        detector.model.share_memory()
+        speaker_classifier.mods.eval()
+        speaker_classifier.mods.share_memory()
+        self._detector = detector
+        self._speaker_classifier = speaker_classifier
+
+        self._workers = [self._spawn(i) for i in range(self.processes)]
+
+        self._respawn = queue.Queue()
+        self._supervisor = threading.Thread(target=self._supervise, name="inference-supervisor", daemon=True)
+        self._supervisor.start()
+        self._reader = threading.Thread(target=self._read_results, name="inference-results", daemon=True)
+        self._reader.start()
+
+        # Thread ở process cha chỉ chờ IPC; đủ nhiều để mỗi worker luôn có việc kế tiếp
+        super().__init__(RemoteDetector(self, detector),
+                         RemoteEncoder(self),
+                         workers=workers or self.processes * 2,
+                         max_queue=max_queue,
+                         retry_after=retry_after)
+
+    def _spawn(self, index: int) -> _Worker:
+        cores = os.cpu_count() or 1
+        cpus = None
+        if self.pin_cpus:
+            t = self.threads_per_process
+            cpus = {c % cores for c in range(index * t, (index + 1) * t)}
+        parent_conn, child_conn = self._ctx.Pipe()
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self._detector, self._speaker_classifier, child_conn,
+                  self.threads_per_process, cpus, self.max_batch_size),
+            name=f"inference-{index}", daemon=True)
+        proc.start()
+        child_conn.close()
+        return _Worker(index, proc, parent_conn)
+
+    def call(self, kind: str, payload: np.ndarray) -> Future:
+        task_id = next(self._ids)
+        future = Future()
+        with self._futures_lock:
+            alive = [w for w in self._workers if not w.dead]
+            if not alive:
+                future.set_exception(RuntimeError("No inference worker alive"))
+                return future
+            worker = min(alive, key=lambda w: len(w.pending))
+            worker.pending.add(task_id)
+            self._futures[task_id] = (future, time.monotonic() + self.task_timeout, worker)
+        try:
+            with worker.send_lock:
+                worker.conn.send((task_id, kind, payload))
+        except (OSError, ValueError) as e:
+            # worker vừa chết: supervisor sẽ fork worker mới
+            self._finish(task_id, exception=RuntimeError(f"Inference worker {worker.index} unavailable: {e}"))
+        return future
+
+    def _finish(self, task_id, result=None, exception=None) -> None:
+        with self._futures_lock:
+            entry = self._futures.pop(task_id, None)
+            if entry is None:
+                return
+            entry[2].pending.discard(task_id)
+        if exception is not None:
+            entry[0].set_exception(exception)
+        else:
+            entry[0].set_result(result)
+
+    def _replace(self, worker: _Worker) -> None:
+        """Worker chết: lỗi ngay các task của nó, nhờ supervisor fork worker mới vào chỗ đó."""
+        with self._futures_lock:
+            worker.dead = True
+        worker.proc.join(timeout=1)
+        worker.conn.close()
+        print(f"Inference worker {worker.index} (pid {worker.proc.pid}) đã dừng, "
+              f"exitcode={worker.proc.exitcode}, {len(worker.pending)} task bị hủy")
+        error = RuntimeError(f"Inference worker {worker.index} died (exitcode {worker.proc.exitcode})")
+        for task_id in list(worker.pending):
+            self._finish(task_id, exception=error)
+        if not self._closing:
+            self._respawn.put(worker.index)
+
+    def _supervise(self) -> None:
+        while True:
+            index = self._respawn.get()
+            if index is None or self._closing:
+                return
+            try:
+                replacement = self._spawn(index)
+            except Exception as e:
+                print(f"Không fork được inference worker {index}: {e}")
+                time.sleep(1.0)
+                self._respawn.put(index)
+                continue
+            with self._futures_lock:
+                self._workers[index] = replacement
+            self._respawns += 1
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        with self._futures_lock:
+            expired = [task_id for task_id, (_, deadline, _) in self._futures.items() if deadline < now]
+        for task_id in expired:
+            self._timeouts += 1
+            self._finish(task_id, exception=TimeoutError(f"Inference task quá {self.task_timeout}s"))
+
+    def _read_results(self) -> None:
+        while not self._closing:
+            workers = [w for w in self._workers if not w.dead]
+            by_handle = {}
+            for w in workers:
+                by_handle[w.conn] = w
+                by_handle[w.proc.sentinel] = w
+            dead = set()
+            for handle in wait_ready(list(by_handle), timeout=1.0):
+                worker = by_handle[handle]
+                if handle is not worker.conn:
+                    dead.add(worker)
+                    continue
+                try:
+                    # đọc hết kết quả đang có trước khi xử lý worker chết
+                    while worker.conn.poll():
+                        task_id, ok, value = worker.conn.recv()
+                        if ok:
+                            self._finish(task_id, result=value)
+                        else:
+                            self._finish(task_id, exception=RuntimeError(value))
+                except (EOFError, OSError):
+                    dead.add(worker)
+            for worker in dead:
+                self._replace(worker)
+            self._expire()
+
+    def metrics(self) -> dict:
+        stats = super().metrics()
+        with self._futures_lock:
+            in_flight = len(self._futures)
+        stats["processes"] = {
+            "count": self.processes,
+            "threads_per_process": self.threads_per_process,
+            "alive": sum(w.proc.is_alive() for w in self._workers),
+            "in_flight": in_flight,
+            "respawns": self._respawns,
+            "timeouts": self._timeouts,
+        }
+        return stats
+
+    def shutdown(self, wait: bool = True) -> None:
+        super().shutdown(wait=wait)
+        self._closing = True
+        self._respawn.put(None)
+        for worker in self._workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for worker in self._workers:
+            worker.proc.join(timeout=5 if wait else 0)
+        self._reader.join(timeout=2)
+        for worker in self._workers:
+            worker.conn.close()
+
+
+def _pss_mb(pid: int) -> float:
+    """Proportional set size: trang shared memory được chia đều cho các process dùng chung."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return 0.0
+
+
+def benchmark(process_counts: list, requests: int = 200, seconds: float = 3.0,
+              threads_per_process: int = 1) -> None:
+    """Mỗi request = 1 score AASIST + 1 embedding ECAPA trên waveform ngẫu nhiên."""
+    from infer import AntiSpoofing
+    from speechbrain.inference.speaker import EncoderClassifier
+
+    torch.set_num_threads(1)
+    detector = AntiSpoofing(config_path="./config/AASIST.conf",
+                            weights_path="./models/weights/AASIST.pth", device="cpu")
+    classifier = EncoderClassifier.from_hparams(source="speechbrain/spkrec-ecapa-voxceleb",
+                                                savedir="pretrained_models/spkrec-ecapa")
+    wav = (np.random.default_rng(0).standard_normal(int(seconds * 16000)) * 0.1).astype(np.float32)
+    base = None
+    for n in process_counts:
+        pool = ProcessInferencePool(detector, classifier, processes=n,
+                                    threads_per_process=threads_per_process,
+                                    max_queue=requests)
+        # 1 vòng làm nóng cho mọi worker
+        wait([pool.call("score", wav) for _ in range(n)] + [pool.call("embed", wav[None]) for _ in range(n)])
+        t0 = time.perf_counter()
+        futures = []
+        for _ in range(requests):
+            futures.append(pool.call("score", wav))
+            futures.append(pool.call("embed", wav[None]))
+        wait(futures)
+        rps = requests / (time.perf_counter() - t0)
+        base = base or rps
+        pss = _pss_mb(os.getpid()) + sum(_pss_mb(w.proc.pid) for w in pool._workers)
+        print(f"processes={n:<3} {rps:8.1f} req/s  speedup x{rps / base:5.2f}  total PSS {pss:8.1f} MB")
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-fork inference scaling benchmark")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--threads-per-process", type=int, default=1)
+    args = parser.parse_args()
+    benchmark(args.processes, args.requests, args.seconds, args.threads_per_process)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+In-process result broker.
+
+process_voice_in_thread publish kết quả theo (call_id, user_id); verify_voice của
+đối phương đang chờ trên đúng key đó sẽ được đánh thức ngay, không cần poll SQLite.
+Chờ được cả từ thread (wait) lẫn từ coroutine asyncio (wait_async, không chiếm thread).
+"""
+import asyncio
+import threading
+import time
+
+
+class _Slot:
+    __slots__ = ("event", "result", "created_at", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.created_at = time.monotonic()
+        self.waiters = []  # [(event loop, asyncio.Future)]
+
+
+class ResultBroker:
+    """
+    - publish(call_id, user_id, result): lưu kết quả và đánh thức mọi luồng đang chờ key đó
+    - wait(call_id, user_id, timeout): chờ kết quả, trả về dict hoặc None nếu hết thời gian
+    - wait_async(...): như wait nhưng là coroutine
+    Các slot cũ hơn ttl giây được dọn dẹp để bộ nhớ không tăng mãi.
+    """
+    def __init__(self, ttl: float = 120.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._last_prune = time.monotonic()
+
+    def _slot(self, call_id, user_id) -> _Slot:
+        key = (int(call_id), str(user_id))
+        with self._lock:
+            self._prune_locked()
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = _Slot()
+            return slot
+
+    def _prune_locked(self) -> None:
+        now = time.monotonic()
+        if now - self._last_prune < self.ttl / 4:
+            return
+        self._last_prune = now
+        expired = [k for k, s in self._slots.items() if now - s.created_at > self.ttl]
+        for key in expired:
+            del self._slots[key]
+
+    def publish(self, call_id, user_id, result: dict) -> None:
+        slot = self._slot(call_id, user_id)
+        with self._lock:
+            slot.result = result
+            slot.event.set()
+            waiters, slot.waiters = slot.waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, result)
+
+    def wait(self, call_id, user_id, timeout: float):
+        slot = self._slot(call_id, user_id)
+        if slot.event.wait(timeout):
+            return slot.result
+        return None
+
+    async def wait_async(self, call_id, user_id, timeout: float):
+        slot = self._slot(call_id, user_id)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if slot.event.is_set():
+                return slot.result
+            slot.waiters.append((loop, future))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._lock:
+                if (loop, future) in slot.waiters:
+                    slot.waiters.remove((loop, future))
+
+
+def _resolve(future, result) -> None:
+    if not future.done():
+        future.set_result(result)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Cache kết quả xác thực theo fingerprint của PCM đã giải mã.
+
+Client retry /verify-voice khi timeout, hoặc cùng 1 bản ghi được phát lại: PCM 16 kHz sau
+giải mã giống hệt nhau nên hash trùng, score AASIST + embedding ECAPA được dùng lại thay
+vì chạy lại 2 model.
+
+Ngoài ra ghi nhận fingerprint theo từng call_id: cùng 1 đoạn audio xuất hiện từ user khác
+trong cùng cuộc gọi là dấu hiệu replay attack.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# chi phí ước lượng của 1 entry ngoài phần embedding (key, tuple, float, str...)
+ENTRY_OVERHEAD = 256
+
+
+def fingerprint(wav: np.ndarray) -> bytes:
+    """Hash nội dung PCM (float32, 16 kHz) — dùng làm key cache."""
+    return hashlib.blake2b(np.ascontiguousarray(wav, dtype=np.float32).tobytes(),
+                           digest_size=16).digest()
+
+
+class CachedResult:
+    __slots__ = ("score", "label", "embedding", "created_at", "nbytes")
+
+    def __init__(self, score, label, embedding):
+        self.score = score
+        self.label = label
+        self.embedding = embedding
+        self.created_at = time.monotonic()
+        self.nbytes = ENTRY_OVERHEAD + (embedding.nbytes if embedding is not None else 0)
+
+
+class VerificationCache:
+    """
+    - get(key) / put(key, score, label, embedding): LRU, entry hết hạn sau ttl giây
+    - giới hạn cả số entry (max_entries) lẫn bộ nhớ ước lượng (max_bytes)
+    - note_call(call_id, user_id, key): user khác trong cùng call đã gửi đúng audio này chưa
+    """
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._calls = OrderedDict()  # call_id -> (created_at, {key: user_id})
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._evictions = 0
+        self._replays = 0
+
+    def get(self, key: bytes):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.created_at > self.ttl:
+                self._drop_locked(key)
+                self._expired += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry
+
+    def put(self, key: bytes, score, label, embedding) -> None:
+        entry = CachedResult(score, label, embedding)
+        with self._lock:
+            if key in self._entries:
+                self._drop_locked(key)
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop_locked(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _drop_locked(self, key: bytes) -> None:
+        self._bytes -= self._entries.pop(key).nbytes
+
+    def note_call(self, call_id, user_id, key: bytes):
+        """Ghi nhận audio của user trong call; trả về user_id khác đã gửi cùng audio (hoặc None)."""
+        now = time.monotonic()
+        with self._lock:
+            while self._calls:
+                oldest = next(iter(self._calls.values()))
+                if now - oldest[0] <= self.ttl:
+                    break
+                self._calls.popitem(last=False)
+            slot = self._calls.get(call_id)
+            if slot is None:
+                slot = self._calls[call_id] = (now, {})
+            seen = slot[1]
+            first = seen.setdefault(key, user_id)
+            if first != user_id:
+                self._replays += 1
+                return first
+            return None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "expired": self._expired,
+                "evictions": self._evictions,
+                "replays": self._replays,
+                "calls_tracked": len(self._calls),
+            }
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Resident speaker index.
+
+Toàn bộ embedding đã enroll nằm trong 1 ma trận float32 liên tục, đã chuẩn hóa L2,
+nên tìm kiếm chỉ là 1 phép nhân ma trận-vector thay vì vòng lặp cosine trên từng dòng DB.
+
+Mỗi dòng có thể kèm cohort stats (mean, std) của user cho AS-norm, tính sẵn lúc enroll
+(xem enrollment.py); search_asnorm dùng chính vector similarity của lần search làm cohort
+phía probe nên không tốn thêm phép nhân nào.
+"""
+import os
+import threading
+
+import numpy as np
+
+
+def normalize(embedding: np.ndarray) -> np.ndarray:
+    """Trả về vector float32 1D đã chuẩn hóa L2."""
+    emb = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(emb)
+    if norm == 0:
+        return emb
+    return emb / norm
+
+
+class SpeakerIndex:
+    """
+    Exact (brute force) cosine index:
+    - add(user_id, name, phone, embedding): thêm hoặc thay thế embedding của user
+    - remove(user_id)
+    - search(embedding, k): trả về k kết quả gần nhất [(user_id, name, phone, distance)]
+      với distance = cosine distance (1 - cosine similarity), giống scipy.spatial.distance.cosine
+    - set_norm_stats / cohort_stats / search_asnorm: score normalization (AS-norm)
+    """
+    kind = "exact"
+
+    def __init__(self, dim: int = 192, capacity: int = 1024):
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._norm = np.zeros((capacity, 2), dtype=np.float32)  # (mean, std); std=0: chưa có
+        self._ids = []
+        self._meta = []
+        self._pos = {}
+        self.version = 0  # tăng mỗi lần index thay đổi (để biết khi nào cần lưu lại)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _grow(self, needed: int) -> None:
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:len(self._ids)] = self._matrix[:len(self._ids)]
+        self._matrix = matrix
+        norm = np.zeros((capacity, 2), dtype=np.float32)
+        norm[:len(self._ids)] = self._norm[:len(self._ids)]
+        self._norm = norm
+
+    def add(self, user_id: str, name: str, phone: str, embedding: np.ndarray) -> None:
+        emb = normalize(embedding)
+        if emb.shape[0] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d embedding, got {emb.shape[0]}")
+        with self._lock:
+            pos = self._pos.get(user_id)
+            if pos is None:
+                pos = len(self._ids)
+                self._grow(pos + 1)
+                self._ids.append(user_id)
+                self._meta.append((name, phone))
+                self._pos[user_id] = pos
+            else:
+                self._meta[pos] = (name, phone)
+            self._matrix[pos] = emb
+            self._norm[pos] = 0.0  # embedding đổi thì stats cũ không còn đúng
+            self.version += 1
+            self._on_add(pos)
+
+    def remove(self, user_id: str) -> bool:
+        """Xóa user, dòng cuối được chuyển vào chỗ trống để ma trận luôn liên tục."""
+        with self._lock:
+            pos = self._pos.pop(user_id, None)
+            if pos is None:
+                return False
+            last = len(self._ids) - 1
+            if pos != last:
+                self._matrix[pos] = self._matrix[last]
+                self._norm[pos] = self._norm[last]
+                self._ids[pos] = self._ids[last]
+                self._meta[pos] = self._meta[last]
+                self._pos[self._ids[pos]] = pos
+            self._norm[last] = 0.0
+            self._on_move(last, pos)
+            self._ids.pop()
+            self._meta.pop()
+            self.version += 1
+            return True
+
+    def set_norm_stats(self, user_id: str, mean: float, std: float) -> bool:
+        with self._lock:
+            pos = self._pos.get(user_id)
+            if pos is None:
+                return False
+            self._norm[pos] = (mean, std)
+            self.version += 1
+            return True
+
+    def norm_stats(self, user_id: str):
+        """(mean, std) của user, None nếu chưa tính."""
+        with self._lock:
+            pos = self._pos.get(user_id)
+            if pos is None or self._norm[pos, 1] <= 0:
+                return None
+            return float(self._norm[pos, 0]), float(self._norm[pos, 1])
+
+    def cohort_stats(self, user_id: str, cohort_k: int = 200):
+        """
+        Mean/std của cohort_k similarity lớn nhất giữa embedding của user và các user
+        còn lại (cohort = toàn bộ người đã enroll). None nếu chưa đủ người.
+        """
+        with self._lock:
+            pos = self._pos.get(user_id)
+            if pos is None:
+                return None
+            return self.embedding_cohort_stats(self._matrix[pos], user_id, cohort_k)
+
+    def embedding_cohort_stats(self, embedding: np.ndarray, user_id: str = None,
+                               cohort_k: int = 200):
+        """
+        Như cohort_stats nhưng cho 1 embedding chưa nằm trong index (ví dụ centroid mới
+        trước khi ghi DB); dòng hiện tại của user_id (nếu có) không tính vào cohort.
+        """
+        emb = normalize(embedding)
+        with self._lock:
+            n = len(self._ids)
+            pos = self._pos.get(user_id)
+            if n - (pos is not None) < 2:
+                return None
+            sims = self._matrix[:n] @ emb
+            if pos is not None:
+                sims[pos] = -np.inf
+            return _top_stats(sims, cohort_k)
+
+    def all_cohort_stats(self, cohort_k: int = 200, chunk: int = 32) -> list:
+        """
+        [(user_id, mean, std)] cho mọi user, nhân ma trận theo khối chunk dòng
+        (bộ nhớ tạm chunk x N float32: 128 MB với 1 triệu user).
+        """
+        with self._lock:
+            n = len(self._ids)
+            if n < 3:
+                return []
+            matrix = self._matrix[:n]
+            out = []
+            for start in range(0, n, chunk):
+                sims = matrix[start:start + chunk] @ matrix.T
+                for i, row in enumerate(sims):
+                    row[start + i] = -np.inf
+                    mean, std = _top_stats(row, cohort_k)
+                    self._norm[start + i] = (mean, std)
+                    out.append((self._ids[start + i], mean, std))
+            self.version += 1
+            return out
+
+    def _on_add(self, pos: int) -> None:
+        """Hook cho index con khi dòng pos được thêm/cập nhật."""
+
+    def _on_move(self, src: int, dst: int) -> None:
+        """Hook cho index con khi dòng src được chuyển sang dst."""
+
+    def _candidates(self, probe: np.ndarray):
+        """Các dòng cần so sánh với probe; None = toàn bộ (exact search)."""
+        return None
+
+    def _scores(self, probe: np.ndarray):
+        """(rows, sims) của probe với các dòng cần so sánh; (None, None) nếu không có."""
+        n = len(self._ids)
+        if n == 0:
+            return None, None
+        rows = self._candidates(probe)
+        if rows is None:
+            return None, self._matrix[:n] @ probe
+        if len(rows) == 0:
+            return None, None
+        return rows, self._matrix[rows] @ probe
+
+    @staticmethod
+    def _top(sims: np.ndarray, k: int) -> np.ndarray:
+        k = min(k, sims.shape[0])
+        top = np.argpartition(-sims, k - 1)[:k]
+        return top[np.argsort(-sims[top])]
+
+    def search(self, embedding: np.ndarray, k: int = 1) -> list:
+        probe = normalize(embedding)
+        with self._lock:
+            rows, sims = self._scores(probe)
+            if sims is None:
+                return []
+            results = []
+            for i in self._top(sims, k):
+                pos = i if rows is None else rows[i]
+                name, phone = self._meta[pos]
+                results.append((self._ids[pos], name, phone, float(1.0 - sims[i])))
+            return results
+
+    def search_asnorm(self, embedding: np.ndarray, k: int = 1, cohort_k: int = 200) -> list:
+        """
+        Như search nhưng kèm score AS-norm:
+            0.5 * ((s - mean_user) / std_user + (s - mean_probe) / std_probe)
+        mean/std_probe lấy từ cohort_k similarity lớn nhất của chính lần search (trừ ứng
+        viên đang chấm). User chưa có stats chỉ được chuẩn hóa phía probe.
+        Trả về [(user_id, name, phone, distance, asnorm_score)], sắp theo distance.
+        """
+        probe = normalize(embedding)
+        with self._lock:
+            rows, sims = self._scores(probe)
+            if sims is None or sims.shape[0] < 2:
+                return []
+            top = self._top(sims, k)
+            # cohort phía probe: top cohort_k + 1 để còn đủ cohort_k sau khi bỏ ứng viên
+            cohort = self._top(sims, cohort_k + 1)
+            results = []
+            for i in top:
+                pos = i if rows is None else rows[i]
+                s = float(sims[i])
+                others = cohort[cohort != i][:cohort_k]
+                mean_t, std_t = _top_stats(sims[others], cohort_k)
+                score = (s - mean_t) / std_t
+                mean_e, std_e = self._norm[pos]
+                if std_e > 0:
+                    score = 0.5 * (score + (s - mean_e) / std_e)
+                name, phone = self._meta[pos]
+                results.append((self._ids[pos], name, phone, 1.0 - s, float(score)))
+            return results
+
+    def load_rows(self, rows) -> None:
+        """Nạp từ các dòng (user_id, name, phone, embedding_blob) đọc ra từ SQLite."""
+        for user_id, name, phone, emb_blob in rows:
+            self.add(user_id, name, phone, np.frombuffer(emb_blob, dtype=np.float32))
+
+    def _state(self) -> dict:
+        n = len(self._ids)
+        return {
+            "kind": np.array(self.kind),
+            "embeddings": self._matrix[:n].copy(),
+            "ids": np.array(self._ids, dtype=object),
+            "names": np.array([m[0] for m in self._meta], dtype=object),
+            "phones": np.array([m[1] for m in self._meta], dtype=object),
+            "norm_stats": self._norm[:n].copy(),
+        }
+
+    def _restore(self, state) -> None:
+        for user_id, name, phone, emb in zip(state["ids"], state["names"],
+                                             state["phones"], state["embeddings"]):
+            self.add(str(user_id), name, phone, emb)
+        if "norm_stats" in state:  # file lưu trước khi có AS-norm không có mục này
+            self._norm[:len(self._ids)] = state["norm_stats"]
+
+    def save(self, path: str) -> int:
+        """
+        Lưu toàn bộ index ra file .npz (ghi file tạm rồi rename, không bao giờ để lại file
+        ghi dở). Trả về version đã lưu.
+        """
+        with self._lock:
+            state = self._state()
+            version = self.version
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **state)
+        os.replace(tmp, path)
+        return version
+
+
+def _top_stats(sims: np.ndarray, k: int):
+    """(mean, std) của k giá trị lớn nhất trong sims (bỏ qua -inf)."""
+    sims = sims[np.isfinite(sims)]
+    if sims.shape[0] > k:
+        sims = np.partition(sims, sims.shape[0] - k)[-k:]
+    if sims.shape[0] == 0:
+        return 0.0, 1.0
+    return float(sims.mean()), float(max(sims.std(), 1e-3))
+
+
+def load_index(path: str, **kwargs) -> SpeakerIndex:
+    """Đọc index đã lưu bằng save(), tự chọn đúng loại index."""
+    state = np.load(path, allow_pickle=True)
+    index = make_speaker_index(str(state["kind"]), dim=state["embeddings"].shape[1], **kwargs)
+    index._restore(state)
+    return index
+
+
+def make_speaker_index(kind: str = "exact", **kwargs) -> SpeakerIndex:
+    """
+    - exact: brute force, recall 100%
+    - ivf: IVF-flat (ann_index.IVFFlatIndex), dùng cho hàng triệu embedding
+    """
+    if kind == "exact":
+        return SpeakerIndex(**kwargs)
+    if kind == "ivf":
+        from ann_index import IVFFlatIndex
+        return IVFFlatIndex(**kwargs)
+    raise ValueError(f"Unknown speaker index kind: {kind}")
@@ -0,0 +1,45 @@
+import numpy as np
+
+import bulk_embed
+import db
+from enrollment import EnrollmentStore
+from speaker_index import make_speaker_index
+
+
+def make_pool(tmp_path):
+    pool = db.ConnectionPool(str(tmp_path / "voice.db"))
+    with pool.connection() as conn:
+        db.create_tables(conn)
+        db.migrate(conn)
+        conn.execute(db.SQL_INSERT_USER, ("u1", "0901", "h", "User 1", "u1.wav", "2024-01-01"))
+        conn.execute(bulk_embed.SQL_CREATE_STAGING)
+        conn.commit()
+    return pool
+
+
+def test_finalize_then_enroll_keeps_registration_utterance(tmp_path):
+    pool = make_pool(tmp_path)
+    rng = np.random.default_rng(0)
+    registered = rng.standard_normal(192).astype(np.float32)
+    with pool.connection() as conn:
+        conn.execute(bulk_embed.SQL_STAGE, ("job", "u1.wav", "u1", registered.tobytes(), None))
+        for i in range(3):
+            conn.execute(bulk_embed.SQL_STAGE, ("job", f"u1_{i}.wav", "u1",
+                                                rng.standard_normal(192).astype(np.float32).tobytes(), None))
+        conn.commit()
+
+    assert bulk_embed.finalize(pool, "job", max_utterances=3) == 1
+
+    index = make_speaker_index("exact")
+    with pool.connection() as conn:
+        index.load_rows(conn.execute(db.SQL_ALL_EMBEDDINGS).fetchall())
+    store = EnrollmentStore(pool, index, max_utterances=3)
+    for _ in range(5):
+        store.enroll("u1", [rng.standard_normal(192)], source="verified")
+
+    with pool.connection() as conn:
+        rows = conn.execute(db.SQL_USER_ENROLLMENTS, ("u1",)).fetchall()
+    kept = [np.frombuffer(r[1], dtype=np.float32) for r in rows if r[2] == "register"]
+    assert len(rows) == 3
+    assert len(kept) == 1
+    np.testing.assert_allclose(kept[0], registered / np.linalg.norm(registered), rtol=1e-6)
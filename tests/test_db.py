@@ -0,0 +1,21 @@
+import sqlite3
+
+import pytest
+
+import db
+
+
+def test_failed_migration_leaves_no_partial_schema(tmp_path, monkeypatch):
+    conn = sqlite3.connect(str(tmp_path / "voice.db"))
+    db.create_tables(conn)
+    broken = db.MIGRATIONS[:1] + (db.MIGRATIONS[1][:5] + ("SELECT missing_column",),)
+    monkeypatch.setattr(db, "MIGRATIONS", broken)
+    with pytest.raises(sqlite3.OperationalError):
+        db.migrate(conn)
+    columns = [r[1] for r in conn.execute("PRAGMA table_info(speaker_embeddings)")]
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 1
+    assert "n_utterances" not in columns
+
+    monkeypatch.undo()
+    db.migrate(conn)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(db.MIGRATIONS)
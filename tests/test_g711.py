@@ -0,0 +1,29 @@
+import warnings
+
+import numpy as np
+import pytest
+
+import g711
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    audioop = pytest.importorskip("audioop")
+
+PCM = np.arange(-32768, 32768, dtype=np.int16)
+
+
+@pytest.mark.parametrize("encode, reference", [
+    (g711.encode_ulaw, audioop.lin2ulaw),
+    (g711.encode_alaw, audioop.lin2alaw),
+])
+def test_encoder_matches_audioop(encode, reference):
+    assert encode(PCM) == reference(PCM.tobytes(), 2)
+
+
+@pytest.mark.parametrize("encode, table", [
+    (g711.encode_ulaw, g711.ULAW_TO_INT16),
+    (g711.encode_alaw, g711.ALAW_TO_INT16),
+])
+def test_decoded_levels_round_trip(encode, table):
+    codes = np.frombuffer(encode(table), dtype=np.uint8)
+    np.testing.assert_array_equal(table[codes], table)
@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import media_ingest
+
+
+class FakeScorer:
+    def __init__(self):
+        self.decision = None
+
+    def feed(self, pcm):
+        self.decision = "genuine"
+        return [{"window": 0, "score": 0.9, "mean": 0.9, "decision": self.decision}]
+
+    def finish(self):
+        return {"score": 0.9, "label": self.decision, "windows": 1, "final": True}
+
+
+def test_leg_result_published_once_with_speaker():
+    published = []
+    executor = ThreadPoolExecutor(max_workers=1)
+    session = media_ingest.LegSession(
+        "leg-1", FakeScorer(), executor,
+        on_event=media_ingest.result_events(lambda *args: published.append(args)),
+        speaker_fn=lambda clip: ("u1", "User 1", "1001"), embed_seconds=0.5, sample_rate=8000)
+    session.source = "127.0.0.1:5004"
+    session.push(np.zeros(2000, dtype=np.float32))
+    session.push(np.zeros(4000, dtype=np.float32))
+    session.close()
+    executor.shutdown(wait=True)
+
+    assert published == [(["leg-1", "127.0.0.1:5004"], "genuine", ("u1", "User 1", "1001"))]
@@ -3,7 +3,8 @@ import numpy as np
 import sounddevice as sd
 from scipy.io.wavfile import write
 from speechbrain.inference.speaker import EncoderClassifier
-import torchaudio
+import audio_pipeline
+from enrollment import centroid
 from scipy.spatial.distance import cosine
 
 import sys
@@ -22,6 +23,7 @@ def delete_user(name: str):
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     c.execute("DELETE FROM speakers WHERE name = ?", (name,))
+    c.execute("DELETE FROM speaker_utterances WHERE name = ?", (name,))
     changes = conn.total_changes
     conn.commit()
     conn.close()
@@ -60,17 +62,25 @@ def authenticate_speaker(threshold: float = 0.7):
 
 
 def enroll_speaker(duration=15.0):
+    """
+    Ghi nhiều câu nói, mỗi câu 1 embedding; speakers.embedding là centroid của tất cả
+    câu đã ghi. Enroll lại cùng tên thì bổ sung thêm câu nói thay vì ghi đè.
+    """
     name = input("Nhập tên người dùng để enroll: ").strip()
-    wav_file = f"{name}.wav"
-    record_audio(wav_file, duration)
-    emb = get_embedding(wav_file)
-    save_embedding(name, emb)
-    print(f"Đã enroll `{name}` thành công.")
+    count = input("Số câu nói cần ghi [3]: ").strip()
+    count = int(count) if count.isdigit() and int(count) > 0 else 3
+    for i in range(count):
+        input(f"Câu {i + 1}/{count}: nhấn Enter rồi bắt đầu nói...")
+        wav_file = f"{name}_{i + 1}.wav"
+        record_audio(wav_file, duration)
+        add_utterance(name, get_embedding(wav_file))
+    n = save_embedding(name)
+    print(f"Đã enroll `{name}` thành công ({n} câu nói).")
 
 
 def get_embedding(wav_path: str):
-    signal, fs = torchaudio.load(wav_path)
-    embeddings = classifier.encode_batch(signal)  # [1,1,192]
+    clip = audio_pipeline.load(wav_path)  # mono 16 kHz
+    embeddings = classifier.encode_batch(clip.encoder_input)  # [1,1,192]
     emb = embeddings.squeeze().detach().cpu().numpy().astype(np.float32)
     return emb
 
@@ -97,19 +107,43 @@ def init_db():
             embedding BLOB
         )
     """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS speaker_utterances (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            embedding BLOB NOT NULL
+        )
+    """)
+    # embedding 1 câu nói của các user enroll trước đây là câu nói đầu tiên
+    c.execute("""
+        INSERT INTO speaker_utterances (name, embedding)
+        SELECT name, embedding FROM speakers
+        WHERE name NOT IN (SELECT name FROM speaker_utterances)
+    """)
     conn.commit()
     conn.close()
 
-def save_embedding(name: str, embedding: np.ndarray):
+def add_utterance(name: str, embedding: np.ndarray):
     conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # Chuyển numpy array thành BLOB
-    emb_blob = embedding.tobytes()
-    c.execute("INSERT OR REPLACE INTO speakers (name, embedding) VALUES (?, ?)",
-              (name, emb_blob))
+    conn.execute("INSERT INTO speaker_utterances (name, embedding) VALUES (?, ?)",
+                 (name, embedding.astype(np.float32).tobytes()))
     conn.commit()
     conn.close()
 
+def save_embedding(name: str) -> int:
+    """Tính lại centroid từ các câu nói của user và lưu vào speakers; trả về số câu nói"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    rows = c.execute("SELECT embedding FROM speaker_utterances WHERE name = ?", (name,)).fetchall()
+    if rows:
+        # Chuyển numpy array thành BLOB
+        emb_blob = centroid([np.frombuffer(r[0], dtype=np.float32) for r in rows]).tobytes()
+        c.execute("INSERT OR REPLACE INTO speakers (name, embedding) VALUES (?, ?)",
+                  (name, emb_blob))
+        conn.commit()
+    conn.close()
+    return len(rows)
+
 def load_all_embeddings():
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
@@ -0,0 +1,629 @@
+#!/usr/bin/env python3
+"""
+Logic dùng chung của API xác thực giọng nói.
+
+Model, pool inference, DB, call registry, broker... được khởi tạo 1 lần ở đây và dùng
+chung cho 2 front-end:
+- asgi_server.py: Starlette/uvicorn, chờ kết quả đối phương bằng coroutine (production)
+- http_server.py: Flask, giữ lại để tương thích
+Các hàm nghiệp vụ raise ApiError; mỗi front-end tự chuyển thành HTTP response.
+
+Model (torch, speechbrain) không được nạp khi import module. MODEL_LOADING:
+- lazy (mặc định): nạp ở request đầu tiên cần inference (hoặc gọi /warmup)
+- background: bắt đầu nạp trong thread riêng ngay khi khởi động
+- eager: nạp xong rồi mới nhận request (như trước đây)
+- off: process chỉ phục vụ API nhẹ (/login, /status, /save-call-status), không bao giờ nạp torch
+INFERENCE_PROCESSES=N: inference chạy ở N worker process fork từ process này, dùng chung
+weight qua shared memory (prefork_pool.py); nên dùng cùng MODEL_LOADING=eager.
+"""
+import queue
+import sqlite3
+import uuid
+import hashlib
+import os
+from concurrent.futures import Future
+from datetime import datetime
+import sip_user_manager
+import numpy as np
+import audio_pipeline
+from inference_pool import InferencePool, PoolSaturated
+from result_broker import ResultBroker
+from result_cache import VerificationCache, fingerprint
+from call_registry import CallRegistry
+from db_writer import BatchWriter
+from speaker_index import load_index, make_speaker_index
+from enrollment import EnrollmentStore
+import db
+import time
+import threading
+import atexit
+
+DB_FILE = db.DB_FILE
+AUDIO_DIR = "user_voices"
+ARCHIVE_AFTER_DAYS = float(os.environ.get("CALL_ARCHIVE_AFTER_DAYS", 1))
+ARCHIVE_INTERVAL = float(os.environ.get("CALL_ARCHIVE_INTERVAL", 3600))
+VERIFY_TIMEOUT = float(os.environ.get("VERIFY_TIMEOUT", 15))
+MODEL_LOADING = os.environ.get("MODEL_LOADING", "lazy")
+os.makedirs(AUDIO_DIR, exist_ok=True)
+
+
+class ApiError(Exception):
+    """Lỗi nghiệp vụ kèm HTTP status; payload dạng {"success": False, "error": ...}."""
+    def __init__(self, error, status, headers=None):
+        super().__init__(error)
+        self.error = error
+        self.status = status
+        self.headers = headers or {}
+
+    @property
+    def payload(self):
+        return {"success": False, "error": self.error}
+
+
+
+# Kết nối SQLite được tái sử dụng giữa các request
+db_pool = db.get_pool(DB_FILE)
+
+# Kết quả xác thực được chuyển thẳng tới request của đối phương qua broker
+result_broker = ResultBroker()
+
+# Score + embedding theo fingerprint PCM: request retry / audio phát lại không chạy lại model
+verification_cache = VerificationCache(
+    max_entries=int(os.environ.get("RESULT_CACHE_ENTRIES", 10000)),
+    max_bytes=int(float(os.environ.get("RESULT_CACHE_MB", 64)) * 1024 * 1024),
+    ttl=float(os.environ.get("RESULT_CACHE_TTL", 600))
+)
+
+
+def init_db():
+    with db_pool.connection() as conn:
+        db.create_tables(conn)
+
+        # Index, bảng active_calls, bảng lưu trữ cuộc gọi cũ
+        db.migrate(conn)
+        archived = db.archive_finished_calls(conn, ARCHIVE_AFTER_DAYS)
+        if archived:
+            print(f"Đã chuyển {archived} cuộc gọi cũ sang call_status_archive")
+
+init_db()
+
+def archive_loop():
+    """Định kỳ chuyển cuộc gọi đã kết thúc ra khỏi call_status để bảng luôn nhỏ"""
+    while True:
+        time.sleep(ARCHIVE_INTERVAL)
+        try:
+            with db_pool.connection() as conn:
+                db.archive_finished_calls(conn, ARCHIVE_AFTER_DAYS)
+        except Exception as e:
+            print(f"Lỗi khi lưu trữ cuộc gọi cũ: {e}")
+
+threading.Thread(target=archive_loop, name="call-archiver", daemon=True).start()
+
+# 1 thread ghi duy nhất: kết quả xác thực và trạng thái cuộc gọi được gộp thành lô
+db_writer = BatchWriter(
+    db_pool,
+    flush_interval=float(os.environ.get("DB_FLUSH_INTERVAL", 0.05)),
+    max_batch=int(os.environ.get("DB_WRITE_BATCH", 1000)),
+    durability=os.environ.get("DB_DURABILITY", "normal")
+)
+atexit.register(db_writer.close)
+
+# Trạng thái cuộc gọi thường trú trong RAM
+call_registry = CallRegistry(db_pool, db_writer)
+
+# Index centroid giọng nói thường trú trong RAM, cập nhật mỗi khi save_embedding
+# SPEAKER_INDEX=exact (mặc định) hoặc ivf (ANN cho hàng triệu người dùng)
+SPEAKER_INDEX_PATH = os.environ.get("SPEAKER_INDEX_PATH")
+if SPEAKER_INDEX_PATH and os.path.exists(SPEAKER_INDEX_PATH):
+    speaker_index = load_index(SPEAKER_INDEX_PATH)
+else:
+    speaker_index = make_speaker_index(os.environ.get("SPEAKER_INDEX", "exact"))
+
+# Nhiều embedding cho mỗi user; index chỉ giữ centroid + cohort stats (AS-norm)
+enrollment = EnrollmentStore(
+    db_pool, speaker_index,
+    max_utterances=int(os.environ.get("ENROLL_MAX_UTTERANCES", 20)),
+    cohort_k=int(os.environ.get("ASNORM_COHORT", 200))
+)
+# Ngưỡng cosine distance tới centroid để nhận diện người nói
+SPEAKER_THRESHOLD = float(os.environ.get("SPEAKER_THRESHOLD", 0.7))
+# SPEAKER_ASNORM=1: quyết định identify theo score AS-norm thay vì cosine distance
+SPEAKER_ASNORM = os.environ.get("SPEAKER_ASNORM", "0") == "1"
+ASNORM_THRESHOLD = float(os.environ.get("ASNORM_THRESHOLD", 3.0))
+# Audio đã xác thực (genuine, đúng người, distance < ENROLL_ADAPT_DISTANCE) được thêm vào enrollment
+ENROLL_ADAPT = os.environ.get("ENROLL_ADAPT", "1") == "1"
+ENROLL_ADAPT_DISTANCE = float(os.environ.get("ENROLL_ADAPT_DISTANCE", 0.3))
+# Ghi DB + cập nhật index + cohort stats chạy trên 1 thread nền, không trên thread inference;
+# hàng đợi đầy thì bỏ qua (adaptation chỉ là tối ưu, không bắt buộc)
+adapt_queue = queue.Queue(maxsize=int(os.environ.get("ENROLL_ADAPT_QUEUE", 1000)))
+
+def adapt_loop():
+    while True:
+        user_id, embedding = adapt_queue.get()
+        save_embedding(user_id, embedding, source="verified")
+
+if ENROLL_ADAPT:
+    threading.Thread(target=adapt_loop, name="enroll-adapt", daemon=True).start()
+
+def load_speaker_index():
+    """Đồng bộ index với DB; centroid IVF đã lưu được giữ lại nên không phải train lại."""
+    with db_pool.connection() as conn:
+        speaker_index.load_rows(conn.execute(db.SQL_ALL_EMBEDDINGS).fetchall())
+    enrollment.load_norm_stats()
+    print(f"Đã nạp {len(speaker_index)} embedding vào speaker index")
+    save_speaker_index()
+
+# Index được lưu lại định kỳ khi có thay đổi (enroll, adaptation, IVF train lại),
+# không chỉ lúc khởi động
+SPEAKER_INDEX_SAVE_INTERVAL = float(os.environ.get("SPEAKER_INDEX_SAVE_INTERVAL", 60))
+_saved_index_version = None
+
+def save_speaker_index():
+    global _saved_index_version
+    if not SPEAKER_INDEX_PATH or speaker_index.version == _saved_index_version:
+        return
+    try:
+        _saved_index_version = speaker_index.save(SPEAKER_INDEX_PATH)
+    except Exception as e:
+        print(f"Lỗi khi lưu speaker index: {e}")
+
+def index_save_loop():
+    while True:
+        time.sleep(SPEAKER_INDEX_SAVE_INTERVAL)
+        save_speaker_index()
+
+if SPEAKER_INDEX_PATH:
+    threading.Thread(target=index_save_loop, name="index-saver", daemon=True).start()
+    atexit.register(save_speaker_index)
+
+# Model và pool inference: chỉ được tạo khi lần đầu cần tới
+_inference_pool = None
+_models_lock = threading.Lock()
+_models_load_ms = None
+
+def _load_models():
+    # import nặng (torch, speechbrain) chỉ xảy ra ở đây
+    from infer import AntiSpoofing, BatchingAntiSpoofing
+    from speechbrain.inference.speaker import EncoderClassifier
+
+    processes = int(os.environ.get("INFERENCE_PROCESSES", 0))
+    if processes:
+        # process cha không chạy forward pass; OpenMP chỉ khởi tạo ở các worker
+        import torch
+        torch.set_num_threads(1)
+
+    antispoofing = AntiSpoofing(
+        config_path="./config/AASIST.conf",
+        weights_path="./models/weights/AASIST.pth",
+        device="cpu",
+        compiled_path=os.environ.get("AASIST_COMPILED")  # graph đã export, xem export_model.py
+    )
+
+    speaker_classifier = EncoderClassifier.from_hparams(
+        source="speechbrain/spkrec-ecapa-voxceleb",
+        savedir="pretrained_models/spkrec-ecapa"
+    )
+
+    load_speaker_index()
+
+    if processes:
+        # Pre-fork: weight ở shared memory, mỗi worker process có số thread cố định
+        from prefork_pool import ProcessInferencePool
+        return ProcessInferencePool(
+            antispoofing,
+            speaker_classifier,
+            processes=processes,
+            threads_per_process=int(os.environ.get("INFERENCE_THREADS_PER_PROCESS", 1)),
+            pin_cpus=os.environ.get("INFERENCE_PIN_CPUS", "0") == "1",
+            max_queue=int(os.environ.get("INFERENCE_MAX_QUEUE", 16)),
+            max_batch_size=int(os.environ.get("AASIST_MAX_BATCH", 8))
+        )
+
+    # Gộp các request đồng thời thành 1 forward pass
+    detector = BatchingAntiSpoofing(
+        antispoofing,
+        max_batch_size=int(os.environ.get("AASIST_MAX_BATCH", 8)),
+        max_wait_ms=float(os.environ.get("AASIST_MAX_WAIT_MS", 10))
+    )
+
+    # Số task inference chạy đồng thời / chờ trong hàng đợi là cố định
+    return InferencePool(
+        detector,
+        speaker_classifier,
+        workers=int(os.environ.get("INFERENCE_WORKERS", 2)),
+        max_queue=int(os.environ.get("INFERENCE_MAX_QUEUE", 16)),
+        torch_threads=int(os.environ.get("INFERENCE_TORCH_THREADS", 0)) or None
+    )
+
+def get_inference_pool():
+    """Pool inference (nạp model ở lần gọi đầu tiên); ApiError 503 ở chế độ API-only"""
+    global _inference_pool, _models_load_ms
+    if _inference_pool is not None:
+        return _inference_pool
+    if MODEL_LOADING == "off":
+        raise ApiError("Server đang chạy ở chế độ API-only, không xử lý giọng nói", 503)
+    with _models_lock:
+        if _inference_pool is None:
+            started = time.perf_counter()
+            _inference_pool = _load_models()
+            _models_load_ms = (time.perf_counter() - started) * 1000.0
+            print(f"Đã nạp model trong {_models_load_ms:.0f} ms")
+    return _inference_pool
+
+def warmup():
+    """Nạp model và chạy thử 1 lần để request thật đầu tiên không phải chờ"""
+    pool = get_inference_pool()
+    started = time.perf_counter()
+    silence = audio_pipeline.AudioClip(np.zeros(audio_pipeline.TARGET_SR, dtype=np.float32),
+                                       audio_pipeline.TARGET_SR)
+    pool.detector.predict_clip(silence)
+    pool.speaker_classifier.encode_batch(silence.encoder_input)
+    return {
+        "load_ms": round(_models_load_ms or 0.0, 1),
+        "warmup_ms": round((time.perf_counter() - started) * 1000.0, 1)
+    }
+
+if MODEL_LOADING == "eager":
+    get_inference_pool()
+elif MODEL_LOADING == "background":
+    threading.Thread(target=get_inference_pool, name="model-loader", daemon=True).start()
+
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def deepfake_detect(clip):
+    """{'score', 'label'} của AASIST; label='error' nếu không chạy được"""
+    try:
+        res = get_inference_pool().detector.predict_clip(clip)
+        print(f"score={res['score']:.4f}, label={res['label']}")
+        return res
+    except Exception as e:
+        print("Cannot deepfake detect:", e)
+        return {"score": None, "label": "error"}
+
+def get_embedding(clip):
+    """Trích xuất embedding từ AudioClip (mono 16 kHz) đã giải mã"""
+    try:
+        embeddings = get_inference_pool().speaker_classifier.encode_batch(clip.encoder_input)
+        emb = embeddings.squeeze().detach().cpu().numpy().astype(np.float32)
+        
+        # Check vector 1D
+        if emb.ndim > 1:
+            emb = emb.flatten()
+            
+        return emb
+    except Exception as e:
+        print(f"Error extracting embedding: {e}")
+        return None
+
+def save_embedding(user_id, embeddings, source="register"):
+    """Thêm 1 hoặc nhiều embedding của user, cập nhật centroid trong DB và index"""
+    if embeddings is None:
+        return False
+    if isinstance(embeddings, np.ndarray):
+        embeddings = [embeddings]
+
+    try:
+        return enrollment.enroll(user_id, embeddings, source) > 0
+    except Exception as e:
+        print(f"Error saving embedding: {e}")
+        return False
+
+def find_speaker(embedding):
+    """(user_id, name, phone, distance) gần nhất nếu vượt ngưỡng quyết định, ngược lại None"""
+    if SPEAKER_ASNORM:
+        matches = speaker_index.search_asnorm(embedding, k=1, cohort_k=enrollment.cohort_k)
+        if matches and matches[0][4] >= ASNORM_THRESHOLD:
+            return matches[0][:4]
+        return None
+
+    matches = speaker_index.search(embedding, k=1)
+    if matches and matches[0][3] < SPEAKER_THRESHOLD:
+        return matches[0]
+    return None
+
+def identify_speaker(embedding):
+    """Xác định người nói từ embedding"""
+    if embedding is None:
+        return None
+        
+    try:
+        match = find_speaker(embedding)
+        return match[:3] if match else None
+    except Exception as e:
+        print(f"Error identifying speaker: {e}")
+        return None
+
+# Hàm xử lý giọng nói trong luồng riêng
+def analyze_clip(clip, key, cached=None, check_cache=True):
+    """
+    (label, embedding, fresh) của clip; dùng lại kết quả nếu PCM này đã được chấm điểm
+    (fresh=False). check_cache=False khi người gọi đã tra cache và miss (không đếm 2 lần).
+    """
+    if cached is None and check_cache:
+        cached = verification_cache.get(key)
+    if cached is not None:
+        return cached.label, cached.embedding, False
+
+    # 1. Kiểm tra deepfake
+    res = deepfake_detect(clip)
+
+    # 2. Embedding người nói (dùng chung audio đã giải mã)
+    embedding = get_embedding(clip)
+
+    if res["label"] != "error" and embedding is not None:
+        verification_cache.put(key, res["score"], res["label"], embedding)
+    return res["label"], embedding, True
+
+def process_voice_in_thread(clip, user_id, call_id, opponent_id, key=None, cached=None,
+                            check_cache=True):
+    try:
+        key = key or fingerprint(clip.wav)
+        replay_of = verification_cache.note_call(call_id, user_id, key)
+        if replay_of is not None:
+            print(f"Cảnh báo replay: audio của user {user_id} trùng audio của {replay_of} trong call {call_id}")
+
+        label, current_emb, fresh = analyze_clip(clip, key, cached, check_cache)
+        match = find_speaker(current_emb) if current_emb is not None else None
+        
+        speaker_id = match[0] if match else None
+
+        # 3-4. Báo kết quả cho đối phương đang chờ + lưu DB
+        publish_result(call_id, user_id, opponent_id, label, match, replay_of is not None)
+
+        # 5. Cập nhật enrollment bằng audio đã xác thực chắc chắn (không phải audio lặp lại)
+        if (ENROLL_ADAPT and fresh and replay_of is None and label == "genuine"
+                and speaker_id == user_id and match[3] < ENROLL_ADAPT_DISTANCE):
+            try:
+                adapt_queue.put_nowait((user_id, current_emb))
+            except queue.Full:
+                print(f"Hàng đợi adaptation đầy, bỏ qua embedding của user {user_id}")
+    except Exception as e:
+        print(f"Lỗi khi xử lý giọng nói: {str(e)}")
+
+def publish_result(call_id, user_id, opponent_id, label, speaker=None, replay=False):
+    """Báo kết quả ngay cho request đang chờ của đối phương, rồi lưu DB (writer gộp theo lô)"""
+    speaker_id, speaker_name, speaker_phone = speaker[:3] if speaker else (None, None, None)
+    result_broker.publish(call_id, user_id, {
+        "label": label,
+        "speaker_id": speaker_id,
+        "speaker_name": speaker_name,
+        "speaker_phone": speaker_phone,
+        "replay": replay
+    })
+    db_writer.submit(db.SQL_INSERT_RESULT,
+        (call_id, user_id, opponent_id, label, speaker_id, speaker_name, speaker_phone))
+    print(f"Đã xếp lưu kết quả cho user {user_id}: {label}")
+
+def publish_media_result(media_keys, label, speaker=None):
+    """
+    Kết quả của 1 leg audio trực tiếp (media_ingest.py), đi cùng đường với /verify-voice.
+    media_keys: các khóa của leg (UUID AudioSocket, SSRC / địa chỉ nguồn RTP); leg được
+    gắn với số điện thoại bằng sự kiện status=media (xem update_call_status).
+    """
+    phone = next((p for p in map(call_registry.media_phone, media_keys) if p), None)
+    user_id = call_registry.user_of(phone) if phone else None
+    if not user_id:
+        print(f"Leg {media_keys} chưa được gắn với người dùng nào, bỏ qua kết quả {label}")
+        return False
+    try:
+        call_id, opponent_id = resolve_call(user_id)
+    except ApiError as e:
+        print(f"Leg {media_keys} của user {user_id}: {e.error}")
+        return False
+    publish_result(call_id, user_id, opponent_id, label, speaker)
+    return True
+
+def fetch_stored_result(call_id, user_id):
+    """Đọc kết quả đã lưu trong DB (khi broker không có, ví dụ sau khi restart)"""
+    with db_pool.connection() as conn:
+        row = conn.execute(db.SQL_SELECT_RESULT, (call_id, user_id)).fetchone()
+
+    if not row:
+        return None
+    label, speaker_id, speaker_name, speaker_phone = row
+    return {
+        "label": label,
+        "speaker_id": speaker_id,
+        "speaker_name": speaker_name,
+        "speaker_phone": speaker_phone
+    }
+
+
+def _voice_list(data):
+    """bytes hoặc list bytes (nhiều file 'voice') → list bytes không rỗng"""
+    if isinstance(data, (bytes, bytearray)):
+        data = [data]
+    return [d for d in (data or []) if d]
+
+def _store_voices(user_id, datas, primary=True):
+    """
+    Lưu file gốc để lưu trữ (gọi sau khi DB đã commit, lỗi 409/500 không để lại file
+    mồ côi). Bản ghi lúc đăng ký (primary) là {user_id}.wav, các bản bổ sung
+    {user_id}_<ngẫu nhiên>.wav
+    """
+    for i, d in enumerate(datas):
+        if primary and i == 0:
+            filename = f"{user_id}.wav"
+        else:
+            filename = f"{user_id}_{uuid.uuid4().hex[:8]}.wav"
+        with open(os.path.join(AUDIO_DIR, filename), "wb") as f:
+            f.write(d)
+
+def register_user(phone, password, fullname, data):
+    """
+    Tạo user mới từ form đăng ký + bytes file giọng nói (1 hoặc nhiều bản ghi),
+    trả về user_id
+    """
+    datas = _voice_list(data)
+    if not all([phone, password, fullname, datas]):
+        raise ApiError("Thiếu thông tin", 400)
+
+    # Cần model để trích embedding; báo lỗi trước khi tạo user
+    get_inference_pool()
+
+    user_id = str(uuid.uuid4())
+    filename = f"{user_id}.wav"
+    clips = [decode_voice(d) for d in datas]
+
+    try:
+        with db_pool.connection() as conn:
+            conn.execute(db.SQL_INSERT_USER,
+                (user_id, phone, hash_password(password), fullname, filename, datetime.now().isoformat()))
+            conn.commit()
+        call_registry.remember_user(user_id, phone)
+        
+        # Trích xuất embedding từng bản ghi, lưu kèm centroid
+        save_embedding(user_id, [get_embedding(clip) for clip in clips])
+        _store_voices(user_id, datas)
+
+        sip_user_manager.add_user(phone, password)
+        return user_id
+    except sqlite3.IntegrityError:
+        raise ApiError("Số điện thoại đã tồn tại", 409)
+    except Exception as e:
+        print(f"Lỗi khi đăng ký: {str(e)}")
+        raise ApiError("Lỗi hệ thống", 500)
+
+def enroll_voice(phone, password, data):
+    """
+    Bổ sung bản ghi giọng nói cho user đã đăng ký, trả về số bản ghi đang dùng.
+    Xác thực bằng số điện thoại + mật khẩu như /login: chỉ biết user_id thì không
+    thêm được giọng vào voiceprint của người khác.
+    """
+    datas = _voice_list(data)
+    if not phone or not password or not datas:
+        raise ApiError("Thiếu thông tin", 400)
+    user_id = login_user(phone, password)["user_id"]
+
+    get_inference_pool()
+    embeddings = [get_embedding(decode_voice(d)) for d in datas]
+    if any(emb is None for emb in embeddings):
+        raise ApiError("Lỗi hệ thống", 500)
+    count = enrollment.enroll(user_id, embeddings, source="enroll")
+    _store_voices(user_id, datas, primary=False)
+    return count
+
+def login_user(phone, password):
+    if not phone or not password:
+        raise ApiError("Thiếu thông tin", 400)
+
+    with db_pool.connection() as conn:
+        user = conn.execute(db.SQL_USER_LOGIN, (phone,)).fetchone()
+
+    if user and hash_password(password) == user[1]:
+        return {
+            "success": True,
+            "user_id": user[0],
+            "fullname": user[2]
+        }
+    raise ApiError("Sai số điện thoại hoặc mật khẩu", 401)
+
+def update_call_status(caller, callee, status):
+    """status=media: callee là khóa leg audio trực tiếp của số caller (media_ingest.py)"""
+    if status == "media":
+        return call_registry.bind_media(callee, caller)
+    if status == "calling":
+        return call_registry.start(caller, callee)
+    return call_registry.end(caller, status)
+
+async def update_call_status_async(caller, callee, status):
+    """Như update_call_status, gọi trên event loop (asgi_server, FastAGI)"""
+    if status == "media":
+        return call_registry.bind_media(callee, caller)
+    if status == "calling":
+        return await call_registry.start_async(caller, callee)
+    return call_registry.end(caller, status)
+
+def resolve_call(user_id):
+    """(call_id, opponent_id) của cuộc gọi user đang tham gia, tra trong call registry"""
+    user_phone = call_registry.phone_of(user_id)
+
+    if not user_phone:
+        raise ApiError("Người dùng không tồn tại", 404)
+
+    call_info = call_registry.find(user_phone)
+
+    if not call_info:
+        raise ApiError("Không tìm thấy cuộc gọi đang hoạt động", 404)
+
+    call_id, opponent_phone = call_info
+
+    opponent_id = call_registry.user_of(opponent_phone)
+
+    if not opponent_id:
+        raise ApiError("Không tìm thấy đối phương", 404)
+
+    return call_id, opponent_id
+
+def decode_voice(data):
+    """Giải mã 1 lần trong bộ nhớ, dùng chung cho AASIST và ECAPA"""
+    try:
+        return audio_pipeline.load(data)
+    except Exception as e:
+        print(f"Không giải mã được file giọng nói: {e}")
+        raise ApiError("File giọng nói không hợp lệ", 400)
+
+def submit_verification(clip, user_id, call_id, opponent_id):
+    """
+    Đưa vào pool inference, từ chối khi pool đã đầy. Audio đã có trong verification_cache
+    (request retry) chỉ cần tra speaker index nên xử lý ngay, không chiếm slot của pool.
+    """
+    key = fingerprint(clip.wav)
+    cached = verification_cache.get(key)
+    if cached is not None:
+        process_voice_in_thread(clip, user_id, call_id, opponent_id, key, cached)
+        done = Future()
+        done.set_result(None)
+        return done
+    pool = get_inference_pool()
+    try:
+        # submit_verification đã tra cache (miss): worker không tra lại
+        return pool.submit(process_voice_in_thread, clip, user_id, call_id, opponent_id, key,
+                           check_cache=False)
+    except PoolSaturated:
+        raise ApiError("Server đang quá tải, vui lòng thử lại", 503,
+                       {"Retry-After": str(pool.retry_after)})
+
+def verification_response(result):
+    """Kết quả của đối phương → (payload, status)"""
+    if result:
+        response = {
+            "success": True,
+            "label": result["label"]
+        }
+
+        if result.get("replay"):
+            response["replay"] = True
+
+        if result["speaker_id"]:
+            response["speaker"] = {
+                "id": result["speaker_id"],
+                "name": result["speaker_name"],
+                "phone": result["speaker_phone"]
+            }
+
+        return response, 200
+    
+    return {
+        "success": False,
+        "error": "Timeout: Không nhận được kết quả từ đối phương"
+    }, 408
+
+def user_status(user_id):
+    phone = call_registry.phone_of(user_id)
+    
+    if not phone:
+        raise ApiError("User not found", 404)
+    
+    return "calling" if call_registry.find(phone) else "idle"
+
+def metrics():
+    return {
+        "models": {"mode": MODEL_LOADING, "loaded": _inference_pool is not None,
+                   "load_ms": _models_load_ms},
+        "inference": _inference_pool.metrics() if _inference_pool is not None else None,
+        "calls": call_registry.metrics(),
+        "db_writer": db_writer.metrics(),
+        "result_cache": verification_cache.metrics()
+    }
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Nạp checkpoint AASIST không copy (memory-mapped).
+
+- .safetensors: file phẳng (header JSON + dữ liệu raw liền nhau, cùng layout với
+  safetensors) được mmap; mỗi tensor là 1 view vào vùng map, parameter của model trỏ
+  thẳng vào page cache nên nạp gần như tức thì và các worker process dùng chung page
+- .pth: torch.load(..., mmap=True) với checkpoint định dạng zip, lùi về torch.load thường
+  với định dạng cũ
+
+Chuyển .pth sang file phẳng:
+    python weights.py convert models/weights/AASIST.pth models/weights/AASIST.safetensors
+    python weights.py bench models/weights/AASIST.pth models/weights/AASIST.safetensors
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+from collections import OrderedDict
+
+import torch
+
+FLAT_EXTENSION = ".safetensors"
+
+DTYPES = {
+    torch.float32: "F32", torch.float16: "F16", torch.bfloat16: "BF16", torch.float64: "F64",
+    torch.int64: "I64", torch.int32: "I32", torch.int16: "I16", torch.int8: "I8",
+    torch.uint8: "U8", torch.bool: "BOOL",
+}
+DTYPES_BY_NAME = {name: dtype for dtype, name in DTYPES.items()}
+
+
+def save_flat(state: dict, path: str, metadata: dict = None) -> None:
+    """Ghi state_dict thành file phẳng; tensor lớn phần tử (8 byte) xếp trước để luôn thẳng hàng."""
+    tensors = [(name, t.detach().cpu().contiguous()) for name, t in state.items()]
+    tensors.sort(key=lambda item: (-item[1].element_size(), item[0]))
+    header = {"__metadata__": {k: str(v) for k, v in (metadata or {}).items()}}
+    offset = 0
+    for name, t in tensors:
+        size = t.numel() * t.element_size()
+        header[name] = {"dtype": DTYPES[t.dtype], "shape": list(t.shape),
+                        "data_offsets": [offset, offset + size]}
+        offset += size
+    raw = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    raw += b" " * (-(8 + len(raw)) % 8)  # dữ liệu bắt đầu ở offset chia hết cho 8
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(struct.pack("<Q", len(raw)))
+        f.write(raw)
+        for _, t in tensors:
+            f.write(t.view(torch.uint8).reshape(-1).numpy().tobytes() if t.numel() else b"")
+    os.replace(tmp, path)
+
+
+def load_flat(path: str) -> "OrderedDict[str, torch.Tensor]":
+    """mmap file phẳng, trả về state_dict gồm các tensor view (không copy dữ liệu)."""
+    with open(path, "rb") as f:
+        # ACCESS_COPY: ghi vào tensor (nếu có) chỉ tạo page riêng, không sửa file
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    header_len = struct.unpack("<Q", buf[:8])[0]
+    header = json.loads(buf[8:8 + header_len])
+    start = 8 + header_len
+    state = OrderedDict()
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = DTYPES_BY_NAME[info["dtype"]]
+        begin, end = info["data_offsets"]
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            tensor = torch.empty(0, dtype=dtype)
+        else:
+            tensor = torch.frombuffer(buf, dtype=dtype, count=count, offset=start + begin)
+        state[name] = tensor.reshape(info["shape"])
+    return state
+
+
+def resolve(path: str) -> str:
+    """Ưu tiên file .safetensors cùng tên nếu đã được convert và mới hơn file .pth."""
+    if path.endswith(FLAT_EXTENSION):
+        return path
+    flat = os.path.splitext(path)[0] + FLAT_EXTENSION
+    if os.path.isfile(flat) and (not os.path.isfile(path) or os.path.getmtime(flat) >= os.path.getmtime(path)):
+        return flat
+    return path
+
+
+def load_state_dict(path: str, device: torch.device = torch.device("cpu")) -> dict:
+    path = resolve(path)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Cannot find weights at {path}")
+    if path.endswith(FLAT_EXTENSION):
+        state = load_flat(path)
+        if torch.device(device).type != "cpu":
+            state = OrderedDict((k, v.to(device)) for k, v in state.items())
+        return state
+    try:
+        return torch.load(path, map_location=device, mmap=True, weights_only=True)
+    except (RuntimeError, TypeError, ValueError):
+        # checkpoint định dạng cũ (không phải zip) không mmap được
+        return torch.load(path, map_location=device)
+
+
+def load_into(model: torch.nn.Module, path: str, device: torch.device = torch.device("cpu")) -> None:
+    """
+    Nạp weight vào model. Trên CPU dùng assign=True: parameter dùng luôn tensor đã mmap
+    thay vì copy sang bộ nhớ riêng của model.
+    """
+    state = load_state_dict(path, device)
+    model.load_state_dict(state, assign=torch.device(device).type == "cpu")
+
+
+def convert(src: str, dst: str) -> None:
+    state = torch.load(src, map_location="cpu")
+    if isinstance(state, dict) and "state_dict" in state and isinstance(state["state_dict"], dict):
+        state = state["state_dict"]
+    save_flat(state, dst, metadata={"source": os.path.basename(src)})
+    print(f"{src} → {dst}: {len(state)} tensor, {os.path.getsize(dst) / 1e6:.1f} MB")
+
+
+def bench(paths: list, repeat: int = 5) -> None:
+    for path in paths:
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            state = load_state_dict(path)
+            times.append((time.perf_counter() - t0) * 1000.0)
+            del state
+        times.sort()
+        print(f"{path}: median {times[len(times) // 2]:8.2f} ms   min {times[0]:8.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory-mapped checkpoint tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("convert", help=".pth → flat memory-mappable file")
+    p.add_argument("src")
+    p.add_argument("dst", nargs="?")
+    p = sub.add_parser("bench", help="time state dict loading")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    if args.cmd == "convert":
+        convert(args.src, args.dst or os.path.splitext(args.src)[0] + FLAT_EXTENSION)
+    else:
+        bench(args.paths, args.repeat)